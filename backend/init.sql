@@ -34,6 +34,20 @@ EXCEPTION
     WHEN duplicate_object THEN null;
 END $$;
 
+-- ============================================================================
+-- TABLE: routes
+-- ============================================================================
+-- Immutable binary route encodings (see backend/utils/route_storage.py),
+-- content-addressed so repeat uploads of the same file share one row
+CREATE TABLE IF NOT EXISTS routes (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    data BYTEA NOT NULL,
+    point_count INTEGER,
+    content_hash VARCHAR UNIQUE,
+    track_metadata JSON,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- ============================================================================
 -- TABLE: events
 -- ============================================================================
@@ -46,6 +60,9 @@ CREATE TABLE IF NOT EXISTS events (
     elevation_gain_adjustment_percent FLOAT DEFAULT 0,
     elevation_descent_adjustment_percent FLOAT DEFAULT 0,
     fatigue_slowdown_percent FLOAT DEFAULT 0,
+    grade_adjusted_pace BOOLEAN DEFAULT FALSE,
+    route_id UUID REFERENCES routes(id) ON DELETE SET NULL,
+    actual_route_id UUID REFERENCES routes(id) ON DELETE SET NULL,
     gpx_route JSON,
     gpx_metadata JSON,
     actual_gpx_data JSON,
@@ -54,6 +71,10 @@ CREATE TABLE IF NOT EXISTS events (
     updated_at TIMESTAMP WITH TIME ZONE
 );
 
+-- Keyset pagination (newest first) and planned date range filters
+CREATE INDEX IF NOT EXISTS idx_events_created_at_id ON events(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_events_planned_date ON events(planned_date);
+
 -- ============================================================================
 -- TABLE: waypoints
 -- ============================================================================
@@ -69,6 +90,8 @@ CREATE TABLE IF NOT EXISTS waypoints (
     comments TEXT,
     order_index INTEGER,
     distance_from_start FLOAT,
+    route_position FLOAT,
+    snapped_route_id UUID,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -87,6 +110,7 @@ CREATE TABLE IF NOT EXISTS calculated_legs (
     leg_distance FLOAT,
     elevation_gain FLOAT,
     elevation_loss FLOAT,
+    grade_adjusted_distance FLOAT,
     base_pace FLOAT,
     adjusted_pace FLOAT,
     expected_arrival_time TIMESTAMP,
@@ -94,7 +118,8 @@ CREATE TABLE IF NOT EXISTS calculated_legs (
     exit_time TIMESTAMP,
     cumulative_distance FLOAT,
     cumulative_time_minutes INTEGER,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    CONSTRAINT uq_calculated_legs_event_leg UNIQUE (event_id, leg_number)
 );
 
 CREATE INDEX IF NOT EXISTS idx_calculated_legs_event_id ON calculated_legs(event_id);
@@ -112,6 +137,8 @@ CREATE TABLE IF NOT EXISTS documents (
     uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+CREATE INDEX IF NOT EXISTS idx_documents_uploaded_at_id ON documents(uploaded_at DESC, id DESC);
+
 -- ============================================================================
 -- TABLE: document_chunks
 -- ============================================================================
@@ -121,6 +148,8 @@ CREATE TABLE IF NOT EXISTS document_chunks (
     chunk_index INTEGER NOT NULL,
     chunk_text TEXT,
     chunk_with_summary TEXT,
+    start_offset INTEGER,
+    end_offset INTEGER,
     embedding VECTOR(1536),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -128,6 +157,20 @@ CREATE TABLE IF NOT EXISTS document_chunks (
 CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id ON document_chunks(document_id);
 CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding ON document_chunks USING ivfflat (embedding vector_cosine_ops);
 
+-- ============================================================================
+-- TABLE: embedding_cache
+-- ============================================================================
+-- Embeddings keyed by sha256 of the embedded text, so unchanged chunks and
+-- repeated chat queries are not sent to the embeddings API again
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    text_hash VARCHAR(64) NOT NULL,
+    model VARCHAR NOT NULL,
+    dimensions INTEGER NOT NULL,
+    embedding VECTOR NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (text_hash, model, dimensions)
+);
+
 -- ============================================================================
 -- TABLE: user_settings
 -- ============================================================================
@@ -157,6 +200,9 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
 
 CREATE INDEX IF NOT EXISTS idx_chat_sessions_event_id ON chat_sessions(event_id);
 CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions(updated_at DESC);
+-- Keyset pagination: sessions by latest activity, overall and per event
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_activity ON chat_sessions((COALESCE(updated_at, created_at)) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_event_activity ON chat_sessions(event_id, (COALESCE(updated_at, created_at)) DESC, id DESC);
 
 -- ============================================================================
 -- TABLE: chat_messages
@@ -173,6 +219,34 @@ CREATE TABLE IF NOT EXISTS chat_messages (
 CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id);
 CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at ON chat_messages(created_at);
 
+-- ============================================================================
+-- TABLE: ingest_jobs
+-- ============================================================================
+-- Background GPX/TCX ingestion queue (claimed with FOR UPDATE SKIP LOCKED)
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    event_id UUID NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    kind VARCHAR NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'pending',
+    stage VARCHAR DEFAULT 'queued',
+    progress_percent INTEGER DEFAULT 0,
+    filename VARCHAR,
+    file_path VARCHAR,
+    content_hash VARCHAR NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    result JSON,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- One active job per identical upload (re-uploads coalesce onto it)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_ingest_jobs_active_upload ON ingest_jobs(event_id, kind, content_hash)
+    WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_claim ON ingest_jobs(status, created_at);
+
 -- ============================================================================
 -- MIGRATIONS FOR EXISTING DATABASES
 -- ============================================================================
@@ -191,6 +265,84 @@ EXCEPTION
     WHEN duplicate_column THEN null;
 END $$;
 
+-- Add binary route references to events if they don't exist
+-- (JSON coordinates are moved into routes by the backend on startup)
+DO $$ BEGIN
+    ALTER TABLE events ADD COLUMN route_id UUID REFERENCES routes(id) ON DELETE SET NULL;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+DO $$ BEGIN
+    ALTER TABLE events ADD COLUMN actual_route_id UUID REFERENCES routes(id) ON DELETE SET NULL;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+-- Add cached snap positions to waypoints if they don't exist (NULL = snap on next calculation)
+DO $$ BEGIN
+    ALTER TABLE waypoints ADD COLUMN route_position FLOAT;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+DO $$ BEGIN
+    ALTER TABLE waypoints ADD COLUMN snapped_route_id UUID;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+-- One row per (event, leg number), the target of incremental leg upserts
+DO $$ BEGIN
+    ALTER TABLE calculated_legs ADD CONSTRAINT uq_calculated_legs_event_leg UNIQUE (event_id, leg_number);
+EXCEPTION
+    WHEN duplicate_table OR duplicate_object THEN null;
+    WHEN unique_violation THEN
+        RAISE NOTICE 'Duplicate calculated legs found - recalculate affected events, then rerun this script';
+END $$;
+
+-- Add content addressing to routes if it doesn't exist (legacy rows keep a NULL hash)
+DO $$ BEGIN
+    ALTER TABLE routes ADD COLUMN content_hash VARCHAR UNIQUE;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+DO $$ BEGIN
+    ALTER TABLE routes ADD COLUMN track_metadata JSON;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+-- Add the grade-adjusted pace model option if it doesn't exist
+DO $$ BEGIN
+    ALTER TABLE events ADD COLUMN grade_adjusted_pace BOOLEAN DEFAULT FALSE;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+DO $$ BEGIN
+    ALTER TABLE calculated_legs ADD COLUMN grade_adjusted_distance FLOAT;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+-- Store document chunks as character spans of documents.content
+-- (uncompressed TOAST storage lets substr() read a span without decompressing the whole document)
+ALTER TABLE documents ALTER COLUMN content SET STORAGE EXTERNAL;
+
+DO $$ BEGIN
+    ALTER TABLE document_chunks ADD COLUMN start_offset INTEGER;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
+DO $$ BEGIN
+    ALTER TABLE document_chunks ADD COLUMN end_offset INTEGER;
+EXCEPTION
+    WHEN duplicate_column THEN null;
+END $$;
+
 -- Update existing embedding columns to correct dimension (1536 for OpenAI text-embedding-3-small)
 -- Note: This will fail if embeddings already exist with wrong dimension - manual migration required
 DO $$ BEGIN
@@ -203,15 +355,18 @@ END $$;
 -- ============================================================================
 -- SUMMARY
 -- ============================================================================
--- Tables created/verified: 8
---   1. events
---   2. waypoints
---   3. calculated_legs
---   4. documents
---   5. document_chunks
---   6. user_settings
---   7. chat_sessions
---   8. chat_messages
+-- Tables created/verified: 11
+--   1. routes
+--   2. events
+--   3. waypoints
+--   4. calculated_legs
+--   5. documents
+--   6. document_chunks
+--   7. user_settings
+--   8. chat_sessions
+--   9. chat_messages
+--  10. ingest_jobs
+--  11. embedding_cache
 --
 -- Enum types: 3
 --   1. waypoint_type (checkpoint, food, water, rest)
@@ -222,6 +377,6 @@ END $$;
 --   1. vector (PGVector for embeddings)
 --   2. uuid-ossp (UUID generation)
 --
--- Indexes: 10 (for performance)
--- Foreign keys: 8 (for referential integrity)
+-- Indexes: 17 (for performance, keyset pagination and job claiming)
+-- Foreign keys: 11 (for referential integrity)
 -- ============================================================================
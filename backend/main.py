@@ -1,15 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database import init_db
-from routes import events, waypoints, calculations, documents, settings, chat
+from database import init_db, migrate_legacy_routes, dispose_engines
+from utils.executor import start_process_pool, shutdown_process_pool, PoolSaturatedError
+from utils.job_queue import start_ingest_workers, stop_ingest_workers
+from utils.embeddings import close_embedding_clients
+from utils.chunking import warm_tokenizer
+from routes import events, waypoints, calculations, documents, settings, chat, jobs
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     init_db()
+    migrate_legacy_routes()
+    warm_tokenizer()
+    start_process_pool(initializer=warm_tokenizer)
+    start_ingest_workers()
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await stop_ingest_workers()
+    shutdown_process_pool()
+    await close_embedding_clients()
+    await dispose_engines()
 
 app = FastAPI(
     title="Ultra Running Planner API",
@@ -25,8 +38,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # keyset pagination cursor on list endpoints
 )
 
+@app.exception_handler(PoolSaturatedError)
+async def pool_saturated_handler(request: Request, exc: PoolSaturatedError):
+    """Backpressure: ask clients to retry when the CPU pool backlog is full"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Include routers
 app.include_router(events.router, prefix="/api/events", tags=["events"])
 app.include_router(waypoints.router, prefix="/api/waypoints", tags=["waypoints"])
@@ -34,6 +57,7 @@ app.include_router(calculations.router, prefix="/api/calculations", tags=["calcu
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(settings.router, prefix="/api/settings", tags=["settings"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["jobs"])
 
 @app.get("/")
 async def root():
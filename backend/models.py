@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Text, JSON, Enum, Boolean
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Text, JSON, Enum, Boolean, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred, column_property
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
 import uuid
@@ -21,6 +21,20 @@ class ElevationUnit(str, enum.Enum):
     meters = "meters"
     feet = "feet"
 
+# Deferred column group for bulky Event route/track JSON; load it with
+# .options(undefer_group(ROUTE_DATA_GROUP)) in routes that need it
+ROUTE_DATA_GROUP = "route_data"
+
+class Route(Base):
+    __tablename__ = "routes"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    data = Column(LargeBinary, nullable=False)  # columnar encoding, see utils/route_storage.py
+    point_count = Column(Integer)
+    content_hash = Column(String, unique=True)  # upload hash + parse settings (utils.route_storage.route_content_key)
+    track_metadata = Column(JSON)  # parse results (distance, elevation, timestamps) reused by repeat uploads
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Event(Base):
     __tablename__ = "events"
     
@@ -32,14 +46,19 @@ class Event(Base):
     elevation_gain_adjustment_percent = Column(Float, default=0)
     elevation_descent_adjustment_percent = Column(Float, default=0)
     fatigue_slowdown_percent = Column(Float, default=0)
-    gpx_route = Column(JSON)  # optimized storage of coordinates
+    grade_adjusted_pace = Column(Boolean, default=False)  # weight legs by local grade instead of gain/loss totals
+    route_id = Column(UUID(as_uuid=True), ForeignKey("routes.id", ondelete="SET NULL"))  # planned route
+    actual_route_id = Column(UUID(as_uuid=True), ForeignKey("routes.id", ondelete="SET NULL"))  # recorded track
+    gpx_route = deferred(Column(JSON), group=ROUTE_DATA_GROUP)  # legacy JSON coordinates (migrated to routes on startup)
     gpx_metadata = Column(JSON)  # elevation, total distance, etc.
-    actual_gpx_data = Column(JSON)  # post-race actual route
-    actual_tcx_data = Column(JSON)  # alternative format
+    actual_gpx_data = deferred(Column(JSON), group=ROUTE_DATA_GROUP)  # post-race actual route metadata
+    actual_tcx_data = deferred(Column(JSON), group=ROUTE_DATA_GROUP)  # alternative format
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationships
+    route = relationship("Route", foreign_keys=[route_id])
+    actual_route = relationship("Route", foreign_keys=[actual_route_id])
     waypoints = relationship("Waypoint", back_populates="event", cascade="all, delete-orphan")
     calculated_legs = relationship("CalculatedLeg", back_populates="event", cascade="all, delete-orphan")
 
@@ -57,6 +76,8 @@ class Waypoint(Base):
     comments = Column(Text)
     order_index = Column(Integer)  # sequence along route
     distance_from_start = Column(Float)  # cumulative distance
+    route_position = Column(Float)  # snapped fractional vertex index (None = needs snapping)
+    snapped_route_id = Column(UUID(as_uuid=True))  # route the position was snapped to
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
@@ -64,6 +85,9 @@ class Waypoint(Base):
 
 class CalculatedLeg(Base):
     __tablename__ = "calculated_legs"
+    __table_args__ = (
+        UniqueConstraint("event_id", "leg_number", name="uq_calculated_legs_event_leg"),  # upsert target
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     event_id = Column(UUID(as_uuid=True), ForeignKey("events.id", ondelete="CASCADE"), nullable=False)
@@ -73,6 +97,7 @@ class CalculatedLeg(Base):
     leg_distance = Column(Float)
     elevation_gain = Column(Float)
     elevation_loss = Column(Float)
+    grade_adjusted_distance = Column(Float)  # flat-equivalent meters (grade-adjusted pace model only)
     base_pace = Column(Float)  # minutes per distance unit
     adjusted_pace = Column(Float)  # with elevation/fatigue
     expected_arrival_time = Column(DateTime)
@@ -104,14 +129,26 @@ class DocumentChunk(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
-    chunk_text = Column(Text)
-    chunk_with_summary = Column(Text)  # chunk + document summary
+    chunk_text = Column(Text)  # legacy rows only; new chunks are spans of documents.content
+    chunk_with_summary = Column(Text)  # legacy rows only (chunk + document summary)
+    start_offset = Column(Integer)  # character span of the chunk in documents.content
+    end_offset = Column(Integer)
     embedding = Column(Vector(1536))  # PGVector embedding (OpenAI text-embedding-3-small dimension)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     document = relationship("Document", back_populates="chunks")
 
+class EmbeddingCache(Base):
+    """Content-addressed embeddings: one row per (text, model, dimensions), shared by documents and chat queries"""
+    __tablename__ = "embedding_cache"
+    
+    text_hash = Column(String(64), primary_key=True)  # sha256 of the embedded text
+    model = Column(String, primary_key=True)
+    dimensions = Column(Integer, primary_key=True)
+    embedding = Column(Vector(), nullable=False)  # undimensioned: the dimension is part of the key
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class UserSettings(Base):
     __tablename__ = "user_settings"
     
@@ -134,6 +171,7 @@ class ChatSession(Base):
     title = Column(String)  # auto-generated from first message
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    last_activity_at = column_property(func.coalesce(updated_at, created_at))  # list sort key (indexed)
     
     # Relationships
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan", order_by="ChatMessage.created_at")
@@ -151,3 +189,33 @@ class ChatMessage(Base):
     # Relationships
     session = relationship("ChatSession", back_populates="messages")
 
+
+# Ingest jobs in these states are coalesced by (event_id, kind, content_hash)
+ACTIVE_JOB_STATUSES = ("pending", "running")
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    __table_args__ = (
+        Index(
+            "uq_ingest_jobs_active_upload", "event_id", "kind", "content_hash",
+            unique=True, postgresql_where=Column("status").in_(ACTIVE_JOB_STATUSES)
+        ),
+        Index("idx_ingest_jobs_claim", "status", "created_at"),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    event_id = Column(UUID(as_uuid=True), ForeignKey("events.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False)  # 'planned' or 'actual'
+    status = Column(String, nullable=False, default="pending")  # pending, running, completed, failed
+    stage = Column(String, default="queued")  # queued, parsing, saving, done
+    progress_percent = Column(Integer, default=0)
+    filename = Column(String)
+    file_path = Column(String)  # spooled upload, removed once processed
+    content_hash = Column(String, nullable=False)  # sha256 of the upload, for coalescing
+    attempts = Column(Integer, default=0)
+    result = Column(JSON)  # upload response (message + metadata) when completed
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,20 +1,102 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer_group
+from typing import List, Optional, Set
 from uuid import UUID
-from database import get_db
-from models import Event, Waypoint, CalculatedLeg
-from schemas import CalculatedLegResponse
-from utils.gpx_processor import find_closest_point_on_route, calculate_leg_metrics, meters_to_miles
-from utils.pace_calculator import calculate_legs
+import uuid
+import os
+import secrets
+import numpy as np
+from database import get_db, get_async_db
+from models import Event, Waypoint, CalculatedLeg, ROUTE_DATA_GROUP
+from schemas import (
+    CalculatedLegResponse, ScenarioRequest, ScenarioResponse, SimulationRequest, SimulationResponse,
+    TargetSolveRequest, TargetSolveResponse
+)
+from utils.gpx_processor import meters_to_miles
+from utils.route_index import get_route_index, course_order_key
+from utils.route_storage import load_event_route, load_actual_route, route_cache_key, actual_route_cache_key
+from utils.pace_calculator import calculate_legs, pace_scenarios, simulate_arrivals, solve_target_duration
+from utils.executor import map_cpu_bound
+from utils.bulk import bulk_insert
+from utils.grade_pace import get_grade_cost_profile
+from utils.track_alignment import align_waypoints, leg_splits
 
 router = APIRouter()
 
+# Largest scenario grid evaluated in one request
+SCENARIO_MAX_COUNT = int(os.getenv("SCENARIO_MAX_COUNT", "5000"))
+# Monte Carlo limits; runs are simulated in fixed-size batches (one process pool job each),
+# so a seed reproduces the same result however many workers there are
+SIMULATION_MAX_RUNS = int(os.getenv("SIMULATION_MAX_RUNS", "200000"))
+SIMULATION_BATCH_RUNS = int(os.getenv("SIMULATION_BATCH_RUNS", "20000"))
+
+# Stored CalculatedLeg columns produced by calculate_legs
+LEG_COLUMNS = (
+    'start_waypoint_id', 'end_waypoint_id', 'leg_distance', 'elevation_gain', 'elevation_loss',
+    'grade_adjusted_distance', 'base_pace', 'adjusted_pace', 'expected_arrival_time', 'stop_time_minutes', 'exit_time',
+    'cumulative_distance', 'cumulative_time_minutes'
+)
+
+def snap_stale_waypoints(route_index, waypoints: List[Waypoint], route_id) -> Set[UUID]:
+    """
+    Snap waypoints whose cached route position is missing or belongs to another route
+    
+    Each run of stale waypoints is snapped monotonically inside the window between
+    its snapped neighbours, so moving one waypoint only re-snaps that waypoint.
+    On the first calculation every waypoint is stale and this is one full pass.
+    
+    Returns:
+        IDs of the waypoints that were (re)snapped
+    """
+    stale = [
+        wp.route_position is None or route_id is None or wp.snapped_route_id != route_id
+        for wp in waypoints
+    ]
+    
+    resnapped = set()
+    i = 0
+    while i < len(waypoints):
+        if not stale[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(waypoints) and stale[j]:
+            j += 1
+        
+        lower = waypoints[i - 1].route_position if i > 0 else 0.0
+        upper = waypoints[j].route_position if j < len(waypoints) else None
+        if upper is not None and upper < lower:
+            upper = lower
+        
+        run = waypoints[i:j]
+        snaps = route_index.snap_sequence(
+            [wp.latitude for wp in run],
+            [wp.longitude for wp in run],
+            lower=lower,
+            upper=upper
+        )
+        for waypoint, snap in zip(run, snaps):
+            waypoint.route_position = snap.position
+            waypoint.distance_from_start = snap.distance_from_start
+            waypoint.snapped_route_id = route_id
+            resnapped.add(waypoint.id)
+        i = j
+    
+    return resnapped
+
 @router.post("/events/{event_id}/calculate")
 def calculate_event_legs(event_id: UUID, db: Session = Depends(get_db)):
-    """Calculate pace and timing for all legs of an event"""
-    # Get event
-    event = db.query(Event).filter(Event.id == event_id).first()
+    """
+    Calculate pace and timing for all legs of an event
+    
+    Incremental: only waypoints that moved (or were never snapped) are re-snapped,
+    legs between unchanged waypoints reuse their stored distance/elevation metrics,
+    and only legs whose values changed are written (upserted by leg number).
+    """
+    # Get event (with its route data, needed for snapping)
+    event = db.query(Event).options(undefer_group(ROUTE_DATA_GROUP)).filter(Event.id == event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
@@ -22,35 +104,56 @@ def calculate_event_legs(event_id: UUID, db: Session = Depends(get_db)):
     if not event.target_duration_minutes:
         raise HTTPException(status_code=400, detail="Target duration not set")
     
-    if not event.gpx_route or "coordinates" not in event.gpx_route:
+    route = load_event_route(event)
+    if route is None:
         raise HTTPException(status_code=400, detail="No route data available")
     
-    # Get waypoints ordered by distance
-    waypoints = db.query(Waypoint).filter(
-        Waypoint.event_id == event_id
-    ).order_by(Waypoint.distance_from_start).all()
+    # Get waypoints in course order
+    waypoints = sorted(
+        db.query(Waypoint).filter(Waypoint.event_id == event_id).all(),
+        key=course_order_key
+    )
     
     if not waypoints:
         raise HTTPException(status_code=400, detail="No waypoints defined")
     
-    # Get route coordinates
-    route_coords = event.gpx_route["coordinates"]
+    # Snap stale waypoints with positions increasing along the course
+    # (an aid station visited twice on an out-and-back gets both of its passes)
+    profile = route.profile
+    route_index = get_route_index(route_cache_key(event), route.coordinates, profile)
+    resnapped = snap_stale_waypoints(route_index, waypoints, event.route_id)
     
-    # Calculate leg metrics
-    leg_metrics = []
-    prev_index = 0
+    # Grade-adjusted pace model: per-segment GAP cost prefix sums, cached per route
+    cost_profile = get_grade_cost_profile(route_cache_key(event), profile) if event.grade_adjusted_pace else None
     
-    for waypoint in waypoints:
-        # Find waypoint position on route
-        closest_index, _ = find_closest_point_on_route(
-            route_coords, waypoint.latitude, waypoint.longitude
-        )
-        
-        # Calculate metrics for this leg
-        metrics = calculate_leg_metrics(route_coords, prev_index, closest_index)
-        leg_metrics.append(metrics)
-        
-        prev_index = closest_index
+    existing_legs = db.query(CalculatedLeg).filter(CalculatedLeg.event_id == event_id).all()
+    legs_by_number = {leg.leg_number: leg for leg in existing_legs}
+    legs_by_endpoints = {(leg.start_waypoint_id, leg.end_waypoint_id): leg for leg in existing_legs}
+    
+    # Leg metrics: reuse stored metrics for legs whose endpoints did not move,
+    # otherwise read them off the route profile's prefix sums
+    leg_metrics = []
+    leg_costs = [] if cost_profile is not None else None
+    prev_position = 0.0
+    for i, waypoint in enumerate(waypoints):
+        start_id = waypoints[i - 1].id if i > 0 else None
+        cached = legs_by_endpoints.get((start_id, waypoint.id)) if start_id is not None else None
+        if (cached is not None and cached.leg_distance is not None
+                and waypoint.id not in resnapped and start_id not in resnapped):
+            leg_metrics.append({
+                'distance': cached.leg_distance,
+                'elevation_gain': cached.elevation_gain,
+                'elevation_loss': cached.elevation_loss
+            })
+        else:
+            cached = None
+            leg_metrics.append(profile.metrics_between(prev_position, waypoint.route_position))
+        if leg_costs is not None:
+            if cached is not None and cached.grade_adjusted_distance is not None:
+                leg_costs.append(cached.grade_adjusted_distance)
+            else:
+                leg_costs.append(cost_profile.cost_between(prev_position, waypoint.route_position))
+        prev_position = waypoint.route_position
     
     # Prepare waypoint data for calculator
     waypoint_data = [
@@ -62,7 +165,7 @@ def calculate_event_legs(event_id: UUID, db: Session = Depends(get_db)):
         for wp in waypoints
     ]
     
-    # Calculate legs
+    # Time allocation pass (cheap; always rerun)
     calculated = calculate_legs(
         event_distance=event.distance or meters_to_miles(event.gpx_metadata.get('total_distance_meters', 0)),
         target_duration_minutes=event.target_duration_minutes,
@@ -71,40 +174,57 @@ def calculate_event_legs(event_id: UUID, db: Session = Depends(get_db)):
         elevation_gain_adjustment=event.elevation_gain_adjustment_percent,
         elevation_descent_adjustment=event.elevation_descent_adjustment_percent,
         fatigue_slowdown=event.fatigue_slowdown_percent,
-        start_time=event.planned_date
+        start_time=event.planned_date,
+        leg_costs=leg_costs
     )
     
-    # Delete existing calculated legs
-    db.query(CalculatedLeg).filter(CalculatedLeg.event_id == event_id).delete()
-    
-    # Store calculated legs
-    db_legs = []
+    # Keep only legs whose stored values would change
+    changed_rows = []
     for leg_data in calculated:
-        db_leg = CalculatedLeg(
-            event_id=event_id,
-            leg_number=leg_data['leg_number'],
-            start_waypoint_id=waypoints[leg_data['leg_number'] - 2].id if leg_data['leg_number'] > 1 else None,
-            end_waypoint_id=leg_data['waypoint_id'],
-            leg_distance=leg_data['leg_distance'],
-            elevation_gain=leg_data['elevation_gain'],
-            elevation_loss=leg_data['elevation_loss'],
-            base_pace=leg_data['base_pace'],
-            adjusted_pace=leg_data['adjusted_pace'],
-            expected_arrival_time=leg_data['expected_arrival_time'],
-            stop_time_minutes=leg_data['stop_time_minutes'],
-            exit_time=leg_data['exit_time'],
-            cumulative_distance=leg_data['cumulative_distance'],
-            cumulative_time_minutes=int(leg_data['cumulative_time_minutes'])
+        row = {
+            'start_waypoint_id': waypoints[leg_data['leg_number'] - 2].id if leg_data['leg_number'] > 1 else None,
+            'end_waypoint_id': leg_data['waypoint_id'],
+            'leg_distance': leg_data['leg_distance'],
+            'elevation_gain': leg_data['elevation_gain'],
+            'elevation_loss': leg_data['elevation_loss'],
+            'grade_adjusted_distance': leg_data['grade_adjusted_distance'],
+            'base_pace': leg_data['base_pace'],
+            'adjusted_pace': leg_data['adjusted_pace'],
+            'expected_arrival_time': leg_data['expected_arrival_time'],
+            'stop_time_minutes': leg_data['stop_time_minutes'],
+            'exit_time': leg_data['exit_time'],
+            'cumulative_distance': leg_data['cumulative_distance'],
+            'cumulative_time_minutes': int(leg_data['cumulative_time_minutes'])
+        }
+        current = legs_by_number.get(leg_data['leg_number'])
+        if current is None or any(getattr(current, column) != row[column] for column in LEG_COLUMNS):
+            changed_rows.append({'id': uuid.uuid4(), 'event_id': event_id, 'leg_number': leg_data['leg_number'], **row})
+    
+    bulk_insert(
+        db,
+        CalculatedLeg,
+        changed_rows,
+        on_conflict=lambda stmt: stmt.on_conflict_do_update(
+            constraint="uq_calculated_legs_event_leg",
+            set_={column: stmt.excluded[column] for column in LEG_COLUMNS}
         )
-        db.add(db_leg)
-        db_legs.append(db_leg)
+    )
+    
+    # Drop legs beyond the new leg count (waypoints were removed)
+    removed = db.query(CalculatedLeg).filter(
+        CalculatedLeg.event_id == event_id,
+        CalculatedLeg.leg_number > len(calculated)
+    ).delete(synchronize_session=False)
     
     db.commit()
     
     return {
         "success": True,
-        "message": f"Calculated {len(db_legs)} legs",
-        "legs_count": len(db_legs)
+        "message": f"Calculated {len(calculated)} legs",
+        "legs_count": len(calculated),
+        "legs_updated": len(changed_rows),
+        "legs_removed": removed,
+        "waypoints_snapped": len(resnapped)
     }
 
 @router.get("/events/{event_id}/legs", response_model=List[CalculatedLegResponse])
@@ -120,16 +240,303 @@ def get_event_legs(event_id: UUID, db: Session = Depends(get_db)):
     
     return legs
 
+def stored_leg_costs(event: Event, legs: List[CalculatedLeg]) -> Optional[List[float]]:
+    """Grade-adjusted leg distances from the last calculation, if the event uses that model"""
+    if not event.grade_adjusted_pace or any(leg.grade_adjusted_distance is None for leg in legs):
+        return None
+    return [leg.grade_adjusted_distance for leg in legs]
+
+@router.post("/events/{event_id}/scenarios", response_model=ScenarioResponse)
+def calculate_scenarios(event_id: UUID, request: ScenarioRequest, db: Session = Depends(get_db)):
+    """
+    Evaluate a grid of pacing scenarios against the event's calculated legs
+    
+    Every combination of target duration and gain/descent/fatigue percentages
+    is run through the vectorized pace engine in one pass; nothing is stored.
+    (Under the grade-adjusted model the gain/descent percentages have no effect.)
+    """
+    event = db.query(Event).filter(Event.id == event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    legs = db.query(CalculatedLeg).filter(
+        CalculatedLeg.event_id == event_id
+    ).order_by(CalculatedLeg.leg_number).all()
+    if not legs:
+        raise HTTPException(status_code=400, detail="Legs not calculated yet")
+    
+    # Parameter axes (omitted axes hold the event's current value)
+    axes = [
+        request.target_durations_minutes or ([event.target_duration_minutes] if event.target_duration_minutes else None),
+        request.elevation_gain_adjustments or [event.elevation_gain_adjustment_percent or 0],
+        request.elevation_descent_adjustments or [event.elevation_descent_adjustment_percent or 0],
+        request.fatigue_slowdowns or [event.fatigue_slowdown_percent or 0]
+    ]
+    if axes[0] is None:
+        raise HTTPException(status_code=400, detail="Target duration not set")
+    
+    scenario_count = int(np.prod([len(axis) for axis in axes]))
+    if scenario_count > SCENARIO_MAX_COUNT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many scenarios ({scenario_count}); at most {SCENARIO_MAX_COUNT} per request"
+        )
+    
+    # Flatten the grid to one row per scenario
+    targets, gains, descents, fatigues = (
+        grid.ravel() for grid in np.meshgrid(*[np.asarray(axis, dtype=np.float64) for axis in axes], indexing="ij")
+    )
+    
+    stop_times = [leg.stop_time_minutes or 0 for leg in legs]
+    result = pace_scenarios(
+        leg_distances=[leg.leg_distance or 0 for leg in legs],
+        elevation_gains=[leg.elevation_gain or 0 for leg in legs],
+        elevation_losses=[leg.elevation_loss or 0 for leg in legs],
+        stop_times=stop_times,
+        target_durations=targets,
+        gain_adjustments=gains,
+        descent_adjustments=descents,
+        fatigue_slowdowns=fatigues,
+        leg_costs=stored_leg_costs(event, legs)
+    )
+    
+    waypoint_ids = [leg.end_waypoint_id for leg in legs if leg.end_waypoint_id]
+    waypoint_names = dict(
+        db.query(Waypoint.id, Waypoint.name).filter(Waypoint.id.in_(waypoint_ids)).all()
+    ) if waypoint_ids else {}
+    
+    durations = result['leg_duration_minutes'].round(2).tolist()
+    paces = result['adjusted_pace'].round(3).tolist()
+    arrivals = result['arrival_minutes'].round(2).tolist()
+    
+    return {
+        "legs": [
+            {
+                "leg_number": leg.leg_number,
+                "waypoint_id": leg.end_waypoint_id,
+                "waypoint_name": waypoint_names.get(leg.end_waypoint_id),
+                "leg_distance": leg.leg_distance or 0,
+                "elevation_gain": leg.elevation_gain or 0,
+                "elevation_loss": leg.elevation_loss or 0,
+                "stop_time_minutes": stop_time
+            }
+            for leg, stop_time in zip(legs, stop_times)
+        ],
+        "scenarios": [
+            {
+                "target_duration_minutes": float(targets[i]),
+                "elevation_gain_adjustment_percent": float(gains[i]),
+                "elevation_descent_adjustment_percent": float(descents[i]),
+                "fatigue_slowdown_percent": float(fatigues[i]),
+                "leg_duration_minutes": durations[i],
+                "adjusted_pace": paces[i],
+                "arrival_minutes": arrivals[i]
+            }
+            for i in range(scenario_count)
+        ]
+    }
+
+@router.post("/events/{event_id}/solve-target", response_model=TargetSolveResponse)
+def solve_event_target(event_id: UUID, request: TargetSolveRequest, db: Session = Depends(get_db)):
+    """
+    Range of target durations that meet every cutoff and pace bound
+    
+    Uses the event's calculated legs and current pace model parameters; reports
+    which constraint sets each end of the range.
+    """
+    event = db.query(Event).filter(Event.id == event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    legs = db.query(CalculatedLeg).filter(
+        CalculatedLeg.event_id == event_id
+    ).order_by(CalculatedLeg.leg_number).all()
+    if not legs:
+        raise HTTPException(status_code=400, detail="Legs not calculated yet")
+    
+    # Per-leg constraint arrays (NaN = unconstrained)
+    cutoffs, min_paces, max_paces = [], [], []
+    for leg in legs:
+        bounds = request.leg_pace_bounds.get(leg.end_waypoint_id)
+        cutoff = request.cutoffs_minutes.get(leg.end_waypoint_id)
+        min_pace = bounds.min_pace if bounds and bounds.min_pace is not None else request.min_pace
+        max_pace = bounds.max_pace if bounds and bounds.max_pace is not None else request.max_pace
+        cutoffs.append(cutoff if cutoff is not None else np.nan)
+        min_paces.append(min_pace if min_pace is not None else np.nan)
+        max_paces.append(max_pace if max_pace is not None else np.nan)
+    
+    result = solve_target_duration(
+        leg_distances=[leg.leg_distance or 0 for leg in legs],
+        elevation_gains=[leg.elevation_gain or 0 for leg in legs],
+        elevation_losses=[leg.elevation_loss or 0 for leg in legs],
+        stop_times=[leg.stop_time_minutes or 0 for leg in legs],
+        gain_adjustment=event.elevation_gain_adjustment_percent or 0,
+        descent_adjustment=event.elevation_descent_adjustment_percent or 0,
+        fatigue_slowdown=event.fatigue_slowdown_percent or 0,
+        cutoffs=cutoffs,
+        min_paces=min_paces,
+        max_paces=max_paces,
+        leg_costs=stored_leg_costs(event, legs)
+    )
+    
+    # Names of the (at most two) binding waypoints, in one query
+    bound_legs = [legs[binding[1]] for binding in (result["lower_binding"], result["upper_binding"])
+                  if binding is not None and binding[1] is not None]
+    waypoint_ids = [leg.end_waypoint_id for leg in bound_legs if leg.end_waypoint_id]
+    waypoint_names = dict(
+        db.query(Waypoint.id, Waypoint.name).filter(Waypoint.id.in_(waypoint_ids)).all()
+    ) if waypoint_ids else {}
+    
+    def describe(binding):
+        if binding is None:
+            return None
+        kind, index = binding
+        if index is None:
+            return {"kind": kind}
+        leg = legs[index]
+        return {
+            "kind": kind,
+            "leg_number": leg.leg_number,
+            "waypoint_id": leg.end_waypoint_id,
+            "waypoint_name": waypoint_names.get(leg.end_waypoint_id)
+        }
+    
+    min_target = float(result["min_target_minutes"])
+    max_target = float(result["max_target_minutes"])
+    target = event.target_duration_minutes
+    
+    return {
+        "feasible": result["feasible"],
+        "min_target_duration_minutes": round(min_target, 2),
+        "max_target_duration_minutes": round(max_target, 2) if np.isfinite(max_target) else None,
+        "lower_binding": describe(result["lower_binding"]),
+        "upper_binding": describe(result["upper_binding"]),
+        "current_target_feasible": (result["feasible"] and min_target <= target <= max_target) if target else None
+    }
+
+async def run_simulation(leg_durations: List[float],
+                         stop_times: List[float],
+                         fatigue_slowdown: float,
+                         runs: int,
+                         seed: int,
+                         pace_variability: float,
+                         leg_variability: float,
+                         stop_variability: float,
+                         fatigue_variability: float,
+                         batch_runs: int = SIMULATION_BATCH_RUNS) -> np.ndarray:
+    """
+    Simulated arrival minutes (runs x legs) in batches across the process pool
+    
+    Batch k always draws from SeedSequence(seed).spawn(...)[k], which does not
+    depend on the number of batches, so a seed gives the same runs however many
+    batches run at once, and raising runs only appends new batches. At most
+    CPU_POOL_WORKERS batches are in the pool at once.
+    
+    Raises:
+        PoolSaturatedError: If the process pool backlog is full
+    """
+    batch_sizes = [min(batch_runs, runs - start) for start in range(0, runs, batch_runs)]
+    batch_seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    batch_args = [
+        (leg_durations, stop_times, fatigue_slowdown, batch_size, batch_seed,
+         pace_variability, leg_variability, stop_variability, fatigue_variability)
+        for batch_size, batch_seed in zip(batch_sizes, batch_seeds)
+    ]
+    return np.concatenate([batch async for batch in map_cpu_bound(simulate_arrivals, batch_args)])
+
+@router.post("/events/{event_id}/simulate", response_model=SimulationResponse)
+async def simulate_event(event_id: UUID, request: SimulationRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Monte Carlo arrival-time distribution around the event's calculated legs
+    
+    Samples pace, stop-time and fatigue variability around the planned split and
+    returns arrival percentiles per waypoint and the probability of missing each
+    given cutoff. Batches of runs are simulated in parallel in the process pool.
+    """
+    event = await db.get(Event, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if not event.target_duration_minutes:
+        raise HTTPException(status_code=400, detail="Target duration not set")
+    if request.runs > SIMULATION_MAX_RUNS:
+        raise HTTPException(status_code=400, detail=f"At most {SIMULATION_MAX_RUNS} runs per request")
+    if any(p < 0 or p > 100 for p in request.percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    
+    legs = (await db.execute(
+        select(CalculatedLeg).where(CalculatedLeg.event_id == event_id).order_by(CalculatedLeg.leg_number)
+    )).scalars().all()
+    if not legs:
+        raise HTTPException(status_code=400, detail="Legs not calculated yet")
+    
+    waypoint_ids = [leg.end_waypoint_id for leg in legs if leg.end_waypoint_id]
+    waypoint_names = dict((await db.execute(
+        select(Waypoint.id, Waypoint.name).where(Waypoint.id.in_(waypoint_ids))
+    )).all()) if waypoint_ids else {}
+    
+    # Planned split under the event's current parameters
+    stop_times = [leg.stop_time_minutes or 0 for leg in legs]
+    fatigue_slowdown = event.fatigue_slowdown_percent or 0
+    plan = pace_scenarios(
+        leg_distances=[leg.leg_distance or 0 for leg in legs],
+        elevation_gains=[leg.elevation_gain or 0 for leg in legs],
+        elevation_losses=[leg.elevation_loss or 0 for leg in legs],
+        stop_times=stop_times,
+        target_durations=event.target_duration_minutes,
+        gain_adjustments=event.elevation_gain_adjustment_percent or 0,
+        descent_adjustments=event.elevation_descent_adjustment_percent or 0,
+        fatigue_slowdowns=fatigue_slowdown,
+        leg_costs=stored_leg_costs(event, legs)
+    )
+    leg_durations = plan['leg_duration_minutes'][0].tolist()
+    
+    seed = request.seed if request.seed is not None else secrets.randbits(63)
+    arrivals = await run_simulation(
+        leg_durations, stop_times, fatigue_slowdown, request.runs, seed,
+        request.pace_variability_percent, request.leg_variability_percent,
+        request.stop_variability_percent, request.fatigue_variability_percent
+    )
+    
+    labels = [f"p{p:g}" for p in request.percentiles]
+    percentile_values = np.percentile(arrivals, request.percentiles, axis=0)  # (P, L)
+    
+    waypoints = []
+    for i, leg in enumerate(legs):
+        cutoff = request.cutoffs_minutes.get(leg.end_waypoint_id) if leg.end_waypoint_id else None
+        waypoints.append({
+            "leg_number": leg.leg_number,
+            "waypoint_id": leg.end_waypoint_id,
+            "waypoint_name": waypoint_names.get(leg.end_waypoint_id),
+            "planned_arrival_minutes": round(float(plan['arrival_minutes'][0, i]), 2),
+            "arrival_percentiles": {
+                label: round(float(value), 2) for label, value in zip(labels, percentile_values[:, i])
+            },
+            "cutoff_minutes": cutoff,
+            "cutoff_miss_probability": float(np.mean(arrivals[:, i] > cutoff)) if cutoff is not None else None
+        })
+    
+    return {
+        "runs": request.runs,
+        "seed": seed,
+        "finish_percentiles": dict(waypoints[-1]["arrival_percentiles"]),
+        "waypoints": waypoints
+    }
+
 @router.get("/events/{event_id}/comparison")
 def get_comparison(event_id: UUID, db: Session = Depends(get_db)):
     """Get planned vs actual comparison with detailed performance analysis"""
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = db.query(Event).options(undefer_group(ROUTE_DATA_GROUP)).filter(Event.id == event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    if not event.actual_gpx_data:
+    # Actual track metadata is stored in whichever column matches its upload format
+    actual_data = event.actual_gpx_data or event.actual_tcx_data
+    if not actual_data:
         raise HTTPException(status_code=404, detail="No actual data available")
     
+    planned_route = load_event_route(event)
+    actual_route = load_actual_route(event)
+    
     # Get calculated legs and waypoints
     planned_legs = db.query(CalculatedLeg).filter(
         CalculatedLeg.event_id == event_id
@@ -141,21 +548,34 @@ def get_comparison(event_id: UUID, db: Session = Depends(get_db)):
     
     # Extract metadata
     planned_distance_meters = event.gpx_metadata.get('total_distance_meters', 0) if event.gpx_metadata else 0
-    actual_distance_meters = event.actual_gpx_data.get('metadata', {}).get('total_distance_meters', 0)
+    actual_distance_meters = actual_data.get('metadata', {}).get('total_distance_meters', 0)
     
     planned_elevation_gain = event.gpx_metadata.get('elevation_gain_meters', 0) if event.gpx_metadata else 0
-    actual_elevation_gain = event.actual_gpx_data.get('metadata', {}).get('elevation_gain_meters', 0)
+    actual_elevation_gain = actual_data.get('metadata', {}).get('elevation_gain_meters', 0)
     
     # Check if actual data has timestamps for time comparison
-    has_actual_timestamps = event.actual_gpx_data.get('metadata', {}).get('has_timestamps', False)
-    actual_duration_minutes = event.actual_gpx_data.get('metadata', {}).get('timestamp_duration_minutes')
+    has_actual_timestamps = actual_data.get('metadata', {}).get('has_timestamps', False)
+    actual_duration_minutes = actual_data.get('metadata', {}).get('timestamp_duration_minutes')
     planned_duration_minutes = event.target_duration_minutes
     
+    # Align the actual track's timestamps to the planned waypoints when it carries them
+    waypoints_by_id = {w.id: w for w in waypoints}
+    end_waypoints = [waypoints_by_id.get(leg.end_waypoint_id) for leg in planned_legs]
+    splits = None
+    if actual_route is not None and actual_route.times is not None and planned_legs and all(end_waypoints):
+        actual_index = get_route_index(actual_route_cache_key(event), actual_route.coordinates, actual_route.profile)
+        passages = align_waypoints(
+            actual_route, actual_index,
+            [w.latitude for w in end_waypoints],
+            [w.longitude for w in end_waypoints]
+        )
+        splits = leg_splits(passages) if passages else None
+    
     # Build leg-by-leg comparison if we have actual timestamps
     leg_comparisons = []
     if has_actual_timestamps and actual_duration_minutes and planned_legs:
-        # TODO: For now, we'll estimate actual leg times proportionally
-        # In future, we could match actual GPX timestamps to waypoints
+        # Without aligned splits (tracks stored before per-point times were kept),
+        # estimate actual leg times proportionally
         actual_to_planned_ratio = actual_duration_minutes / planned_duration_minutes if planned_duration_minutes else 1.0
         
         cumulative_planned_time = 0
@@ -163,23 +583,26 @@ def get_comparison(event_id: UUID, db: Session = Depends(get_db)):
         cumulative_time_diff = 0
         
         for i, leg in enumerate(planned_legs):
-            # Find corresponding waypoint
-            waypoint = next((w for w in waypoints if str(w.id) == str(leg.end_waypoint_id)), None)
+            waypoint = end_waypoints[i]
             
-            # Estimate actual leg time (proportional to planned)
             planned_leg_time = leg.cumulative_time_minutes - cumulative_planned_time if i > 0 else leg.cumulative_time_minutes
-            estimated_actual_leg_time = planned_leg_time * actual_to_planned_ratio
+            if splits is not None:
+                split = splits[i]
+                actual_leg_time = split["leg_seconds"] / 60
+                cumulative_actual_time = split["departure_seconds"] / 60
+            else:
+                actual_leg_time = planned_leg_time * actual_to_planned_ratio
+                cumulative_actual_time += actual_leg_time
             
             cumulative_planned_time = leg.cumulative_time_minutes
-            cumulative_actual_time += estimated_actual_leg_time
             cumulative_time_diff = cumulative_actual_time - cumulative_planned_time
             
             leg_comparison = {
                 "leg_number": leg.leg_number,
                 "waypoint_name": waypoint.name if waypoint else f"Waypoint {leg.leg_number}",
                 "planned_leg_time_minutes": round(planned_leg_time, 2),
-                "estimated_actual_leg_time_minutes": round(estimated_actual_leg_time, 2),
-                "leg_time_diff_minutes": round(estimated_actual_leg_time - planned_leg_time, 2),
+                "estimated_actual_leg_time_minutes": round(actual_leg_time, 2),
+                "leg_time_diff_minutes": round(actual_leg_time - planned_leg_time, 2),
                 "cumulative_planned_time_minutes": round(cumulative_planned_time, 2),
                 "cumulative_actual_time_minutes": round(cumulative_actual_time, 2),
                 "cumulative_time_diff_minutes": round(cumulative_time_diff, 2),
@@ -187,6 +610,17 @@ def get_comparison(event_id: UUID, db: Session = Depends(get_db)):
                 "distance_miles": round(leg.leg_distance, 2),
                 "cumulative_distance_miles": round(leg.cumulative_distance, 2)
             }
+            if splits is not None:
+                actual_miles = meters_to_miles(split["distance_meters"])
+                moving_minutes = split["moving_seconds"] / 60
+                leg_comparison.update({
+                    "actual_moving_time_minutes": round(moving_minutes, 2),
+                    "actual_stopped_time_minutes": round(split["stopped_seconds"] / 60, 2),
+                    "actual_stop_at_waypoint_minutes": round(split["stop_seconds"] / 60, 2),
+                    "actual_arrival_minutes": round(split["arrival_seconds"] / 60, 2),
+                    "actual_distance_meters": round(split["distance_meters"], 1),
+                    "actual_pace": round(moving_minutes / actual_miles, 2) if actual_miles > 0 else None
+                })
             leg_comparisons.append(leg_comparison)
     
     # Summary statistics
@@ -206,13 +640,18 @@ def get_comparison(event_id: UUID, db: Session = Depends(get_db)):
         "time_diff_percent": round(((actual_duration_minutes - planned_duration_minutes) / planned_duration_minutes * 100), 2) if (actual_duration_minutes and planned_duration_minutes) else None,
         
         "has_actual_timestamps": has_actual_timestamps,
+        "leg_timing": ("track" if splits is not None else "estimated") if leg_comparisons else None,
+        "actual_moving_time_minutes": actual_data.get('metadata', {}).get('moving_time_minutes'),
         "planned_avg_pace": round(planned_duration_minutes / meters_to_miles(planned_distance_meters), 2) if planned_distance_meters and planned_duration_minutes else None,
         "actual_avg_pace": round(actual_duration_minutes / meters_to_miles(actual_distance_meters), 2) if actual_distance_meters and actual_duration_minutes else None
     }
     
     return {
-        "planned_route": event.gpx_route,
-        "actual_route": event.actual_gpx_data,
+        "planned_route": planned_route.to_json(include_profile=False) if planned_route else None,
+        "actual_route": {
+            **actual_data,
+            "coordinates": actual_route.to_json(include_profile=False)["coordinates"] if actual_route else []
+        },
         "planned_legs": [CalculatedLegResponse.model_validate(leg) for leg in planned_legs],
         "comparison_summary": summary,
         "leg_comparisons": leg_comparisons,
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import text, desc
-from database import get_db
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import text, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_async_db, AsyncSessionLocal
+from utils.pagination import paginate, NEXT_CURSOR_HEADER
 from schemas import ChatMessage, ChatResponse, ChatSessionResponse, ChatMessageResponse
 from models import Event, UserSettings, DocumentChunk, Waypoint, CalculatedLeg, ChatSession, ChatMessage as ChatMessageModel
 from cryptography.fernet import Fernet
@@ -12,6 +14,7 @@ import json
 from typing import List, Optional
 from datetime import datetime
 import uuid
+from uuid import UUID
 
 router = APIRouter()
 
@@ -31,18 +34,22 @@ def decrypt_value(value: str) -> str:
         return None
     return cipher_suite.decrypt(value.encode()).decode()
 
-def get_event_context(event_id: str, db: Session) -> Optional[str]:
+async def get_event_context(event_id: str, db: AsyncSession) -> Optional[str]:
     """Get context about the current event"""
     try:
-        event = db.query(Event).filter(Event.id == event_id).first()
+        event = await db.get(Event, uuid.UUID(event_id))
         if not event:
             return None
         
         # Get waypoints
-        waypoints = db.query(Waypoint).filter(Waypoint.event_id == event_id).order_by(Waypoint.order_index).all()
+        waypoints = (await db.execute(
+            select(Waypoint).where(Waypoint.event_id == event.id).order_by(Waypoint.order_index)
+        )).scalars().all()
         
         # Get calculated legs
-        legs = db.query(CalculatedLeg).filter(CalculatedLeg.event_id == event_id).order_by(CalculatedLeg.leg_number).all()
+        legs = (await db.execute(
+            select(CalculatedLeg).where(CalculatedLeg.event_id == event.id).order_by(CalculatedLeg.leg_number)
+        )).scalars().all()
         
         # Build context string
         context = f"Current Event: {event.name}\n"
@@ -78,13 +85,15 @@ def get_event_context(event_id: str, db: Session) -> Optional[str]:
             context += f"Pace adjustments: Elevation gain {event.elevation_gain_adjustment_percent}%, "
             context += f"Descent {event.elevation_descent_adjustment_percent}%, "
             context += f"Fatigue {event.fatigue_slowdown_percent}%\n"
+            if event.grade_adjusted_pace:
+                context += "Pace model: grade-adjusted (legs weighted by local grade along the route)\n"
         
         return context
     except Exception as e:
         print(f"Error getting event context: {e}")
         return None
 
-async def search_documents(query: str, api_key: str, db: Session, limit: int = 3) -> List[dict]:
+async def search_documents(query: str, api_key: str, db: AsyncSession, limit: int = 3) -> List[dict]:
     """Search document chunks using vector similarity with PGVector"""
     try:
         # Generate embedding for the query
@@ -100,20 +109,23 @@ async def search_documents(query: str, api_key: str, db: Session, limit: int = 3
         embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
         
         # Use PGVector cosine distance operator (<=>)
-        # Lower distance = more similar
+        # Lower distance = more similar (explicit cast: asyncpg sends typed parameters)
         query_sql = text("""
             SELECT 
-                dc.chunk_text,
+                COALESCE(
+                    dc.chunk_text,
+                    substr(d.content, dc.start_offset + 1, dc.end_offset - dc.start_offset)
+                ) as chunk_text,
                 d.filename,
-                (dc.embedding <=> :embedding) as distance
+                (dc.embedding <=> CAST(:embedding AS vector)) as distance
             FROM document_chunks dc
             JOIN documents d ON dc.document_id = d.id
             WHERE dc.embedding IS NOT NULL
-            ORDER BY dc.embedding <=> :embedding
+            ORDER BY dc.embedding <=> CAST(:embedding AS vector)
             LIMIT :limit
         """)
         
-        result = db.execute(
+        result = await db.execute(
             query_sql,
             {"embedding": embedding_str, "limit": limit}
         )
@@ -135,12 +147,12 @@ async def search_documents(query: str, api_key: str, db: Session, limit: int = 3
         return []
 
 @router.post("", response_model=ChatResponse)
-async def chat(message: ChatMessage, db: Session = Depends(get_db)):
+async def chat(message: ChatMessage, db: AsyncSession = Depends(get_async_db)):
     """
     Send a message to the AI assistant with RAG capabilities and save to database
     """
     # Get settings for API keys
-    settings = db.query(UserSettings).first()
+    settings = (await db.execute(select(UserSettings).limit(1))).scalars().first()
     
     if not settings or not settings.openai_api_key:
         return ChatResponse(
@@ -151,7 +163,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
     try:
         # Create or get session
         if message.session_id:
-            session = db.query(ChatSession).filter(ChatSession.id == message.session_id).first()
+            session = await db.get(ChatSession, message.session_id)
             if not session:
                 raise HTTPException(status_code=404, detail="Chat session not found")
         else:
@@ -161,8 +173,8 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
                 title=message.message[:50] + ("..." if len(message.message) > 50 else "")  # Use first message as title
             )
             db.add(session)
-            db.commit()
-            db.refresh(session)
+            await db.commit()
+            await db.refresh(session)
         
         # Save user message
         user_msg = ChatMessageModel(
@@ -171,7 +183,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
             content=message.message
         )
         db.add(user_msg)
-        db.commit()
+        await db.commit()
         
         # Decrypt API key and get AI settings
         api_key = decrypt_value(settings.openai_api_key)
@@ -196,7 +208,7 @@ Provide detailed, practical advice based on the user's questions and the context
         # Get event context if provided
         event_context = None
         if message.event_id:
-            event_context = get_event_context(str(message.event_id), db)
+            event_context = await get_event_context(str(message.event_id), db)
         
         # Search relevant documents using vector similarity
         relevant_docs = await search_documents(message.message, api_key, db)
@@ -212,13 +224,13 @@ Provide detailed, practical advice based on the user's questions and the context
             user_message += f"\n\nRelevant information from uploaded documents:\n{docs_text}"
         
         # Call OpenAI API using responses endpoint for GPT-5 Nano with streaming
-        client = openai.OpenAI(api_key=api_key)
+        client = openai.AsyncOpenAI(api_key=api_key)
         
         # Combine system and user messages for GPT-5
         combined_message = f"{system_message}\n\n{user_message}"
         
         # Create streaming generator
-        def generate():
+        async def generate():
             try:
                 # Web search requires at least "low" reasoning effort
                 # Auto-upgrade from minimal to low if web search is enabled
@@ -237,7 +249,7 @@ Provide detailed, practical advice based on the user's questions and the context
                     "stream": True
                 }
                 
-                stream = client.responses.create(**request_params)
+                stream = await client.responses.create(**request_params)
                 
                 full_response = ""
                 web_searches = []
@@ -245,7 +257,7 @@ Provide detailed, practical advice based on the user's questions and the context
                 # Send session ID first
                 yield f"data: {json.dumps({'session_id': str(session.id)})}\n\n"
                 
-                for event in stream:
+                async for event in stream:
                     # Log the event for debugging
                     print(f"Stream event type: {type(event)}, event: {event}")
                     
@@ -285,15 +297,17 @@ Provide detailed, practical advice based on the user's questions and the context
                 if relevant_docs:
                     sources_list = [{"document": doc["document"], "preview": doc["text"][:200]} for doc in relevant_docs]
                 
-                assistant_msg = ChatMessageModel(
-                    session_id=session.id,
-                    role="assistant",
-                    content=full_response,
-                    sources=sources_list if sources_list else None
-                )
-                db.add(assistant_msg)
-                session.updated_at = datetime.utcnow()
-                db.commit()
+                # (own session: the request's session may already be closed while streaming)
+                async with AsyncSessionLocal() as stream_db:
+                    stream_db.add(ChatMessageModel(
+                        session_id=session.id,
+                        role="assistant",
+                        content=full_response,
+                        sources=sources_list if sources_list else None
+                    ))
+                    stream_session = await stream_db.get(ChatSession, session.id)
+                    stream_session.updated_at = datetime.utcnow()
+                    await stream_db.commit()
                 
                 # Send completion message with sources
                 yield f"data: {json.dumps({'done': True, 'sources': sources_list})}\n\n"
@@ -330,16 +344,29 @@ Provide detailed, practical advice based on the user's questions and the context
         )
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
-async def get_chat_sessions(event_id: Optional[str] = None, db: Session = Depends(get_db)):
+def get_chat_sessions(
+    response: Response,
+    event_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db)
+):
     """
-    Get chat sessions, optionally filtered by event_id
+    Get chat sessions by most recent activity, optionally filtered by event_id
+    Pages with a keyset cursor returned in the X-Next-Cursor header
     """
-    query = db.query(ChatSession).order_by(desc(ChatSession.updated_at))
+    query = db.query(ChatSession)
     
     if event_id:
         query = query.filter(ChatSession.event_id == event_id)
     
-    sessions = query.all()
+    try:
+        sessions, next_cursor = paginate(query, ChatSession.last_activity_at, ChatSession.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Return sessions without messages for list view
     return [ChatSessionResponse(
@@ -352,12 +379,14 @@ async def get_chat_sessions(event_id: Optional[str] = None, db: Session = Depend
     ) for session in sessions]
 
 @router.get("/sessions/{session_id}", response_model=ChatSessionResponse)
-async def get_chat_session(session_id: str, db: Session = Depends(get_db)):
+async def get_chat_session(session_id: UUID, db: AsyncSession = Depends(get_async_db)):
     """
     Get a specific chat session with all messages
     """
     try:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+        session = (await db.execute(
+            select(ChatSession).options(selectinload(ChatSession.messages)).where(ChatSession.id == session_id)
+        )).scalars().first()
         
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
@@ -398,17 +427,20 @@ async def get_chat_session(session_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error loading session: {str(e)}")
 
 @router.delete("/sessions/{session_id}")
-async def delete_chat_session(session_id: str, db: Session = Depends(get_db)):
+async def delete_chat_session(session_id: UUID, db: AsyncSession = Depends(get_async_db)):
     """
     Delete a chat session and all its messages
     """
-    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+    # Messages are loaded up front so the delete cascade never lazy-loads
+    session = (await db.execute(
+        select(ChatSession).options(selectinload(ChatSession.messages)).where(ChatSession.id == session_id)
+    )).scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    db.delete(session)
-    db.commit()
+    await db.delete(session)
+    await db.commit()
     
     return {"success": True, "message": "Chat session deleted"}
 
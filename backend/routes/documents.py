@@ -1,16 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
+from sqlalchemy import select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List, Optional
+from collections import defaultdict, deque
 from uuid import UUID
-from database import get_db
+import uuid
+from database import get_db, get_async_db
 from models import Document, DocumentChunk, UserSettings
-from schemas import DocumentResponse
-from utils.text_processor import process_document
+from schemas import DocumentResponse, DocumentUpdateResponse
+from utils.text_processor import (
+    process_document, load_document, generate_embeddings, embedding_inputs, chunk_texts
+)
+from utils.embedding_cache import text_hash
+from utils.executor import PoolSaturatedError
+from utils.uploads import spooled_upload
+from utils.pagination import paginate, NEXT_CURSOR_HEADER
+from utils.bulk import bulk_insert_async
 from cryptography.fernet import Fernet
 import os
 
 router = APIRouter()
 
+# Chunks per INSERT statement (each row carries a 1536-float embedding)
+DOCUMENT_CHUNK_BATCH_SIZE = int(os.getenv("DOCUMENT_CHUNK_BATCH_SIZE", "100"))
+
 # Encryption setup (same as in settings.py and chat.py)
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 if not ENCRYPTION_KEY:
@@ -26,17 +40,11 @@ def decrypt_value(value: str) -> str:
         return None
     return cipher_suite.decrypt(value.encode()).decode()
 
-@router.post("/upload", response_model=DocumentResponse, status_code=201)
-async def upload_document(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """
-    Upload a document to the vector store with full RAG processing
-    - Extracts text from PDF, TXT, DOCX, or Markdown files
-    - Chunks text into 500-token segments with 50-token overlap
-    - Generates embeddings using OpenAI text-embedding-3-small
-    - Stores chunks with embeddings for semantic search
-    """
-    # Get OpenAI API key from settings
-    settings = db.query(UserSettings).first()
+SUPPORTED_FILE_TYPES = ['txt', 'pdf', 'docx', 'md', 'markdown']
+
+async def get_openai_api_key(db: AsyncSession) -> str:
+    """Decrypted OpenAI API key from settings (400 if missing or unreadable)"""
+    settings = (await db.execute(select(UserSettings).limit(1))).scalars().first()
     if not settings or not settings.openai_api_key:
         raise HTTPException(
             status_code=400,
@@ -44,30 +52,59 @@ async def upload_document(file: UploadFile = File(...), db: Session = Depends(ge
         )
     
     try:
-        api_key = decrypt_value(settings.openai_api_key)
+        return decrypt_value(settings.openai_api_key)
     except Exception:
         raise HTTPException(
             status_code=400,
             detail="Failed to decrypt OpenAI API key. Please reconfigure it in Settings."
         )
-    
-    # Verify file type
-    file_ext = file.filename.split('.')[-1].lower()
-    if file_ext not in ['txt', 'pdf', 'docx', 'md', 'markdown']:
+
+def validate_file_type(filename: str) -> str:
+    """Lowercase file extension, or 400 if the type is not supported"""
+    file_ext = filename.split('.')[-1].lower()
+    if file_ext not in SUPPORTED_FILE_TYPES:
         raise HTTPException(
             status_code=400, 
             detail="Only .txt, .pdf, .docx, .md, and .markdown files are supported"
         )
+    return file_ext
+
+def chunk_rows(document_id: UUID, indexes, prepared: Dict, embeddings: List[List[float]]) -> List[Dict]:
+    """
+    DocumentChunk rows for the given chunk indexes of a prepared document (embeddings in the same order)
+    Chunks are stored as spans of the document text, not copies of it
+    """
+    spans = prepared['spans']
+    return [
+        {
+            'id': uuid.uuid4(),
+            'document_id': document_id,
+            'chunk_index': i,
+            'start_offset': spans[i].start,
+            'end_offset': spans[i].end,
+            'embedding': embedding
+        }
+        for i, embedding in zip(indexes, embeddings)
+    ]
+
+@router.post("/upload", response_model=DocumentResponse, status_code=201)
+async def upload_document(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """
+    Upload a document to the vector store with full RAG processing
+    - Extracts text from PDF, TXT, DOCX, or Markdown files
+    - Chunks text into 500-token segments with 50-token overlap
+    - Generates embeddings using OpenAI text-embedding-3-small
+    - Stores chunks with embeddings for semantic search
+    """
+    api_key = await get_openai_api_key(db)
+    file_ext = validate_file_type(file.filename)
     
-    # Read file content
-    try:
-        content = await file.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
-    
-    # Process document (extract, chunk, embed)
+    # Process document (extract, chunk, embed); workers read the spooled file by path
     try:
-        processed = await process_document(content, file.filename, api_key)
+        async with spooled_upload(file) as spooled:
+            processed = await process_document(spooled.path, file.filename, api_key)
+    except PoolSaturatedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
     
@@ -80,30 +117,165 @@ async def upload_document(file: UploadFile = File(...), db: Session = Depends(ge
     )
     
     db.add(db_document)
-    db.flush()  # Get document ID before creating chunks
-    
-    # Create document chunks with embeddings
-    for i, (chunk_text, chunk_with_context, embedding) in enumerate(
-        zip(processed['chunks'], processed['chunks_with_context'], processed['embeddings'])
-    ):
-        db_chunk = DocumentChunk(
-            document_id=db_document.id,
-            chunk_index=i,
-            chunk_text=chunk_text,
-            chunk_with_summary=chunk_with_context,
-            embedding=embedding
-        )
-        db.add(db_chunk)
+    await db.flush()  # Get document ID before creating chunks
     
-    db.commit()
-    db.refresh(db_document)
+    # Create document chunks with embeddings (multi-row INSERTs, not one per chunk)
+    await bulk_insert_async(db, DocumentChunk, chunk_rows(
+        db_document.id,
+        range(len(processed['spans'])),
+        processed,
+        processed['embeddings']
+    ), batch_size=DOCUMENT_CHUNK_BATCH_SIZE)
+    
+    await db.commit()
+    await db.refresh(db_document)
     
     return db_document
 
+@router.put("/{document_id}", response_model=DocumentUpdateResponse)
+async def update_document(document_id: UUID, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
+    """
+    Replace a document with a revised file, re-embedding only chunks that changed
+    - Re-extracts and re-chunks the new file
+    - Matches new chunks to existing ones by hash of the chunk text
+    - Keeps matched chunks and their vectors in place (re-pointed at the new text)
+    - Embeds and inserts new chunks, deletes chunks no longer present
+    
+    The diff and embeddings are computed outside any transaction; the document
+    is then locked for the writes, which are refused with 409 if it changed in
+    the meantime.
+    """
+    api_key = await get_openai_api_key(db)
+    file_ext = validate_file_type(file.filename)
+    
+    # Extract and chunk before touching the document
+    try:
+        async with spooled_upload(file) as spooled:
+            prepared = await load_document(spooled.path, file.filename)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    
+    current = (await db.execute(
+        select(Document.content).where(Document.id == document_id)
+    )).first()
+    if not current:
+        raise HTTPException(status_code=404, detail="Document not found")
+    old_content = current.content or ""
+    
+    existing = (await db.execute(
+        select(
+            DocumentChunk.id, DocumentChunk.chunk_index, DocumentChunk.chunk_text,
+            DocumentChunk.chunk_with_summary, DocumentChunk.start_offset, DocumentChunk.end_offset
+        )
+        .where(DocumentChunk.document_id == document_id)
+        .order_by(DocumentChunk.chunk_index)
+    )).all()
+    
+    # End the read transaction so no connection or snapshot is held while embedding
+    await db.rollback()
+    
+    def stored_text(row) -> str:
+        """An existing chunk's text (legacy rows store it; span rows point into the content)"""
+        if row.chunk_text is not None or row.start_offset is None:
+            return row.chunk_text or ""
+        return old_content[row.start_offset:row.end_offset]
+    
+    # Existing chunks by text hash, in order, so repeated chunks are reused front to back.
+    # A reused chunk keeps its vector even if the document summary changed, so an
+    # edit near the start of the document re-embeds only the chunks it touches.
+    reusable = defaultdict(deque)
+    for row in existing:
+        reusable[text_hash(stored_text(row))].append(row)
+    
+    spans = prepared['spans']
+    moved = []
+    kept_ids = set()
+    changed_indexes = []
+    for i, chunk in enumerate(chunk_texts(prepared)):
+        matches = reusable.get(text_hash(chunk))
+        if not matches:
+            changed_indexes.append(i)
+            continue
+        row = matches.popleft()
+        kept_ids.add(row.id)
+        # Same chunk, but its position in the new text may have shifted (legacy rows become spans)
+        if (row.chunk_index, row.start_offset, row.end_offset) != (i, spans[i].start, spans[i].end) \
+                or row.chunk_text is not None or row.chunk_with_summary is not None:
+            moved.append({
+                'id': row.id,
+                'chunk_index': i,
+                'start_offset': spans[i].start,
+                'end_offset': spans[i].end,
+                'chunk_text': None,
+                'chunk_with_summary': None
+            })
+    removed_ids = [row.id for row in existing if row.id not in kept_ids]
+    
+    new_inputs = embedding_inputs(prepared)
+    try:
+        embeddings = await generate_embeddings([new_inputs[i] for i in changed_indexes], api_key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    
+    # Row lock serializes concurrent updates; held only for the writes
+    db_document = (await db.execute(
+        select(Document).where(Document.id == document_id).with_for_update()
+    )).scalars().first()
+    if not db_document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    # The diff above is only valid against the content it was computed from
+    if (db_document.content or "") != old_content:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Document was modified during the update; please retry")
+    
+    if removed_ids:
+        await db.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(removed_ids)))
+    if moved:
+        # ORM bulk UPDATE by primary key (one executemany)
+        await db.execute(update(DocumentChunk), moved)
+    await bulk_insert_async(
+        db, DocumentChunk, chunk_rows(document_id, changed_indexes, prepared, embeddings),
+        batch_size=DOCUMENT_CHUNK_BATCH_SIZE
+    )
+    
+    db_document.filename = file.filename
+    db_document.file_type = file_ext
+    db_document.content = prepared['text']
+    db_document.summary = prepared['summary']
+    
+    await db.commit()
+    await db.refresh(db_document)
+    
+    return {
+        **DocumentResponse.model_validate(db_document).model_dump(),
+        'chunks_total': len(spans),
+        'chunks_reused': len(kept_ids),
+        'chunks_embedded': len(changed_indexes),
+        'chunks_removed': len(removed_ids)
+    }
+
 @router.get("", response_model=List[DocumentResponse])
-def list_documents(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """List all documents"""
-    documents = db.query(Document).offset(skip).limit(limit).all()
+def list_documents(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    file_type: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """List documents, newest first (keyset cursor in the X-Next-Cursor header)"""
+    query = db.query(Document)
+    if file_type:
+        query = query.filter(Document.file_type == file_type.lower())
+    
+    try:
+        documents, next_cursor = paginate(query, Document.uploaded_at, Document.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return documents
 
 @router.get("/{document_id}", response_model=DocumentResponse)
@@ -1,11 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer_group
+from typing import List, Optional
 from uuid import UUID
-from database import get_db
-from models import Event, Waypoint
-from schemas import EventCreate, EventUpdate, EventResponse, GPXUploadResponse
-from utils.gpx_processor import parse_gpx_file, meters_to_miles, meters_to_kilometers
+from database import get_db, get_async_db
+from models import Event, Waypoint, ROUTE_DATA_GROUP
+from schemas import EventCreate, EventUpdate, EventResponse, GPXUploadResponse, IngestJobResponse
+from utils.route_index import get_route_index
+from utils.route_storage import load_event_route, route_cache_key
+from utils.executor import PoolSaturatedError
+from utils.uploads import spooled_upload
+from utils.ingest import resolve_track, apply_track, upload_message, PLANNED, ACTUAL
+from utils.job_queue import enqueue_ingest_job
+from utils.pagination import paginate, NEXT_CURSOR_HEADER
 import uuid as uuid_module
 from datetime import datetime
 
@@ -21,9 +30,39 @@ def create_event(event: EventCreate, db: Session = Depends(get_db)):
     return db_event
 
 @router.get("", response_model=List[EventResponse])
-def list_events(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """List all events"""
-    events = db.query(Event).offset(skip).limit(limit).all()
+def list_events(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    planned_from: Optional[datetime] = None,
+    planned_to: Optional[datetime] = None,
+    has_route: Optional[bool] = None,
+    has_actual: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    List events, newest first
+    Pages with a keyset cursor: pass the X-Next-Cursor response header back as ?cursor=
+    (route/track JSON stays deferred; EventResponse never reads it)
+    """
+    query = db.query(Event)
+    
+    if planned_from is not None:
+        query = query.filter(Event.planned_date >= planned_from)
+    if planned_to is not None:
+        query = query.filter(Event.planned_date <= planned_to)
+    if has_route is not None:
+        query = query.filter(Event.route_id.isnot(None) if has_route else Event.route_id.is_(None))
+    if has_actual is not None:
+        query = query.filter(Event.actual_route_id.isnot(None) if has_actual else Event.actual_route_id.is_(None))
+    
+    try:
+        events, next_cursor = paginate(query, Event.created_at, Event.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return events
 
 @router.get("/{event_id}", response_model=EventResponse)
@@ -64,7 +103,7 @@ def delete_event(event_id: UUID, db: Session = Depends(get_db)):
 def duplicate_event(event_id: UUID, db: Session = Depends(get_db)):
     """Duplicate an event with all its waypoints"""
     # Get original event
-    original_event = db.query(Event).filter(Event.id == event_id).first()
+    original_event = db.query(Event).options(undefer_group(ROUTE_DATA_GROUP)).filter(Event.id == event_id).first()
     if not original_event:
         raise HTTPException(status_code=404, detail="Event not found")
     
@@ -78,6 +117,8 @@ def duplicate_event(event_id: UUID, db: Session = Depends(get_db)):
         elevation_gain_adjustment_percent=original_event.elevation_gain_adjustment_percent,
         elevation_descent_adjustment_percent=original_event.elevation_descent_adjustment_percent,
         fatigue_slowdown_percent=original_event.fatigue_slowdown_percent,
+        grade_adjusted_pace=original_event.grade_adjusted_pace,
+        route_id=original_event.route_id,  # route rows are immutable, so copies share them
         gpx_route=original_event.gpx_route,
         gpx_metadata=original_event.gpx_metadata,
         created_at=datetime.utcnow()
@@ -100,6 +141,8 @@ def duplicate_event(event_id: UUID, db: Session = Depends(get_db)):
             comments=orig_waypoint.comments,
             order_index=orig_waypoint.order_index,
             distance_from_start=orig_waypoint.distance_from_start,
+            route_position=orig_waypoint.route_position,
+            snapped_route_id=orig_waypoint.snapped_route_id,
             created_at=datetime.utcnow()
         )
         db.add(new_waypoint)
@@ -111,154 +154,93 @@ def duplicate_event(event_id: UUID, db: Session = Depends(get_db)):
     
     return new_event
 
-@router.post("/{event_id}/upload-gpx", response_model=GPXUploadResponse)
-async def upload_gpx(event_id: UUID, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Upload and process GPX file for an event"""
-    event = db.query(Event).filter(Event.id == event_id).first()
+async def _upload_track(event_id: UUID, kind: str, file: UploadFile, background: bool, db: AsyncSession):
+    """Shared upload flow for planned and actual tracks"""
+    event = await db.get(Event, event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    # Read GPX file
-    content = await file.read()
-    gpx_content = content.decode('utf-8')
-    
-    try:
-        # Parse and optimize GPX
-        gpx_data = parse_gpx_file(gpx_content)
-        
-        # Store optimized route and metadata
-        event.gpx_route = {"coordinates": gpx_data["coordinates"]}
-        event.gpx_metadata = {
-            "total_distance_meters": gpx_data["total_distance_meters"],
-            "elevation_gain_meters": gpx_data["elevation_gain_meters"],
-            "elevation_loss_meters": gpx_data["elevation_loss_meters"],
-            "min_elevation": gpx_data["min_elevation"],
-            "max_elevation": gpx_data["max_elevation"],
-            "bounding_box": gpx_data["bounding_box"],
-            "original_points": gpx_data["original_points"],
-            "simplified_points": gpx_data["simplified_points"],
-            "has_timestamps": gpx_data.get("has_timestamps", False),
-            "timestamp_duration_minutes": gpx_data.get("timestamp_duration_minutes"),
-            "first_timestamp": gpx_data.get("first_timestamp"),
-            "last_timestamp": gpx_data.get("last_timestamp")
-        }
-        
-        # Update event distance if not set
-        if not event.distance:
-            distance_miles = meters_to_miles(gpx_data["total_distance_meters"])
-            event.distance = distance_miles
-        
-        # Delete existing waypoints for clean start
-        db.query(Waypoint).filter(Waypoint.event_id == event_id).delete()
-        
-        # Create START waypoint at first coordinate
-        coords = gpx_data["coordinates"]
-        if coords and len(coords) > 0:
-            start_coord = coords[0]
-            start_waypoint = Waypoint(
-                event_id=event_id,
-                name="START",
-                waypoint_type="checkpoint",
-                latitude=start_coord[0],
-                longitude=start_coord[1],
-                elevation=start_coord[2] if len(start_coord) > 2 else None,
-                stop_time_minutes=0,
-                order_index=0,
-                distance_from_start=0,
-                comments="Start of route"
-            )
-            db.add(start_waypoint)
-            
-            # Create FINISH waypoint at last coordinate
-            finish_coord = coords[-1]
-            finish_waypoint = Waypoint(
-                event_id=event_id,
-                name="FINISH",
-                waypoint_type="checkpoint",
-                latitude=finish_coord[0],
-                longitude=finish_coord[1],
-                elevation=finish_coord[2] if len(finish_coord) > 2 else None,
-                stop_time_minutes=0,
-                order_index=999999,  # Large number to keep it at end
-                distance_from_start=gpx_data["total_distance_meters"],
-                comments="End of route"
-            )
-            db.add(finish_waypoint)
-        
-        db.commit()
-        
-        message = f"GPX file processed successfully. {gpx_data['simplified_points']} points from {gpx_data['original_points']} original. Start and Finish waypoints created."
-        if gpx_data.get("has_timestamps"):
-            duration_hours = gpx_data.get("timestamp_duration_minutes", 0) / 60
-            message += f" Timestamps detected (duration: {duration_hours:.1f} hours)."
-        
-        return GPXUploadResponse(
-            success=True,
-            message=message,
-            metadata=event.gpx_metadata
+    if background:
+        # Return immediately; poll GET /api/jobs/{job_id} for progress
+        job = await enqueue_ingest_job(db, event_id, kind, file)
+        return JSONResponse(
+            status_code=202,
+            content=jsonable_encoder(IngestJobResponse.model_validate(job))
         )
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing GPX file: {str(e)}")
-
-@router.post("/{event_id}/upload-actual", response_model=GPXUploadResponse)
-async def upload_actual_gpx(event_id: UUID, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Upload actual GPX/TCX file for post-race analysis"""
-    event = db.query(Event).filter(Event.id == event_id).first()
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
-    
-    # Read file
-    content = await file.read()
-    file_content = content.decode('utf-8')
     
     try:
-        # Parse GPX (TCX support can be added later)
-        gpx_data = parse_gpx_file(file_content)
-        
-        # Store actual data with timestamp information
-        event.actual_gpx_data = {
-            "coordinates": gpx_data["coordinates"],
-            "metadata": {
-                "total_distance_meters": gpx_data["total_distance_meters"],
-                "elevation_gain_meters": gpx_data["elevation_gain_meters"],
-                "elevation_loss_meters": gpx_data["elevation_loss_meters"],
-                "has_timestamps": gpx_data.get("has_timestamps", False),
-                "timestamp_duration_minutes": gpx_data.get("timestamp_duration_minutes"),
-                "first_timestamp": gpx_data.get("first_timestamp"),
-                "last_timestamp": gpx_data.get("last_timestamp")
-            }
-        }
+        # Reuse the route of an identical earlier upload, or parse, optimize
+        # and encode the track in the process pool
+        async with spooled_upload(file) as spooled:
+            route, gpx_data = await resolve_track(db, spooled.sha256, spooled.path)
         
-        db.commit()
-        
-        message = "Actual route uploaded successfully"
-        if gpx_data.get("has_timestamps"):
-            duration_hours = gpx_data.get("timestamp_duration_minutes", 0) / 60
-            message += f" with timestamps (duration: {duration_hours:.1f} hours)"
+        metadata = await apply_track(db, event, kind, route, gpx_data)
+        await db.commit()
         
         return GPXUploadResponse(
             success=True,
-            message=message,
-            metadata=event.actual_gpx_data.get("metadata")
+            message=upload_message(kind, gpx_data),
+            metadata=metadata
         )
+    except PoolSaturatedError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
+        label = "GPX file" if kind == PLANNED else "file"
+        raise HTTPException(status_code=400, detail=f"Error processing {label}: {str(e)}")
+
+@router.post("/{event_id}/upload-gpx", response_model=GPXUploadResponse, responses={202: {"model": IngestJobResponse}})
+async def upload_gpx(event_id: UUID, file: UploadFile = File(...), background: bool = False,
+                     db: AsyncSession = Depends(get_async_db)):
+    """
+    Upload and process GPX file for an event
+    With ?background=true, returns 202 and an ingest job to poll instead of waiting
+    (503 with Retry-After if the processing pool is full)
+    """
+    return await _upload_track(event_id, PLANNED, file, background, db)
+
+@router.post("/{event_id}/upload-actual", response_model=GPXUploadResponse, responses={202: {"model": IngestJobResponse}})
+async def upload_actual_gpx(event_id: UUID, file: UploadFile = File(...), background: bool = False,
+                            db: AsyncSession = Depends(get_async_db)):
+    """Upload actual GPX/TCX file for post-race analysis (?background=true queues it as a job)"""
+    return await _upload_track(event_id, ACTUAL, file, background, db)
 
 @router.get("/{event_id}/route")
 def get_route(event_id: UUID, db: Session = Depends(get_db)):
     """Get optimized route data for an event"""
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = db.query(Event).options(undefer_group(ROUTE_DATA_GROUP)).filter(Event.id == event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    if not event.gpx_route:
+    route = load_event_route(event)
+    if route is None:
         raise HTTPException(status_code=404, detail="No route data available")
     
     return {
-        "route": event.gpx_route,
+        "route": route.to_json(),
         "metadata": event.gpx_metadata
     }
 
+@router.get("/{event_id}/route/locate")
+def locate_on_route(event_id: UUID, distance_meters: float, db: Session = Depends(get_db)):
+    """Get the point on the route at a distance from the start (for placing waypoints)"""
+    event = db.query(Event).options(undefer_group(ROUTE_DATA_GROUP)).filter(Event.id == event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    route = load_event_route(event)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No route data available")
+    
+    route_index = get_route_index(route_cache_key(event), route.coordinates, route.profile)
+    snap = route_index.snap_at_position(route.profile.position_at_distance(distance_meters))
+    
+    return {
+        "latitude": snap.latitude,
+        "longitude": snap.longitude,
+        "elevation": snap.elevation,
+        "distance_from_start": snap.distance_from_start
+    }
+
 @router.get("/{event_id}/waypoints")
 def get_event_waypoints(event_id: UUID, db: Session = Depends(get_db)):
     """Get all waypoints for an event"""
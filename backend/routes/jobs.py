@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID
+from database import get_async_db
+from models import IngestJob
+from schemas import IngestJobResponse
+
+router = APIRouter()
+
+@router.get("/{job_id}", response_model=IngestJobResponse)
+async def get_job(job_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    """Get the status, stage and progress of a background ingest job"""
+    job = await db.get(IngestJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -4,10 +4,33 @@ from uuid import UUID
 from database import get_db
 from models import Waypoint, Event
 from schemas import WaypointCreate, WaypointUpdate, WaypointResponse
-from utils.gpx_processor import find_closest_point_on_route
+from utils.route_index import get_route_index, course_order_key, snap_between_neighbours
+from utils.route_storage import load_event_route, route_cache_key
 
 router = APIRouter()
 
+def snap_in_course_order(db: Session, event: Event, db_waypoint: Waypoint):
+    """
+    Snap a waypoint onto the event's route between its neighbours in course order
+    (None if the event has no route)
+    """
+    route = load_event_route(event)
+    if route is None:
+        return None
+    route_index = get_route_index(route_cache_key(event), route.coordinates, route.profile)
+    waypoints = db.query(Waypoint).filter(Waypoint.event_id == event.id).all()
+    if db_waypoint not in waypoints:
+        waypoints.append(db_waypoint)
+    waypoints.sort(key=course_order_key)
+    return snap_between_neighbours(route_index, waypoints, db_waypoint)
+
+def make_room(db: Session, event_id: UUID, order_index: int, exclude_id: UUID = None) -> None:
+    """Shift waypoints at or after order_index one place later in the sequence"""
+    query = db.query(Waypoint).filter(Waypoint.event_id == event_id, Waypoint.order_index >= order_index)
+    if exclude_id is not None:
+        query = query.filter(Waypoint.id != exclude_id)
+    query.update({Waypoint.order_index: Waypoint.order_index + 1})
+
 @router.post("", response_model=WaypointResponse, status_code=201)
 def create_waypoint(waypoint: WaypointCreate, db: Session = Depends(get_db)):
     """Create a new waypoint"""
@@ -19,21 +42,20 @@ def create_waypoint(waypoint: WaypointCreate, db: Session = Depends(get_db)):
     # Create waypoint
     db_waypoint = Waypoint(**waypoint.model_dump())
     
+    # Place it in the sequence: at the requested index, else after the others
+    if waypoint.order_index is not None:
+        make_room(db, waypoint.event_id, waypoint.order_index)
+    else:
+        db_waypoint.order_index = db.query(Waypoint).filter(Waypoint.event_id == waypoint.event_id).count()
+    
     # Calculate distance from start if route exists
-    if event.gpx_route and "coordinates" in event.gpx_route:
-        coords = event.gpx_route["coordinates"]
-        closest_index, distance_from_start = find_closest_point_on_route(
-            coords, waypoint.latitude, waypoint.longitude
-        )
-        db_waypoint.distance_from_start = distance_from_start
+    snap = snap_in_course_order(db, event, db_waypoint)
+    if snap is not None:
+        db_waypoint.distance_from_start = snap.distance_from_start
         
         # Get elevation from route if not provided
-        if not db_waypoint.elevation and closest_index < len(coords):
-            db_waypoint.elevation = coords[closest_index][2]
-    
-    # Calculate order index
-    max_order = db.query(Waypoint).filter(Waypoint.event_id == waypoint.event_id).count()
-    db_waypoint.order_index = max_order
+        if not db_waypoint.elevation:
+            db_waypoint.elevation = snap.elevation
     
     db.add(db_waypoint)
     db.commit()
@@ -56,18 +78,21 @@ def update_waypoint(waypoint_id: UUID, waypoint_update: WaypointUpdate, db: Sess
         raise HTTPException(status_code=404, detail="Waypoint not found")
     
     update_data = waypoint_update.model_dump(exclude_unset=True)
+    if update_data.get('order_index', 0) is None:
+        del update_data['order_index']
+    if 'order_index' in update_data:
+        make_room(db, db_waypoint.event_id, update_data['order_index'], exclude_id=db_waypoint.id)
     for key, value in update_data.items():
         setattr(db_waypoint, key, value)
     
-    # Recalculate distance if position changed
-    if 'latitude' in update_data or 'longitude' in update_data:
+    # Recalculate distance if position (or place in the sequence) changed
+    if 'latitude' in update_data or 'longitude' in update_data or 'order_index' in update_data:
+        # Cached course position is stale; the next leg calculation re-snaps it
+        db_waypoint.route_position = None
         event = db.query(Event).filter(Event.id == db_waypoint.event_id).first()
-        if event and event.gpx_route and "coordinates" in event.gpx_route:
-            coords = event.gpx_route["coordinates"]
-            closest_index, distance_from_start = find_closest_point_on_route(
-                coords, db_waypoint.latitude, db_waypoint.longitude
-            )
-            db_waypoint.distance_from_start = distance_from_start
+        snap = snap_in_course_order(db, event, db_waypoint) if event else None
+        if snap is not None:
+            db_waypoint.distance_from_start = snap.distance_from_start
     
     db.commit()
     db.refresh(db_waypoint)
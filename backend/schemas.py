@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from uuid import UUID
 from models import WaypointType, DistanceUnit, ElevationUnit
@@ -13,6 +13,7 @@ class EventBase(BaseModel):
     elevation_gain_adjustment_percent: float = 0
     elevation_descent_adjustment_percent: float = 0
     fatigue_slowdown_percent: float = 0
+    grade_adjusted_pace: bool = False
 
 class EventCreate(EventBase):
     pass
@@ -25,6 +26,7 @@ class EventUpdate(BaseModel):
     elevation_gain_adjustment_percent: Optional[float] = None
     elevation_descent_adjustment_percent: Optional[float] = None
     fatigue_slowdown_percent: Optional[float] = None
+    grade_adjusted_pace: Optional[bool] = None
 
 class EventResponse(EventBase):
     model_config = ConfigDict(from_attributes=True)
@@ -46,6 +48,7 @@ class WaypointBase(BaseModel):
 
 class WaypointCreate(WaypointBase):
     event_id: UUID
+    order_index: Optional[int] = None  # place in the course sequence (default: after the others)
 
 class WaypointUpdate(BaseModel):
     name: Optional[str] = None
@@ -55,6 +58,7 @@ class WaypointUpdate(BaseModel):
     elevation: Optional[float] = None
     stop_time_minutes: Optional[int] = None
     comments: Optional[str] = None
+    order_index: Optional[int] = None
 
 class WaypointResponse(WaypointBase):
     model_config = ConfigDict(from_attributes=True)
@@ -77,6 +81,7 @@ class CalculatedLegResponse(BaseModel):
     leg_distance: Optional[float] = None
     elevation_gain: Optional[float] = None
     elevation_loss: Optional[float] = None
+    grade_adjusted_distance: Optional[float] = None
     base_pace: Optional[float] = None
     adjusted_pace: Optional[float] = None
     expected_arrival_time: Optional[datetime] = None
@@ -96,6 +101,12 @@ class DocumentResponse(BaseModel):
     summary: Optional[str] = None
     uploaded_at: datetime
 
+class DocumentUpdateResponse(DocumentResponse):
+    chunks_total: int
+    chunks_reused: int  # unchanged chunks kept with their vectors
+    chunks_embedded: int  # new or changed chunks sent for embedding
+    chunks_removed: int
+
 # Settings Schemas
 class SettingsBase(BaseModel):
     distance_unit: DistanceUnit = DistanceUnit.miles
@@ -153,3 +164,100 @@ class GPXUploadResponse(BaseModel):
     message: str
     metadata: Optional[dict] = None
 
+# Background ingest job
+class IngestJobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: UUID
+    event_id: UUID
+    kind: str
+    status: str
+    stage: Optional[str] = None
+    progress_percent: int = 0
+    filename: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# Pacing scenarios (what-if grid over the pace model parameters)
+class ScenarioRequest(BaseModel):
+    # Every combination of the listed values is evaluated; omitted = the event's current value
+    target_durations_minutes: Optional[List[float]] = Field(None, min_length=1)
+    elevation_gain_adjustments: Optional[List[float]] = Field(None, min_length=1)
+    elevation_descent_adjustments: Optional[List[float]] = Field(None, min_length=1)
+    fatigue_slowdowns: Optional[List[float]] = Field(None, min_length=1)
+
+class ScenarioLeg(BaseModel):
+    leg_number: int
+    waypoint_id: Optional[UUID] = None
+    waypoint_name: Optional[str] = None
+    leg_distance: float
+    elevation_gain: float
+    elevation_loss: float
+    stop_time_minutes: int
+
+class ScenarioResult(BaseModel):
+    target_duration_minutes: float
+    elevation_gain_adjustment_percent: float
+    elevation_descent_adjustment_percent: float
+    fatigue_slowdown_percent: float
+    leg_duration_minutes: List[float]  # per leg, in leg order
+    adjusted_pace: List[float]  # minutes per mile, per leg
+    arrival_minutes: List[float]  # elapsed time at each waypoint arrival
+
+class ScenarioResponse(BaseModel):
+    legs: List[ScenarioLeg]
+    scenarios: List[ScenarioResult]
+
+# Monte Carlo finish-time simulation
+class SimulationRequest(BaseModel):
+    runs: int = Field(10000, ge=1)
+    seed: Optional[int] = Field(None, ge=0)  # omit for a random seed (returned in the response)
+    pace_variability_percent: float = Field(8, ge=0)  # whole-day form
+    leg_variability_percent: float = Field(5, ge=0)
+    stop_variability_percent: float = Field(30, ge=0)
+    fatigue_variability_percent: float = Field(5, ge=0)  # percentage points
+    percentiles: List[float] = Field(default_factory=lambda: [10, 50, 90], min_length=1)
+    cutoffs_minutes: Dict[UUID, float] = Field(default_factory=dict)  # waypoint id -> elapsed-minute cutoff
+
+class SimulationWaypoint(BaseModel):
+    leg_number: int
+    waypoint_id: Optional[UUID] = None
+    waypoint_name: Optional[str] = None
+    planned_arrival_minutes: float
+    arrival_percentiles: Dict[str, float]  # "p10" -> elapsed minutes
+    cutoff_minutes: Optional[float] = None
+    cutoff_miss_probability: Optional[float] = None
+
+class SimulationResponse(BaseModel):
+    runs: int
+    seed: int
+    finish_percentiles: Dict[str, float]
+    waypoints: List[SimulationWaypoint]
+
+# Inverse solver: feasible target durations
+class PaceBounds(BaseModel):
+    min_pace: Optional[float] = Field(None, gt=0)  # fastest allowed, minutes per mile
+    max_pace: Optional[float] = Field(None, gt=0)  # slowest allowed, minutes per mile
+
+class TargetSolveRequest(BaseModel):
+    cutoffs_minutes: Dict[UUID, float] = Field(default_factory=dict)  # waypoint id -> elapsed-minute cutoff
+    min_pace: Optional[float] = Field(None, gt=0)  # applies to every leg
+    max_pace: Optional[float] = Field(None, gt=0)
+    leg_pace_bounds: Dict[UUID, PaceBounds] = Field(default_factory=dict)  # by leg end waypoint id; overrides the above
+
+class BindingConstraint(BaseModel):
+    kind: str  # cutoff, min_pace, max_pace or stop_time
+    leg_number: Optional[int] = None
+    waypoint_id: Optional[UUID] = None
+    waypoint_name: Optional[str] = None
+
+class TargetSolveResponse(BaseModel):
+    feasible: bool
+    min_target_duration_minutes: float
+    max_target_duration_minutes: Optional[float] = None  # None = no cutoff or pace bound limits it
+    lower_binding: Optional[BindingConstraint] = None
+    upper_binding: Optional[BindingConstraint] = None
+    current_target_feasible: Optional[bool] = None
@@ -0,0 +1,62 @@
+"""
+Bulk inserts: rows go out as a few multi-row statements
+"""
+
+import asyncio
+import uuid
+
+from sqlalchemy.dialects import postgresql
+from models import CalculatedLeg, DocumentChunk
+from utils.bulk import MAX_BIND_PARAMETERS, batched, bulk_insert, bulk_insert_async
+
+
+class RecordingSession:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+
+class AsyncRecordingSession(RecordingSession):
+    async def execute(self, statement):
+        self.statements.append(statement)
+
+
+def leg_rows(count):
+    event_id = uuid.uuid4()
+    return [{"id": uuid.uuid4(), "event_id": event_id, "leg_number": n, "leg_distance": float(n)}
+            for n in range(1, count + 1)]
+
+
+def test_batches_cover_every_row_once():
+    rows = leg_rows(1201)
+    batches = list(batched(rows, 500))
+    assert [len(b) for b in batches] == [500, 500, 201]
+    assert [r for b in batches for r in b] == rows
+    assert list(batched([], 500)) == []
+
+
+def test_batch_size_respects_the_bind_parameter_limit():
+    wide = [{f"c{i}": i for i in range(100)}] * 1000
+    assert max(len(b) for b in batched(wide, 500)) * 100 <= MAX_BIND_PARAMETERS
+
+
+def test_bulk_insert_sends_one_statement_per_batch():
+    db = RecordingSession()
+    rows = leg_rows(60)
+    assert bulk_insert(db, CalculatedLeg, rows, on_conflict=lambda stmt: stmt.on_conflict_do_update(
+        constraint="uq_calculated_legs_event_leg", set_={"leg_distance": stmt.excluded.leg_distance})) == 60
+
+    assert len(db.statements) == 1
+    sql = str(db.statements[0].compile(dialect=postgresql.dialect()))
+    assert sql.count("VALUES") == 1 and "ON CONFLICT ON CONSTRAINT uq_calculated_legs_event_leg" in sql
+    assert len(db.statements[0].compile(dialect=postgresql.dialect()).params) == 60 * 4
+
+
+def test_bulk_insert_async_batches_document_chunks():
+    db = AsyncRecordingSession()
+    rows = [{"id": uuid.uuid4(), "document_id": uuid.uuid4(), "chunk_index": i, "chunk_text": "text"}
+            for i in range(300)]
+    assert asyncio.run(bulk_insert_async(db, DocumentChunk, rows, batch_size=100)) == 300
+    assert len(db.statements) == 3
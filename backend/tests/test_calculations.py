@@ -0,0 +1,60 @@
+"""
+Incremental leg calculation: only stale waypoints are re-snapped
+"""
+
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from routes.calculations import snap_stale_waypoints
+from utils.route_index import RouteIndex
+from tests.test_route_index import route_from_meters, point_from_meters
+
+ROUTE_ID = uuid.uuid4()
+
+
+def waypoint(x, y):
+    lat, lon = point_from_meters(x, y)
+    return SimpleNamespace(id=uuid.uuid4(), latitude=lat, longitude=lon, route_position=None,
+                           distance_from_start=None, snapped_route_id=None)
+
+
+@pytest.fixture
+def out_and_back():
+    x = np.concatenate((np.linspace(0, 1000, 101), np.linspace(1000, 0, 101)))
+    y = np.concatenate((np.zeros(101), np.full(101, 10.0)))
+    return RouteIndex(route_from_meters(x, y))
+
+
+@pytest.fixture
+def course():
+    # START, aid out, turnaround, same aid on the way back, FINISH
+    return [waypoint(0, 0), waypoint(500, 4), waypoint(1000, 5), waypoint(500, 4), waypoint(0, 10)]
+
+
+def test_first_calculation_snaps_everything_in_order(out_and_back, course):
+    resnapped = snap_stale_waypoints(out_and_back, course, ROUTE_ID)
+    assert resnapped == {wp.id for wp in course}
+    assert [wp.distance_from_start for wp in course] == pytest.approx([0, 500, 1005, 1510, 2010], abs=1)
+    assert all(wp.snapped_route_id == ROUTE_ID for wp in course)
+
+
+def test_only_moved_waypoint_is_resnapped_between_its_neighbours(out_and_back, course):
+    snap_stale_waypoints(out_and_back, course, ROUTE_ID)
+    before = [wp.route_position for wp in course]
+
+    inbound = course[3]
+    inbound.latitude, inbound.longitude = point_from_meters(400, 6)
+    inbound.route_position = None
+
+    assert snap_stale_waypoints(out_and_back, course, ROUTE_ID) == {inbound.id}
+    # Still on the return pass, not the nearer-by-index outbound one
+    assert inbound.distance_from_start == pytest.approx(1610, abs=1)
+    assert [wp.route_position for i, wp in enumerate(course) if i != 3] == [p for i, p in enumerate(before) if i != 3]
+
+
+def test_new_route_resnaps_every_waypoint(out_and_back, course):
+    snap_stale_waypoints(out_and_back, course, ROUTE_ID)
+    assert snap_stale_waypoints(out_and_back, course, uuid.uuid4()) == {wp.id for wp in course}
+    assert snap_stale_waypoints(out_and_back, course, None) == {wp.id for wp in course}
@@ -0,0 +1,158 @@
+"""
+Span chunker against a byte-level stand-in tokenizer (one token per UTF-8
+byte), so no encoding files are downloaded
+"""
+
+import logging
+import random
+
+import numpy as np
+import pytest
+from utils import chunking, text_processor
+from utils.chunking import (
+    chunk_range, chunk_spans, chunk_text, iter_chunk_spans, stitch_range_spans, warm_tokenizer
+)
+
+
+class ByteEncoding:
+    """Stand-in tiktoken.Encoding: each UTF-8 byte is a token"""
+    name = "bytes"
+    n_vocab = 256
+
+    def encode(self, text, disallowed_special=()):
+        return list(text.encode("utf-8"))
+
+    def encode_batch(self, texts, disallowed_special=()):
+        return [self.encode(text) for text in texts]
+
+    def decode_single_token_bytes(self, token):
+        return bytes([token])
+
+
+@pytest.fixture
+def byte_tokens(monkeypatch):
+    monkeypatch.setattr(chunking, "get_encoding", lambda: ByteEncoding())
+    monkeypatch.setattr(chunking, "_byte_length_tables", {})
+
+
+def multibyte_text(length=4000, seed=5):
+    rng = random.Random(seed)
+    words = ["héllo", "wörld", "日本語", "😀", "naïve", "plain", "ascii", "Ωmega"]
+    text = ""
+    while len(text) < length:
+        text += rng.choice(words) + rng.choice([" ", " ", ". ", "\n"])
+    return text.strip()
+
+
+def test_spans_slice_multibyte_text(byte_tokens):
+    text = multibyte_text()
+    spans = chunk_spans(text, boundary_lookback=None)
+
+    assert len(spans) > 5
+    assert spans[0].start == 0 and spans[-1].end == len(text)
+    for span, following in zip(spans, spans[1:]):
+        assert following.start < span.end
+    for span in spans:
+        chunk = text[span.start:span.end]
+        assert chunk == chunk.strip()
+        # A window boundary inside a character moves to its start (at most 3 bytes back)
+        assert len(chunk.encode("utf-8")) <= chunking.CHUNK_SIZE_TOKENS + 3
+
+
+def test_streamed_pieces_match_whole_text(byte_tokens):
+    text = multibyte_text()
+    cuts = sorted(random.Random(9).sample(range(1, len(text)), 25))
+    pieces = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+    assert list(iter_chunk_spans(pieces)) == chunk_spans(text)
+
+
+def test_fixed_windows_overlap_by_fifty_tokens(byte_tokens):
+    text = "abcdefghij" * 230
+    spans = chunk_spans(text, boundary_lookback=None)
+
+    assert [span.start for span in spans] == list(range(0, len(text) - 50, 450))
+    assert all(span.end - span.start == 500 for span in spans[:-1])
+    for span, following in zip(spans, spans[1:]):
+        assert span.end - following.start == 50
+    assert spans[-1].end == len(text)
+
+
+def test_windows_end_at_paragraph_breaks(byte_tokens):
+    paragraph = "Runners refill at every aid station. Crews wait at the big ones.\n\n"
+    text = (paragraph * 40).strip()
+    spans = chunk_spans(text)
+
+    assert len(spans) > 3
+    for span in spans[:-1]:
+        assert text[span.end:span.end + 2] == "\n\n"
+        assert span.token_count <= 500
+
+
+def test_windows_fall_back_to_sentence_ends(byte_tokens):
+    text = " ".join(f"Leg {n} climbs to the ridge." for n in range(120))
+    spans = chunk_spans(text)
+
+    assert len(spans) > 3
+    for span in spans[:-1]:
+        assert text[span.end - 1] == "."
+        assert text[span.end] == " "
+
+
+def test_chunk_text_is_the_span_text(byte_tokens):
+    text = multibyte_text(1500)
+    assert chunk_text(text) == [text[span.start:span.end] for span in chunk_spans(text)]
+    assert text_processor.chunk_text is chunk_text
+
+
+def test_byte_lengths_are_filled_only_for_seen_tokens(byte_tokens):
+    text = "plain ascii only"
+    chunk_spans(text)
+    table = chunking._byte_length_tables[ByteEncoding.name]
+    assert set(np.flatnonzero(table >= 0)) == set(text.encode())
+
+
+def test_warm_tokenizer_logs_instead_of_raising(monkeypatch, caplog):
+    def unavailable():
+        raise OSError("no network")
+
+    monkeypatch.setattr(chunking, "get_encoding", unavailable)
+    with caplog.at_level(logging.WARNING, logger=chunking.__name__):
+        warm_tokenizer()
+    assert "Tokenizer warm-up failed" in caplog.text
+
+
+def stitched(text, cuts, **options):
+    bounds = [0] + cuts + [len(text)]
+    ranges = [(b - a, *chunk_range([text[a:b]], **options)) for a, b in zip(bounds, bounds[1:])]
+    return stitch_range_spans(text, ranges, **options)
+
+
+@pytest.mark.parametrize("cuts", [
+    [1200, 2600],
+    [950, 1000, 1030],  # short ranges are carried into the next seam
+    [500, 1000, 1500],
+    [480],
+])
+def test_stitched_ranges_overlap_across_seams(byte_tokens, cuts):
+    text = "abcdefghij" * 300
+    spans = stitched(text, cuts, boundary_lookback=None)
+
+    serial = chunk_range([text[:cuts[0]]], boundary_lookback=None)[0]
+    assert spans[:len(serial)] == serial
+    assert spans[0].start == 0 and spans[-1].end == len(text)
+    for span, following in zip(spans, spans[1:]):
+        assert span.end - span.start <= 500
+        assert span.start < following.start and span.end - following.start >= 50
+
+
+def test_stitched_ranges_cover_multibyte_text(byte_tokens):
+    text = multibyte_text(6000)
+    cuts = [1000, 2300, 2350, 4100]
+    spans = stitched(text, cuts)
+
+    covered = np.zeros(len(text), dtype=bool)
+    for span in spans:
+        covered[span.start:span.end] = True
+        assert text[span.start:span.end] == text[span.start:span.end].strip()
+    assert all(covered[i] for i, c in enumerate(text) if not c.isspace())
+    assert [span.start for span in spans] == sorted(span.start for span in spans)
@@ -0,0 +1,18 @@
+"""
+Database engines: sync and async share one pool configuration
+"""
+
+import database
+
+
+def test_async_engine_uses_asyncpg():
+    assert database.async_engine.url.drivername == "postgresql+asyncpg"
+    assert database.async_engine.url.database == database.engine.url.database
+
+
+def test_engines_share_pool_settings():
+    for pool in (database.engine.pool, database.async_engine.sync_engine.pool):
+        assert pool.size() == database.DB_POOL_SIZE
+        assert pool._max_overflow == database.DB_MAX_OVERFLOW
+        assert pool._recycle == database.DB_POOL_RECYCLE_SECONDS
+        assert pool._pre_ping == database.DB_POOL_PRE_PING
@@ -0,0 +1,33 @@
+"""
+Deferred Event route data: plain queries leave the bulky JSON columns out
+"""
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import undefer_group
+from models import Event, ROUTE_DATA_GROUP
+from schemas import EventResponse
+
+ROUTE_DATA_COLUMNS = ("gpx_route", "actual_gpx_data", "actual_tcx_data")
+
+
+def selected_columns(statement) -> str:
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    return sql.split(" FROM ")[0]
+
+
+def test_route_data_is_deferred_by_default():
+    columns = selected_columns(select(Event))
+    assert "events.gpx_metadata" in columns
+    for name in ROUTE_DATA_COLUMNS:
+        assert f"events.{name}" not in columns
+
+
+def test_undefer_group_loads_route_data():
+    columns = selected_columns(select(Event).options(undefer_group(ROUTE_DATA_GROUP)))
+    for name in ROUTE_DATA_COLUMNS:
+        assert f"events.{name}" in columns
+
+
+def test_event_response_does_not_read_route_data():
+    assert not set(ROUTE_DATA_COLUMNS) & set(EventResponse.model_fields)
@@ -0,0 +1,137 @@
+"""
+Document update: chunks diffed on their text, embedded outside the transaction,
+and written under a row lock only if the document is unchanged
+"""
+
+import asyncio
+import io
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from routes import documents
+from utils import uploads
+from utils.chunking import ChunkSpan
+
+DOCUMENT_ID = uuid.uuid4()
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.value[0] if isinstance(self.value, list) else self.value
+
+    def all(self):
+        return self.value
+
+
+class FakeSession:
+    """Replies to each execute() with the next queued value and logs every call"""
+
+    def __init__(self, log, *replies):
+        self.log = log
+        self.replies = list(replies)
+
+    async def execute(self, statement, params=None):
+        self.log.append(("execute", str(statement)))
+        return FakeResult(self.replies.pop(0) if self.replies else None)
+
+    async def rollback(self):
+        self.log.append(("rollback",))
+
+    async def commit(self):
+        self.log.append(("commit",))
+
+    async def refresh(self, instance):
+        pass
+
+
+def document(content):
+    return SimpleNamespace(id=DOCUMENT_ID, filename="notes.txt", file_type="txt", summary="old",
+                           content=content, uploaded_at=datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+
+def stored_chunk(index, text):
+    """A legacy row that stores its text"""
+    return SimpleNamespace(id=uuid.uuid4(), chunk_index=index, chunk_text=text, chunk_with_summary=f"S {text}",
+                           start_offset=None, end_offset=None)
+
+
+@pytest.fixture
+def update(monkeypatch, tmp_path):
+    """Run update_document on a revised file whose chunks are ["b", "new", "c"]"""
+    prepared = {
+        "text": "b new c",
+        "summary": "new summary",
+        "spans": [ChunkSpan(0, 1, 1), ChunkSpan(2, 5, 1), ChunkSpan(6, 7, 1)],
+    }
+    log = []
+
+    async def load_document(path, filename):
+        with open(path, "rb") as f:
+            assert f.read() == b"b new c"
+        return prepared
+
+    async def generate_embeddings(texts, api_key):
+        log.append(("embed", list(texts)))
+        return [[0.0] * 3 for _ in texts]
+
+    async def bulk_insert_async(db, model, rows, **kwargs):
+        log.append(("insert", [(row["start_offset"], row["end_offset"]) for row in rows]))
+        return len(rows)
+
+    async def get_openai_api_key(db):
+        return "key"
+
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(documents, "load_document", load_document)
+    monkeypatch.setattr(documents, "generate_embeddings", generate_embeddings)
+    monkeypatch.setattr(documents, "bulk_insert_async", bulk_insert_async)
+    monkeypatch.setattr(documents, "get_openai_api_key", get_openai_api_key)
+
+    def run(locked_content="a b c"):
+        existing = [stored_chunk(0, "a"), stored_chunk(1, "b"), stored_chunk(2, "c")]
+        db = FakeSession(log, SimpleNamespace(content="a b c"), existing, [document(locked_content)])
+        upload = UploadFile(io.BytesIO(b"b new c"), filename="notes.txt")
+        return asyncio.run(documents.update_document(DOCUMENT_ID, upload, db))
+
+    return SimpleNamespace(run=run, log=log)
+
+
+def test_only_changed_chunks_are_embedded(update):
+    result = update.run()
+    log = update.log
+
+    assert ("embed", ["Document: new summary\n\nChunk: new"]) in log
+    assert ("insert", [(2, 5)]) in log
+    assert result["chunks_total"] == 3
+    assert (result["chunks_reused"], result["chunks_embedded"], result["chunks_removed"]) == (2, 1, 1)
+
+
+def test_embedding_runs_between_transactions(update):
+    update.run()
+    log = update.log
+
+    embed = next(i for i, entry in enumerate(log) if entry[0] == "embed")
+    assert log[embed - 1] == ("rollback",)
+    # Reads (api key is stubbed): content, chunks; then the locked re-read after embedding
+    reads = [entry[1] for entry in log[:embed] if entry[0] == "execute"]
+    assert len(reads) == 2 and not any("FOR UPDATE" in sql for sql in reads)
+    assert log[embed + 1][0] == "execute" and log[embed + 1][1].endswith("FOR UPDATE")
+    assert log[-1] == ("commit",)
+
+
+def test_concurrent_change_is_refused(update):
+    with pytest.raises(HTTPException) as error:
+        update.run(locked_content="something else")
+
+    assert error.value.status_code == 409
+    assert not any(entry[0] in ("insert", "commit") for entry in update.log)
+    assert update.log[-1] == ("rollback",)
@@ -0,0 +1,85 @@
+"""
+Embedding cache: memory, then table, then API, with each distinct text embedded once
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from utils import embedding_cache
+from utils.cache import LRUCache
+from utils.embedding_cache import cached_embeddings, text_hash
+
+
+class FakeBackends:
+    """Stand-ins for the embedding_cache table and the embeddings API"""
+
+    def __init__(self, stored=None, fail_load=False, fail_store=False):
+        self.table = {text_hash(text): [float(len(text)), 0.0] for text in (stored or [])}
+        self.fail_load = fail_load
+        self.fail_store = fail_store
+        self.loads = []
+        self.api_calls = []
+
+    async def load(self, digests):
+        self.loads.append(list(digests))
+        if self.fail_load:
+            raise ConnectionError("database unavailable")
+        return {d: np.asarray(self.table[d], dtype=np.float32) for d in digests if d in self.table}
+
+    async def store(self, embeddings):
+        if self.fail_store:
+            raise ConnectionError("database unavailable")
+        for digest, embedding in embeddings.items():
+            self.table.setdefault(digest, embedding)
+
+    async def embed(self, texts, api_key):
+        self.api_calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    fake = FakeBackends()
+    monkeypatch.setattr(embedding_cache, "_memory_cache", LRUCache(16))
+    monkeypatch.setattr(embedding_cache, "_load", fake.load)
+    monkeypatch.setattr(embedding_cache, "_store", fake.store)
+    monkeypatch.setattr(embedding_cache, "embed_texts", fake.embed)
+    return fake
+
+
+def test_repeated_texts_are_embedded_once_in_input_order(backends):
+    result = asyncio.run(cached_embeddings(["a", "bb", "a", "ccc"], "key"))
+
+    assert result == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0], [3.0, 1.0]]
+    assert backends.api_calls == [["a", "bb", "ccc"]]
+    assert set(backends.table) == {text_hash("a"), text_hash("bb"), text_hash("ccc")}
+
+
+def test_second_call_is_served_from_memory(backends):
+    asyncio.run(cached_embeddings(["a", "bb"], "key"))
+    result = asyncio.run(cached_embeddings(["bb", "a"], "key"))
+
+    assert result == [[2.0, 1.0], [1.0, 1.0]]
+    assert len(backends.api_calls) == 1
+    assert len(backends.loads) == 1
+
+
+def test_table_hits_skip_the_api(backends):
+    backends.table = FakeBackends(stored=["a"]).table
+    result = asyncio.run(cached_embeddings(["a", "bb"], "key"))
+
+    assert result == [[1.0, 0.0], [2.0, 1.0]]
+    assert backends.api_calls == [["bb"]]
+
+
+def test_cache_failures_fall_back_to_the_api(backends):
+    backends.fail_load = backends.fail_store = True
+    result = asyncio.run(cached_embeddings(["a", "bb"], "key"))
+
+    assert result == [[1.0, 1.0], [2.0, 1.0]]
+    assert backends.api_calls == [["a", "bb"]]
+
+
+def test_no_texts_touch_nothing(backends):
+    assert asyncio.run(cached_embeddings([], "key")) == []
+    assert backends.loads == [] and backends.api_calls == []
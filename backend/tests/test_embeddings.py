@@ -0,0 +1,130 @@
+"""
+Embedding client against a stub embeddings server: batching, ordering,
+retries and the concurrency limit
+"""
+
+import asyncio
+import json
+import httpx
+import openai
+import pytest
+from utils import embeddings
+from utils.embeddings import token_batches, embed_texts
+
+_sleep = asyncio.sleep
+
+
+class StubServer:
+    """
+    Stand-in for POST /embeddings: each text "t<n>" embeds as [n]
+
+    Returns items in reverse order and serves the queued error responses
+    (status, headers) before any success.
+    """
+
+    def __init__(self, errors=(), latency=0.0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body["input"])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await _sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        if self.errors:
+            status, headers = self.errors.pop(0)
+            return httpx.Response(status, headers=headers, json={"error": {"message": "stub error"}})
+        data = [
+            {"object": "embedding", "index": i, "embedding": [float(text[1:])]}
+            for i, text in enumerate(body["input"])
+        ]
+        return httpx.Response(200, json={
+            "object": "list",
+            "data": data[::-1],
+            "model": body["model"],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        })
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Route the embedding client to a StubServer; one token per text; record backoff sleeps"""
+    server = StubServer()
+    sleeps = []
+
+    async def fake_sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+        await _sleep(0)
+
+    monkeypatch.setattr(embeddings, "count_tokens", lambda texts: [1] * len(texts))
+    monkeypatch.setattr(embeddings.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(embeddings, "_http_client",
+                        httpx.AsyncClient(transport=httpx.MockTransport(server), base_url="http://stub"))
+    monkeypatch.setattr(embeddings, "_clients", {})
+    monkeypatch.setattr(embeddings, "_semaphore", None)
+    monkeypatch.setattr(embeddings, "OPENAI_BASE_URL", "http://stub/v1")
+    server.sleeps = sleeps
+    return server
+
+
+def texts(n: int):
+    return [f"t{i}" for i in range(n)]
+
+
+def test_token_batches_respect_token_limit():
+    assert token_batches([40, 40, 40, 10], max_tokens=100, max_inputs=10) == [range(0, 2), range(2, 4)]
+
+
+def test_token_batches_respect_input_limit():
+    assert token_batches([1] * 7, max_tokens=100, max_inputs=3) == [range(0, 3), range(3, 6), range(6, 7)]
+
+
+def test_token_batches_oversized_input_gets_own_batch():
+    assert token_batches([5, 500, 5], max_tokens=100, max_inputs=10) == [range(0, 1), range(1, 2), range(2, 3)]
+
+
+def tokens_each(monkeypatch, count: int):
+    monkeypatch.setattr(embeddings, "count_tokens", lambda texts: [count] * len(texts))
+
+
+def test_output_follows_input_order(stub, monkeypatch):
+    tokens_each(monkeypatch, embeddings.EMBEDDING_BATCH_MAX_TOKENS // 4)  # four texts per request
+    result = asyncio.run(embed_texts(texts(10), "key"))
+    assert result == [[float(i)] for i in range(10)]
+    # Batches run concurrently, so they may reach the server in any order
+    assert sorted(len(batch) for batch in stub.requests) == [2, 4, 4]
+
+
+def test_rate_limit_retry_honours_retry_after(stub):
+    stub.errors = [(429, {"retry-after": "7"})]
+    result = asyncio.run(embed_texts(texts(3), "key"))
+    assert result == [[0.0], [1.0], [2.0]]
+    assert len(stub.requests) == 2
+    assert stub.sleeps == [7.0]
+
+
+def test_gives_up_after_max_retries(stub, monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBEDDING_MAX_RETRIES", 2)
+    stub.errors = [(503, {})] * 10
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(embed_texts(texts(3), "key"))
+    assert len(stub.requests) == 3
+    assert len(stub.sleeps) == 2
+
+
+def test_requests_in_flight_stay_within_concurrency(stub, monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBEDDING_CONCURRENCY", 3)
+    tokens_each(monkeypatch, embeddings.EMBEDDING_BATCH_MAX_TOKENS)  # one text per request
+    stub.latency = 0.01
+    result = asyncio.run(embed_texts(texts(12), "key"))
+    assert result == [[float(i)] for i in range(12)]
+    assert len(stub.requests) == 12
+    assert stub.max_in_flight == 3
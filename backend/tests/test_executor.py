@@ -0,0 +1,83 @@
+"""
+CPU process pool: work runs in worker processes and the backlog is bounded
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+from utils import executor, uploads
+from utils.executor import PoolSaturatedError, run_cpu_bound
+from utils.route_storage import decode_route, parse_and_encode_track
+from tests.test_track_parser import GPX
+
+
+@pytest.fixture
+def pool():
+    yield executor.start_process_pool()
+    executor.shutdown_process_pool()
+
+
+@pytest.fixture
+def two_workers(monkeypatch):
+    monkeypatch.setattr(executor, "CPU_POOL_WORKERS", 2)
+    executor.shutdown_process_pool()
+    executor.start_process_pool()
+    yield
+    executor.shutdown_process_pool()
+
+
+async def collect(fn, arg_tuples, max_in_flight=None):
+    return [result async for result in executor.map_cpu_bound(fn, arg_tuples, max_in_flight)]
+
+
+def test_run_cpu_bound_returns_the_worker_result(pool):
+    assert asyncio.run(run_cpu_bound(os.getpid)) != os.getpid()
+    assert asyncio.run(run_cpu_bound(divmod, 17, 5)) == (3, 2)
+    assert executor._in_flight == 0
+
+
+def test_saturated_pool_rejects_new_work(monkeypatch):
+    monkeypatch.setattr(executor, "_in_flight", executor.CPU_POOL_WORKERS + executor.CPU_POOL_QUEUE_DEPTH)
+    with pytest.raises(PoolSaturatedError) as error:
+        asyncio.run(run_cpu_bound(divmod, 1, 1))
+    assert error.value.retry_after == executor.CPU_POOL_RETRY_AFTER_SECONDS
+
+
+def test_worker_errors_propagate(pool):
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(run_cpu_bound(divmod, 1, 0))
+    assert executor._in_flight == 0
+
+
+def test_spooled_track_is_parsed_in_the_pool(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+
+    async def upload_and_parse():
+        async with uploads.spooled_upload(UploadFile(io.BytesIO(GPX), filename="Loop.GPX")) as spooled:
+            assert spooled.path.endswith(".gpx")
+            assert spooled.sha256 == hashlib.sha256(GPX).hexdigest() and spooled.size == len(GPX)
+            return spooled.path, await run_cpu_bound(parse_and_encode_track, spooled.path)
+
+    path, track = asyncio.run(upload_and_parse())
+    assert not os.path.exists(path)
+    route = decode_route(track["encoded_route"])
+    assert route.point_count == track["simplified_points"]
+    assert route.coordinates[0].tolist() == pytest.approx(track["start_coordinate"], abs=1e-6)
+    assert route.profile.point_count == route.point_count
+
+
+def test_map_cpu_bound_keeps_input_order(two_workers):
+    args = [(n, 7) for n in range(50)]
+    assert asyncio.run(collect(divmod, args)) == [divmod(*a) for a in args]
+
+
+def test_map_cpu_bound_cancels_pending_on_failure(two_workers):
+    # The third task divides by zero; nothing may stay in flight afterwards
+    args = [(1, 1), (2, 1), (3, 0)] + [(n, 1) for n in range(20)]
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(collect(divmod, args, max_in_flight=2))
+    assert executor._in_flight == 0
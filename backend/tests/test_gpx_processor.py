@@ -0,0 +1,91 @@
+"""
+Track metrics: vectorized results match the per-point formulas
+"""
+
+import numpy as np
+import pytest
+from utils.gpx_processor import (
+    compute_track_metrics, distance_3d, haversine_distance, haversine_distances, parse_gpx_file
+)
+
+GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk><trkseg>
+    <trkpt lat="45.0000" lon="-122.0000"><ele>100</ele><time>2024-06-01T06:00:00Z</time></trkpt>
+    <trkpt lat="45.0010" lon="-122.0000"><ele>110</ele><time>2024-06-01T06:01:00Z</time></trkpt>
+    <trkpt lat="45.0020" lon="-122.0010"><ele>105</ele><time>2024-06-01T06:02:00Z</time></trkpt>
+    <trkpt lat="45.0030" lon="-122.0010"><ele>120</ele><time>2024-06-01T06:03:00Z</time></trkpt>
+  </trkseg></trk>
+</gpx>
+"""
+
+
+def random_track(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    lats = 45.0 + np.cumsum(rng.normal(0, 1e-4, n))
+    lons = -122.0 + np.cumsum(rng.normal(0, 1e-4, n))
+    eles = 500 + np.cumsum(rng.normal(0, 2, n))
+    return lats, lons, eles
+
+
+def test_haversine_distances_match_scalar():
+    lats, lons, _ = random_track(50)
+    vectorized = haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    scalar = [haversine_distance(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(49)]
+    assert np.allclose(vectorized, scalar, rtol=1e-9, atol=1e-6)
+
+
+def test_metrics_match_point_by_point_loop():
+    lats, lons, eles = random_track(500)
+    metrics = compute_track_metrics(lats, lons, eles)
+
+    distance = sum(distance_3d(lats[i], lons[i], eles[i], lats[i + 1], lons[i + 1], eles[i + 1])
+                   for i in range(499))
+    diffs = np.diff(eles)
+    assert metrics["total_distance_meters"] == pytest.approx(distance, rel=1e-9)
+    assert metrics["elevation_gain_meters"] == pytest.approx(diffs[diffs > 0].sum())
+    assert metrics["elevation_loss_meters"] == pytest.approx(-diffs[diffs < 0].sum())
+    assert metrics["min_elevation"] == pytest.approx(eles.min())
+    assert metrics["max_elevation"] == pytest.approx(eles.max())
+
+
+def test_missing_elevations_add_no_gain_or_loss():
+    lats = np.array([45.0, 45.001, 45.002, 45.003])
+    lons = np.full(4, -122.0)
+    eles = np.array([100.0, np.nan, 150.0, 140.0])
+    metrics = compute_track_metrics(lats, lons, eles)
+    # Only the last segment has an elevation at both ends
+    assert metrics["elevation_gain_meters"] == 0
+    assert metrics["elevation_loss_meters"] == pytest.approx(10)
+
+
+def test_timestamp_coverage_threshold():
+    lats, lons, eles = random_track(10)
+    times = 1.7e9 + 60.0 * np.arange(10)
+    times[[2, 5]] = np.nan  # 80% timed: enough
+    metrics = compute_track_metrics(lats, lons, eles, times)
+    assert metrics["has_timestamps"]
+    assert metrics["timestamp_duration_minutes"] == pytest.approx(9)
+
+    times[7] = np.nan  # 70%: not enough
+    metrics = compute_track_metrics(lats, lons, eles, times)
+    assert not metrics["has_timestamps"]
+    assert metrics["timestamp_duration_minutes"] is None
+
+
+def test_empty_and_single_point_tracks():
+    empty = compute_track_metrics(np.array([]), np.array([]), np.array([]))
+    assert empty["total_distance_meters"] == 0 and not empty["has_timestamps"]
+    single = compute_track_metrics(np.array([45.0]), np.array([-122.0]), np.array([100.0]))
+    assert single["total_distance_meters"] == 0 and single["max_elevation"] == 100
+
+
+def test_parse_gpx_file():
+    result = parse_gpx_file(GPX)
+    assert result["original_points"] == 4
+    assert result["elevation_gain_meters"] == pytest.approx(25)
+    assert result["elevation_loss_meters"] == pytest.approx(5)
+    assert result["has_timestamps"]
+    assert result["timestamp_duration_minutes"] == pytest.approx(3)
+    assert result["first_timestamp"].startswith("2024-06-01T06:00:00")
+    assert result["coordinates"][0] == [45.0, -122.0, 100.0]
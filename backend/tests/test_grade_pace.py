@@ -0,0 +1,49 @@
+"""
+Grade-adjusted pace: flat-equivalent leg costs from the route's grades
+"""
+
+import numpy as np
+import pytest
+from utils.grade_pace import GradeCostProfile, gap_multiplier
+from utils.pace_calculator import pace_scenarios
+from utils.route_profile import RouteProfile
+from tests.test_route_index import route_from_meters
+
+
+def profile_for(eles, spacing=10.0):
+    x = np.arange(len(eles)) * spacing
+    return RouteProfile.from_coordinates(route_from_meters(x, np.zeros(len(eles)), eles=eles))
+
+
+def test_gap_multiplier_shape():
+    assert gap_multiplier([0.0])[0] == pytest.approx(1.0)
+    assert gap_multiplier([0.1])[0] > 1.0
+    assert gap_multiplier([-0.1])[0] < 1.0
+    # Steep descents cost more again than moderate ones, and grades are clipped
+    assert gap_multiplier([-0.4])[0] > gap_multiplier([-0.15])[0]
+    assert gap_multiplier([2.0])[0] == pytest.approx(gap_multiplier([0.45])[0])
+
+
+def test_flat_route_costs_its_length():
+    costs = GradeCostProfile(profile_for(np.zeros(101)))
+    assert costs.cost_between(0, 100) == pytest.approx(1000, rel=1e-6)
+    assert costs.cost_between(25.5, 75.5) == pytest.approx(500, rel=1e-6)
+    assert costs.cost_between(50, 10) == 0.0
+
+
+def test_one_steep_wall_costs_more_than_the_same_gain_spread_evenly():
+    even = np.linspace(0, 100, 201)
+    wall = np.concatenate((np.zeros(150), np.linspace(0, 100, 26)[1:], np.full(26, 100.0)))
+    even_cost = GradeCostProfile(profile_for(even)).cost_between(0, 200)
+    wall_cost = GradeCostProfile(profile_for(wall)).cost_between(0, 200)
+    # Same length and total gain, but the curve is convex in grade
+    assert wall_cost > even_cost * 1.05
+
+
+def test_leg_costs_drive_the_time_split():
+    result = pace_scenarios(
+        leg_distances=[5000, 5000], elevation_gains=[0, 0], elevation_losses=[0, 0], stop_times=[0, 0],
+        target_durations=120, gain_adjustments=50, descent_adjustments=50, fatigue_slowdowns=0,
+        leg_costs=[5000, 10000]
+    )
+    assert result["leg_duration_minutes"][0] == pytest.approx([40, 80])
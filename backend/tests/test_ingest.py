@@ -0,0 +1,97 @@
+"""
+Track ingestion: routes are content-addressed by upload hash and settings
+"""
+
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+from utils import ingest, route_storage
+from utils.route_storage import route_content_key
+
+SHA = "ab" * 32
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    """Replies to each execute() with the next queued value"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.statements = []
+        self.fetched = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult(self.replies.pop(0))
+
+    async def get(self, model, key, options=None):
+        self.fetched.append(key)
+        return SimpleNamespace(id=key, track_metadata={"fetched": True})
+
+
+def test_content_key_covers_upload_and_settings(monkeypatch):
+    key = route_content_key(SHA)
+    assert key == route_content_key(SHA)
+    assert key != route_content_key("cd" * 32)
+    assert key != route_content_key(SHA, variant="tcx")
+
+    monkeypatch.setattr(route_storage, "SIMPLIFY_TOLERANCE_METERS", route_storage.SIMPLIFY_TOLERANCE_METERS + 1)
+    assert route_content_key(SHA) != key
+
+
+def test_known_upload_reuses_the_route_without_parsing(monkeypatch):
+    async def no_parse(*args):
+        raise AssertionError("should not parse a known upload")
+
+    monkeypatch.setattr(ingest, "run_cpu_bound", no_parse)
+    stored = SimpleNamespace(id=uuid.uuid4(), track_metadata={"simplified_points": 2})
+    db = FakeSession(stored)
+
+    route, metadata = asyncio.run(ingest.resolve_track(db, SHA, "upload.gpx"))
+    assert route is stored and metadata == {"simplified_points": 2}
+    assert len(db.statements) == 1
+
+
+def test_new_upload_is_parsed_and_inserted(monkeypatch):
+    async def parse(fn, path):
+        return {"simplified_points": 2, "encoded_route": b"URT1...", "format": "gpx"}
+
+    monkeypatch.setattr(ingest, "run_cpu_bound", parse)
+    route_id = uuid.uuid4()
+    db = FakeSession(None, route_id)
+
+    route, metadata = asyncio.run(ingest.resolve_track(db, SHA, "upload.gpx"))
+    assert db.fetched == [route_id]
+    insert = db.statements[1].compile().params
+    assert insert["content_hash"] == route_content_key(SHA)
+    assert insert["data"] == b"URT1..."
+    assert "encoded_route" not in insert["track_metadata"]
+    assert "ON CONFLICT (content_hash) DO NOTHING" in str(db.statements[1].compile(dialect=postgresql.dialect()))
+
+
+def test_concurrent_identical_upload_uses_the_winning_row(monkeypatch):
+    async def parse(fn, path):
+        return {"simplified_points": 2, "encoded_route": b"URT1...", "format": "gpx"}
+
+    monkeypatch.setattr(ingest, "run_cpu_bound", parse)
+    winner = SimpleNamespace(id=uuid.uuid4(), track_metadata={"simplified_points": 2})
+    db = FakeSession(None, None, winner)
+
+    route, _ = asyncio.run(ingest.resolve_track(db, SHA, "upload.gpx"))
+    assert route is winner
+    assert db.fetched == []
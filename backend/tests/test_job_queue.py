@@ -0,0 +1,174 @@
+"""
+Ingest job queue: heartbeats keep a claim alive and a lost claim drops the result
+"""
+
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from utils import job_queue
+
+
+class FakeResult:
+    def __init__(self, job=None, rowcount=0):
+        self.job = job
+        self.rowcount = rowcount
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.job
+
+
+class FakeSession:
+    """Answers the claim check with `job` while `owned`, else with no row"""
+
+    def __init__(self, job=None, rowcounts=()):
+        self.job = job
+        self.owned = True
+        self.rowcounts = list(rowcounts)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        rowcount = self.rowcounts.pop(0) if self.rowcounts else 0
+        return FakeResult(self.job if self.owned else None, rowcount)
+
+    async def get(self, model, key):
+        return SimpleNamespace(id=key)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def make_job(attempts=1):
+    return SimpleNamespace(id=uuid.uuid4(), event_id=uuid.uuid4(), kind="planned", status="running",
+                           stage="parsing", progress_percent=10, attempts=attempts, file_path="upload.gpx", content_hash="abc",
+                           result=None, error=None, finished_at=None)
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    paths = []
+
+    async def remove_spooled(path):
+        paths.append(path)
+
+    monkeypatch.setattr(job_queue, "remove_spooled", remove_spooled)
+    return paths
+
+
+def test_heartbeat_touches_the_job_until_the_claim_is_gone(monkeypatch):
+    session = FakeSession(rowcounts=[1, 1, 1, 0])
+    monkeypatch.setattr(job_queue, "AsyncSessionLocal", lambda: session)
+    monkeypatch.setattr(job_queue, "INGEST_HEARTBEAT_SECONDS", 0.001)
+
+    asyncio.run(asyncio.wait_for(job_queue._heartbeat(uuid.uuid4(), 2), timeout=5))
+
+    assert len(session.statements) == 4
+    assert session.commits == 4
+    sql = str(session.statements[0])
+    assert sql.startswith("UPDATE ingest_jobs SET updated_at=now()")
+    assert "ingest_jobs.attempts" in sql and "ingest_jobs.status" in sql
+
+
+def test_process_job_heartbeats_while_parsing(monkeypatch, removed):
+    heartbeat = FakeSession(rowcounts=[1] * 100)
+    monkeypatch.setattr(job_queue, "AsyncSessionLocal", lambda: heartbeat)
+    monkeypatch.setattr(job_queue, "INGEST_HEARTBEAT_SECONDS", 0.001)
+
+    async def slow_parse(db, content_hash, path):
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(id=uuid.uuid4()), {"format": "gpx"}
+
+    async def apply_track(db, event, kind, route, gpx_data):
+        return {"points": 2}
+
+    monkeypatch.setattr(job_queue, "resolve_track", slow_parse)
+    monkeypatch.setattr(job_queue, "apply_track", apply_track)
+    monkeypatch.setattr(job_queue, "upload_message", lambda kind, data: "ok")
+    job = make_job()
+    db = FakeSession(job)
+
+    assert asyncio.run(job_queue.process_job(db, job)) is True
+    assert len(heartbeat.statements) >= 3
+    assert job.status == "completed" and job.result["metadata"] == {"points": 2}
+    assert removed == ["upload.gpx"]
+
+
+def test_reclaimed_job_result_is_dropped(monkeypatch, removed):
+    applied = []
+    job = make_job()
+    db = FakeSession(job)
+
+    async def parse(db_, content_hash, path):
+        # Meanwhile the job went stale and another worker reclaimed it
+        db.owned = False
+        return SimpleNamespace(id=uuid.uuid4()), {"format": "gpx"}
+
+    async def apply_track(*args):
+        applied.append(args)
+
+    monkeypatch.setattr(job_queue, "resolve_track", parse)
+    monkeypatch.setattr(job_queue, "apply_track", apply_track)
+
+    assert asyncio.run(job_queue.process_job(db, job)) is True
+    assert applied == []
+    assert job.status == "running" and job.stage == "parsing"
+    assert db.commits == 0 and db.rollbacks == 1
+    # The new owner still needs the spooled file
+    assert removed == []
+    claim_check = str(db.statements[0])
+    assert "FOR UPDATE" in claim_check and "ingest_jobs.attempts" in claim_check
+
+
+def test_failure_after_reclaim_is_not_recorded(monkeypatch, removed):
+    job = make_job()
+    db = FakeSession(job)
+
+    async def parse(db_, content_hash, path):
+        db.owned = False
+        raise ValueError("bad file")
+
+    monkeypatch.setattr(job_queue, "resolve_track", parse)
+
+    assert asyncio.run(job_queue.process_job(db, job)) is True
+    assert job.status == "running" and job.error is None
+    assert removed == []
+
+
+def test_worker_loop_logs_errors_and_keeps_polling(monkeypatch, caplog):
+    attempts = []
+
+    def broken_session():
+        attempts.append(1)
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(job_queue, "AsyncSessionLocal", broken_session)
+    monkeypatch.setattr(job_queue, "INGEST_POLL_SECONDS", 0.001)
+
+    async def run_briefly():
+        monkeypatch.setattr(job_queue, "_wakeup", asyncio.Event())
+        worker = asyncio.create_task(job_queue._worker_loop())
+        await asyncio.sleep(0.05)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    with caplog.at_level("ERROR", logger="utils.job_queue"):
+        asyncio.run(run_briefly())
+    assert len(attempts) >= 2
+    assert caplog.records[0].message == "Ingest worker error"
+    assert caplog.records[0].exc_info[0] is ConnectionError
@@ -0,0 +1,114 @@
+"""
+Pace engine: vectorized scenarios match the per-leg allocation; target solver bounds
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from utils.pace_calculator import calculate_legs, pace_scenarios, solve_target_duration
+
+START = datetime(2024, 6, 1, 6, 0)
+NAN = np.nan
+
+
+def reference_legs(target, stops, metrics, gain_pct, loss_pct, fatigue_pct):
+    """The original loop: effort factors, then moving time split in proportion"""
+    factors = []
+    for i, m in enumerate(metrics):
+        factor = m["distance"] / 1609.34
+        if m["distance"] > 0:
+            factor *= 1 + (m["elevation_gain"] / m["distance"]) * gain_pct / 100 \
+                - (m["elevation_loss"] / m["distance"]) * loss_pct / 100
+        factor *= 1 + (i / (len(metrics) - 1) if len(metrics) > 1 else 0) * fatigue_pct / 100
+        factors.append(factor)
+    moving = target - sum(stops)
+    durations = [f / sum(factors) * moving for f in factors]
+    return durations
+
+
+@pytest.fixture
+def course():
+    rng = np.random.default_rng(16)
+    metrics = [{"distance": float(d), "elevation_gain": float(g), "elevation_loss": float(l)}
+               for d, g, l in zip(rng.uniform(3000, 15000, 12), rng.uniform(0, 800, 12), rng.uniform(0, 800, 12))]
+    metrics[4]["distance"] = 0.0  # a duplicate aid station
+    stops = [0, 5, 10, 0, 3, 15, 0, 5, 10, 0, 5, 0]
+    waypoints = [{"id": i, "name": f"Aid {i}", "stop_time_minutes": s} for i, s in enumerate(stops)]
+    return metrics, stops, waypoints
+
+
+def test_calculate_legs_matches_reference(course):
+    metrics, stops, waypoints = course
+    legs = calculate_legs(62.0, 900, waypoints, metrics, 8.0, 3.0, 12.0, START)
+    expected = reference_legs(900, stops, metrics, 8.0, 3.0, 12.0)
+
+    assert [leg["leg_duration_minutes"] for leg in legs] == pytest.approx(expected)
+    assert legs[-1]["cumulative_time_minutes"] == pytest.approx(900)
+    assert legs[-1]["exit_time"] == START + timedelta(minutes=900)
+    assert legs[4]["adjusted_pace"] == 0
+    assert legs[0]["base_pace"] == pytest.approx((900 - sum(stops)) / 62.0)
+    for leg in legs:
+        arrival = leg["expected_arrival_time"] + timedelta(minutes=leg["stop_time_minutes"])
+        assert abs((arrival - leg["exit_time"]).total_seconds()) < 1e-3
+
+
+def test_scenario_grid_matches_one_scenario_at_a_time(course):
+    metrics, stops, waypoints = course
+    # 3 targets x 4 fatigue levels, flattened to 12 scenarios
+    targets = np.repeat([840.0, 900.0, 960.0], 4)
+    fatigue = np.tile([0.0, 10.0, 20.0, 30.0], 3)
+    grid = pace_scenarios(
+        [m["distance"] for m in metrics], [m["elevation_gain"] for m in metrics],
+        [m["elevation_loss"] for m in metrics], stops, targets, 8.0, 3.0, fatigue, event_distance=62.0
+    )
+    assert grid["leg_duration_minutes"].shape == (12, 12)
+    assert grid["cumulative_time_minutes"][:, -1] == pytest.approx(targets)
+
+    for s, (target, slowdown) in enumerate(zip(targets, fatigue)):
+        legs = calculate_legs(62.0, target, waypoints, metrics, 8.0, 3.0, slowdown, START)
+        assert grid["adjusted_pace"][s] == pytest.approx([leg["adjusted_pace"] for leg in legs])
+
+
+def solve(stop_times, cutoffs, min_paces=(NAN, NAN), max_paces=(NAN, NAN)):
+    return solve_target_duration(
+        leg_distances=[16093.44, 16093.44],  # 10 miles each
+        elevation_gains=[0, 0],
+        elevation_losses=[0, 0],
+        stop_times=stop_times,
+        gain_adjustment=0,
+        descent_adjustment=0,
+        fatigue_slowdown=0,
+        cutoffs=cutoffs,
+        min_paces=list(min_paces),
+        max_paces=list(max_paces)
+    )
+
+
+def test_unconstrained_max_is_unbounded():
+    result = solve([0, 0], [NAN, NAN])
+    assert result["feasible"]
+    assert result["max_target_minutes"] == np.inf
+    assert result["upper_binding"] is None
+
+
+def test_cutoff_and_pace_bound_the_range():
+    # Halfway cutoff at 120 min caps the target at 240; 10 min/mile minimum pace floors it at 200
+    result = solve([0, 0], [120, NAN], min_paces=(10, 10))
+    assert result["feasible"]
+    assert np.isclose(result["min_target_minutes"], 200)
+    assert np.isclose(result["max_target_minutes"], 240)
+    assert result["upper_binding"] == ("cutoff", 0)
+
+
+def test_unreachable_cutoff_gives_finite_infeasible_range():
+    # Two zero-distance legs with a 30 min stop between, and a 10 min cutoff at the second:
+    # no moving time comes before it, so no target can make it
+    result = solve_target_duration(
+        leg_distances=[0, 0, 16093.44], elevation_gains=[0, 0, 0], elevation_losses=[0, 0, 0],
+        stop_times=[30, 0, 0], gain_adjustment=0, descent_adjustment=0, fatigue_slowdown=0,
+        cutoffs=[NAN, 10, NAN], min_paces=[NAN, NAN, NAN], max_paces=[NAN, NAN, NAN]
+    )
+    assert not result["feasible"]
+    assert result["max_target_minutes"] == 30
+    assert result["upper_binding"] == ("cutoff", 1)
@@ -0,0 +1,71 @@
+"""
+Keyset pagination: cursors walk every row exactly once, newest first
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, Uuid, create_engine
+from sqlalchemy.orm import Session, declarative_base
+from utils.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, paginate
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    created_at = Column(DateTime, nullable=False)
+    group = Column(Integer, nullable=False)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    start = datetime(2024, 6, 1)
+    with Session(engine) as db:
+        # Three rows per timestamp so the id tie-breaker matters
+        db.add_all(Item(created_at=start + timedelta(minutes=i // 3), group=i % 2) for i in range(47))
+        db.commit()
+        yield db
+
+
+def all_pages(db, query, limit):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = paginate(query, Item.created_at, Item.id, cursor, limit)
+        pages.append(rows)
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_in_order(session):
+    pages = all_pages(session, session.query(Item), limit=10)
+    rows = [row for page in pages for row in page]
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 7]
+    assert len({row.id for row in rows}) == 47
+    assert rows == sorted(rows, key=lambda r: (r.created_at, r.id), reverse=True)
+
+
+def test_filters_apply_across_pages(session):
+    pages = all_pages(session, session.query(Item).filter(Item.group == 1), limit=4)
+    rows = [row for page in pages for row in page]
+    assert len(rows) == 23
+    assert all(row.group == 1 for row in rows)
+
+
+def test_exact_last_page_has_no_cursor(session):
+    rows, cursor = paginate(session.query(Item), Item.created_at, Item.id, None, 47)
+    assert len(rows) == 47 and cursor is None
+    rows, cursor = paginate(session.query(Item), Item.created_at, Item.id, None, 10 ** 6)
+    assert len(rows) == min(47, MAX_PAGE_SIZE)
+
+
+def test_cursor_round_trip_and_rejection():
+    when, row_id = datetime(2024, 6, 1, 12, 30, 15, 123456), uuid.uuid4()
+    assert decode_cursor(encode_cursor(when, row_id)) == (when, row_id)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
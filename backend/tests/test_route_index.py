@@ -0,0 +1,97 @@
+"""
+Route spatial index: grid snapping matches a brute-force projection
+"""
+
+import numpy as np
+import pytest
+from utils.cache import LRUCache
+from utils.gpx_processor import EARTH_RADIUS_METERS, project_to_plane
+from utils.route_index import RouteIndex
+
+METERS_PER_DEGREE = np.radians(1) * EARTH_RADIUS_METERS
+
+
+def route_from_meters(x, y, eles=None, lat0: float = 45.0):
+    """[lat, lon, ele] coordinates for planar offsets in meters around lat0"""
+    lats = lat0 + np.asarray(y, dtype=np.float64) / METERS_PER_DEGREE
+    lons = -122.0 + np.asarray(x, dtype=np.float64) / (METERS_PER_DEGREE * np.cos(np.radians(lat0)))
+    eles = np.zeros(len(lats)) if eles is None else np.asarray(eles, dtype=np.float64)
+    return np.column_stack((lats, lons, eles)).tolist()
+
+
+def point_from_meters(x: float, y: float, lat0: float = 45.0):
+    lat = lat0 + y / METERS_PER_DEGREE
+    lon = -122.0 + x / (METERS_PER_DEGREE * np.cos(np.radians(lat0)))
+    return lat, lon
+
+
+def brute_force_snap(index: RouteIndex, lat: float, lon: float):
+    """(distance to route, distance along route) of the closest point over every segment"""
+    px, py = project_to_plane(np.array([lat]), np.array([lon]), index.ref_lat)
+    x, y = index.x, index.y
+    dx, dy = np.diff(x), np.diff(y)
+    length_sq = dx ** 2 + dy ** 2
+    t = np.clip(((px[0] - x[:-1]) * dx + (py[0] - y[:-1]) * dy) / np.where(length_sq > 0, length_sq, 1), 0, 1)
+    distances = np.hypot(px[0] - (x[:-1] + t * dx), py[0] - (y[:-1] + t * dy))
+    best = int(np.argmin(distances))
+    along = index.cumulative_distance[best] + t[best] * index.segment_lengths[best]
+    return float(distances[best]), float(along)
+
+
+@pytest.fixture(scope="module")
+def wiggly_route():
+    rng = np.random.default_rng(5)
+    x = np.cumsum(rng.uniform(5, 40, 3000))
+    y = 2000 * np.sin(x / 3000) + np.cumsum(rng.normal(0, 10, 3000))
+    return RouteIndex(route_from_meters(x, y, eles=np.linspace(0, 900, 3000)))
+
+
+def test_snap_matches_brute_force(wiggly_route):
+    rng = np.random.default_rng(6)
+    x_max = float(wiggly_route.x.max() - wiggly_route.x.min())
+    for _ in range(200):
+        lat, lon = point_from_meters(rng.uniform(-500, x_max + 500), rng.uniform(-3000, 3000))
+        snap = wiggly_route.snap(lat, lon)
+        distance, along = brute_force_snap(wiggly_route, lat, lon)
+        assert snap.distance_to_route == pytest.approx(distance, abs=1e-6)
+        assert snap.distance_from_start == pytest.approx(along, abs=1e-3)
+
+
+def test_snap_projects_onto_segment_and_interpolates():
+    index = RouteIndex(route_from_meters([0, 1000, 1000], [0, 0, 1000], eles=[100, 200, 200]))
+    lat, lon = point_from_meters(250, 30)
+    snap = index.snap(lat, lon)
+    assert snap.segment_index == 0
+    assert snap.fraction == pytest.approx(0.25, abs=1e-3)
+    assert snap.vertex_index == 0
+    assert snap.distance_to_route == pytest.approx(30, abs=0.1)
+    assert snap.distance_from_start == pytest.approx(250, abs=1)
+    assert snap.elevation == pytest.approx(125, abs=0.1)
+
+
+def test_far_point_still_finds_the_route():
+    index = RouteIndex(route_from_meters(np.linspace(0, 500, 51), np.zeros(51)))
+    lat, lon = point_from_meters(250, 50_000)
+    snap = index.snap(lat, lon)
+    assert snap.distance_from_start == pytest.approx(250, abs=1)
+    assert snap.distance_to_route == pytest.approx(50_000, rel=1e-3)
+
+
+def test_single_point_route():
+    index = RouteIndex(route_from_meters([0], [0]))
+    lat, lon = point_from_meters(30, 40)
+    snap = index.snap(lat, lon)
+    assert snap.distance_from_start == 0
+    assert snap.distance_to_route == pytest.approx(50, abs=0.1)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get_or_create("a", lambda: 99) == 1
+    assert cache.get_or_create("d", lambda: 4) == 4
+    assert len(cache) == 2
@@ -0,0 +1,55 @@
+"""
+Route profile: prefix-sum leg metrics match a walk over the route
+"""
+
+import numpy as np
+import pytest
+from utils.gpx_processor import calculate_leg_metrics
+from utils.route_profile import RouteProfile
+from utils.route_storage import StoredRoute
+from tests.test_route_index import route_from_meters
+
+
+@pytest.fixture(scope="module")
+def hilly_route():
+    rng = np.random.default_rng(11)
+    x = np.cumsum(rng.uniform(5, 50, 500))
+    y = np.cumsum(rng.normal(0, 20, 500))
+    eles = 500 + np.cumsum(rng.normal(0, 3, 500))
+    return route_from_meters(x, y, eles=eles)
+
+
+def test_leg_metrics_match_calculate_leg_metrics(hilly_route):
+    profile = RouteProfile.from_coordinates(hilly_route)
+    rng = np.random.default_rng(12)
+    for _ in range(50):
+        start, end = sorted(rng.integers(0, len(hilly_route), 2))
+        expected = calculate_leg_metrics(hilly_route, int(start), int(end))
+        actual = profile.leg_metrics(int(start), int(end))
+        for key in ("distance", "elevation_gain", "elevation_loss"):
+            assert actual[key] == pytest.approx(expected[key], abs=1e-6)
+
+
+def test_metrics_between_interpolates_within_a_segment():
+    profile = RouteProfile.from_coordinates(route_from_meters([0, 100, 200], [0, 0, 0], eles=[0, 10, 0]))
+    half = profile.metrics_between(0.5, 1.5)
+    assert half["elevation_gain"] == pytest.approx(5)
+    assert half["elevation_loss"] == pytest.approx(5)
+    assert half["distance"] == pytest.approx(np.hypot(100, 10), rel=1e-3)
+    assert profile.metrics_between(1.5, 0.5) == {"distance": 0, "elevation_gain": 0, "elevation_loss": 0}
+
+
+def test_position_at_distance_inverts_distance_at(hilly_route):
+    profile = RouteProfile.from_coordinates(hilly_route)
+    for meters in np.linspace(0, profile.horizontal[-1], 37):
+        assert profile.distance_at(profile.position_at_distance(meters)) == pytest.approx(meters, abs=1e-6)
+    assert profile.position_at_distance(-5) == 0.0
+    assert profile.position_at_distance(profile.horizontal[-1] + 5) == profile.end_position
+
+
+def test_stored_profile_round_trips(hilly_route):
+    profile = RouteProfile.from_coordinates(hilly_route)
+    stored = StoredRoute.from_json({"coordinates": hilly_route, "profile": profile.to_dict()}).profile
+    assert np.allclose(stored.distance, profile.distance, atol=0.01)
+    assert np.allclose(stored.gain, profile.gain, atol=0.01)
+    assert np.allclose(stored.elevation, profile.elevation)
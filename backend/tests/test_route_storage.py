@@ -0,0 +1,79 @@
+"""
+Binary route storage: encode/decode round-trips and legacy JSON routes
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from utils.route_profile import RouteProfile
+from utils.route_storage import (
+    StoredRoute, decode_route, encode_route, load_event_route, route_cache_key
+)
+from tests.test_route_index import route_from_meters
+
+
+@pytest.fixture(scope="module")
+def coordinates():
+    rng = np.random.default_rng(21)
+    x = np.cumsum(rng.uniform(5, 50, 300))
+    y = np.cumsum(rng.normal(0, 20, 300))
+    return np.asarray(route_from_meters(x, y, eles=1000 + np.cumsum(rng.normal(0, 2, 300))))
+
+
+def test_round_trip_coordinates_and_profile(coordinates):
+    profile = RouteProfile.from_coordinates(coordinates)
+    route = decode_route(encode_route(coordinates, profile=profile))
+
+    assert route.point_count == len(coordinates)
+    assert np.abs(route.coordinates[:, :2] - coordinates[:, :2]).max() <= 0.5e-7
+    assert np.allclose(route.coordinates[:, 2], coordinates[:, 2], atol=1e-3)
+    assert np.allclose(route.profile.distance, profile.distance, rtol=1e-6)
+    assert np.allclose(route.profile.gain, profile.gain, rtol=1e-6)
+    assert route.times is None
+
+
+def test_round_trip_times_keeps_missing_as_nan(coordinates):
+    times = 1_717_221_600.0 + np.arange(len(coordinates)) * 5.0
+    times[10] = np.nan
+    route = decode_route(encode_route(coordinates, times=times))
+
+    assert route.profile_arrays is None
+    assert np.isnan(route.times[10])
+    assert np.allclose(np.delete(route.times, 10), np.delete(times, 10))
+
+
+def test_decode_is_a_view_over_the_buffer(coordinates):
+    data = encode_route(coordinates)
+    route = decode_route(memoryview(data))
+    assert not route.lat_e7.flags.owndata
+    assert not route.elevation.flags.writeable
+
+
+def test_unknown_encoding_is_rejected(coordinates):
+    data = bytearray(encode_route(coordinates))
+    data[:4] = b"XXXX"
+    with pytest.raises(ValueError):
+        decode_route(bytes(data))
+
+
+def test_legacy_json_route_matches_binary(coordinates):
+    legacy = StoredRoute.from_json({"coordinates": coordinates.tolist()})
+    binary = decode_route(encode_route(coordinates))
+    assert np.array_equal(legacy.lat_e7, binary.lat_e7)
+    assert legacy.profile.leg_metrics(0, 299) == pytest.approx(binary.profile.leg_metrics(0, 299), rel=1e-6)
+    assert np.allclose(legacy.to_json(include_profile=False)["coordinates"], coordinates, atol=1e-3)
+
+
+def test_load_event_route_prefers_the_route_row(coordinates):
+    row = SimpleNamespace(data=encode_route(coordinates[:10]))
+    event = SimpleNamespace(id="e1", route_id="r1", route=row, gpx_route={"coordinates": coordinates.tolist()},
+                            updated_at=None, created_at="t0")
+    assert route_cache_key(event) == ("route", "r1")
+    assert load_event_route(event).point_count == 10
+
+    legacy = SimpleNamespace(id="e2", route_id=None, route=None, gpx_route={"coordinates": coordinates.tolist()},
+                             updated_at=None, created_at="t0")
+    assert load_event_route(legacy).point_count == len(coordinates)
+    assert load_event_route(SimpleNamespace(id="e3", route_id=None, gpx_route=None,
+                                            updated_at=None, created_at="t0")) is None
@@ -0,0 +1,78 @@
+"""
+Track simplification: kept indices, tolerance and the elevation-aware mode
+"""
+
+import numpy as np
+from utils.gpx_processor import EARTH_RADIUS_METERS, simplify_coordinates, simplify_track_indices
+
+METERS_PER_DEGREE = np.radians(1) * EARTH_RADIUS_METERS
+
+
+def track_from_meters(x, y, lat0: float = 45.0):
+    """Lat/lon arrays for planar offsets in meters around lat0"""
+    lats = lat0 + np.asarray(y, dtype=np.float64) / METERS_PER_DEGREE
+    lons = -122.0 + np.asarray(x, dtype=np.float64) / (METERS_PER_DEGREE * np.cos(np.radians(lat0)))
+    return lats, lons
+
+
+def max_deviation(x, y, kept):
+    """Largest distance of any point from the simplified polyline segment spanning it"""
+    worst = 0.0
+    for a, b in zip(kept[:-1], kept[1:]):
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        length = np.hypot(dx, dy)
+        px, py = x[a:b + 1] - x[a], y[a:b + 1] - y[a]
+        d = np.abs(px * dy - py * dx) / length if length > 0 else np.hypot(px, py)
+        worst = max(worst, float(d.max()))
+    return worst
+
+
+def test_straight_line_keeps_endpoints():
+    lats, lons = track_from_meters(np.linspace(0, 1000, 101), np.zeros(101))
+    assert simplify_track_indices(lats, lons).tolist() == [0, 100]
+
+
+def test_corner_is_kept():
+    x = np.concatenate((np.linspace(0, 500, 51), np.full(50, 500.0)))
+    y = np.concatenate((np.zeros(51), np.linspace(10, 500, 50)))
+    lats, lons = track_from_meters(x, y)
+    assert simplify_track_indices(lats, lons).tolist() == [0, 50, 100]
+
+
+def test_dropped_points_stay_within_tolerance():
+    rng = np.random.default_rng(3)
+    x = np.cumsum(rng.normal(5, 3, 2000))
+    y = np.cumsum(rng.normal(0, 3, 2000))
+    lats, lons = track_from_meters(x, y)
+    kept = simplify_track_indices(lats, lons, tolerance_meters=10)
+    assert kept[0] == 0 and kept[-1] == 1999
+    assert np.all(np.diff(kept) > 0)
+    assert 2 < len(kept) < 2000
+    # Projection differences between this check and the simplifier are centimeters
+    assert max_deviation(x, y, kept) <= 10.5
+
+
+def test_closed_loop_is_not_collapsed():
+    angles = np.linspace(0, 2 * np.pi, 201)
+    lats, lons = track_from_meters(300 * np.sin(angles), 300 - 300 * np.cos(angles))
+    kept = simplify_track_indices(lats, lons)
+    assert kept[0] == 0 and kept[-1] == 200
+    assert len(kept) > 8
+
+
+def test_elevation_mode_keeps_a_climb_on_a_straight_line():
+    lats, lons = track_from_meters(np.linspace(0, 1000, 101), np.zeros(101))
+    eles = np.concatenate((np.linspace(100, 200, 51), np.linspace(199, 100, 50)))
+    assert simplify_track_indices(lats, lons, eles).tolist() == [0, 100]
+    kept = simplify_track_indices(lats, lons, eles, elevation_tolerance_meters=5)
+    assert 50 in kept.tolist()
+
+
+def test_simplify_coordinates_keeps_original_points():
+    # An out-and-back passes the same spot twice at different elevations
+    x = np.concatenate((np.linspace(0, 1000, 11), np.linspace(900, 0, 10)))
+    lats, lons = track_from_meters(x, np.zeros(21))
+    eles = np.arange(21, dtype=np.float64)
+    coordinates = np.column_stack((lats, lons, eles)).tolist()
+    simplified = simplify_coordinates(coordinates)
+    assert simplified == [coordinates[0], coordinates[10], coordinates[20]]
@@ -0,0 +1,60 @@
+"""
+Monte Carlo simulation: seeded reproducibility and bounded pool use
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from utils import executor
+from routes.calculations import run_simulation
+
+LEG_DURATIONS = [45.0, 80.0, 60.0, 120.0]
+STOP_TIMES = [2.0, 5.0, 0.0, 10.0]
+PERCENTILES = [10, 50, 90]
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    """Two workers and no backlog: at most 2 tasks may be in flight"""
+    monkeypatch.setattr(executor, "CPU_POOL_WORKERS", 2)
+    monkeypatch.setattr(executor, "CPU_POOL_QUEUE_DEPTH", 0)
+    executor.shutdown_process_pool()
+    executor.start_process_pool()
+    yield
+    executor.shutdown_process_pool()
+
+
+def simulate(runs: int, seed: int, batch_runs: int = 1000) -> np.ndarray:
+    return asyncio.run(run_simulation(
+        LEG_DURATIONS, STOP_TIMES, 5.0, runs, seed,
+        pace_variability=8.0, leg_variability=10.0, stop_variability=30.0, fatigue_variability=3.0,
+        batch_runs=batch_runs
+    ))
+
+
+def test_many_batches_fit_the_pool(small_pool):
+    # 10 batches against a cap of 2 tasks in flight
+    arrivals = simulate(10000, seed=1)
+    assert arrivals.shape == (10000, len(LEG_DURATIONS))
+
+
+def test_same_seed_gives_same_percentiles(small_pool):
+    first = np.percentile(simulate(5000, seed=42), PERCENTILES, axis=0)
+    second = np.percentile(simulate(5000, seed=42), PERCENTILES, axis=0)
+    assert np.array_equal(first, second)
+    other = np.percentile(simulate(5000, seed=43), PERCENTILES, axis=0)
+    assert not np.array_equal(first, other)
+
+
+def test_result_does_not_depend_on_batches_in_flight(small_pool, monkeypatch):
+    two_at_once = simulate(5000, seed=7)
+    monkeypatch.setattr(executor, "CPU_POOL_WORKERS", 1)
+    one_at_a_time = simulate(5000, seed=7)
+    assert np.array_equal(two_at_once, one_at_a_time)
+
+
+def test_more_runs_extend_the_same_sample(small_pool):
+    # Batch k's seed is spawn(...)[k] whatever the batch count, so earlier batches are unchanged
+    shorter = simulate(3000, seed=11)
+    longer = simulate(5000, seed=11)
+    assert np.array_equal(longer[:3000], shorter)
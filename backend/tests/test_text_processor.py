@@ -0,0 +1,103 @@
+"""
+Document text processing: whitespace stripping over streamed pieces, PDF page
+ranges, and chunking page ranges on separate workers then stitching them in order
+"""
+
+import asyncio
+import random
+
+import pytest
+from utils import executor, text_processor
+from utils.chunking import chunk_range, chunk_spans
+from utils.text_processor import _strip_pieces, pdf_page_ranges
+from tests.test_chunking import byte_tokens
+
+
+def test_page_ranges_cover_every_page_in_order():
+    for pages in (1, 24, 25, 26, 99, 100, 1001):
+        ranges = pdf_page_ranges(pages, max_tasks=4, pages_per_task=25)
+        assert ranges[0][0] == 0 and ranges[-1][1] == pages
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+        assert len(ranges) <= 4
+        sizes = [stop - start for start, stop in ranges]
+        assert max(sizes) - min(sizes) <= 1
+        assert len(ranges) == 4 or max(sizes) <= 25
+    assert pdf_page_ranges(25, max_tasks=4, pages_per_task=25) == [(0, 25)]
+    assert pdf_page_ranges(0, max_tasks=4, pages_per_task=25) == []
+
+
+def test_strip_pieces_matches_strip_of_the_joined_text():
+    rng = random.Random(3)
+    alphabet = ["a", "b", " ", "\n", "\t", "  \n\n"]
+    for _ in range(500):
+        pieces = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 5))) for _ in range(rng.randint(0, 6))]
+        joined = "".join(pieces)
+        assert "".join(_strip_pieces(pieces)) == joined.strip()
+        assert "".join(_strip_pieces(pieces, trailing=False)) == joined.lstrip()
+        assert "".join(_strip_pieces(pieces, leading=False)) == joined.rstrip()
+        assert "".join(_strip_pieces(pieces, leading=False, trailing=False)) == joined
+
+
+def page(n):
+    return f"Page {n} opens here. " + "The trail climbs. " * 30 + "\n\n"
+
+
+def fake_range(path, start, stop, first, last):
+    """prepare_page_range over generated pages"""
+    text = "".join(_strip_pieces((page(n) for n in range(start, stop)), leading=first, trailing=last))
+    spans, tail_start = chunk_range([text])
+    return {'text': text, 'spans': spans, 'tail_start': tail_start}
+
+
+def test_page_ranges_are_stitched_in_page_order(byte_tokens, monkeypatch):
+    ranges = [(0, 3), (3, 6), (6, 9), (9, 12)]
+
+    async def run_cpu_bound(fn, *args):
+        # Later ranges finish first
+        await asyncio.sleep(0.01 * (len(ranges) - args[1] // 3))
+        return fn(*args)
+
+    monkeypatch.setattr(executor, "run_cpu_bound", run_cpu_bound)
+    monkeypatch.setattr(text_processor, "prepare_page_range", fake_range)
+
+    prepared = asyncio.run(text_processor._prepare_page_ranges("doc.pdf", ranges))
+
+    text = prepared['text']
+    assert text == "".join(page(n) for n in range(12)).strip()
+    first_range = chunk_spans(text[:len("".join(page(n) for n in range(3)))])
+    assert prepared['spans'][:len(first_range) - 1] == first_range[:-1]
+    assert prepared['spans'][-1].end == len(text)
+    starts = [span.start for span in prepared['spans']]
+    assert starts == sorted(starts)
+    covered = set()
+    for span in prepared['spans']:
+        covered.update(range(span.start, span.end))
+    assert all(i in covered for i, c in enumerate(text) if not c.isspace())
+
+
+def test_failed_range_cancels_pending_ranges(byte_tokens, monkeypatch):
+    started, finished = [], []
+    third_started = asyncio.Event()
+
+    async def run_cpu_bound(fn, *args):
+        started.append(args[1])
+        if args[1] == 3:
+            await third_started.wait()
+            raise ValueError("bad page")
+        if args[1] == 6:
+            third_started.set()
+        if args[1] > 0:
+            await asyncio.Event().wait()
+        finished.append(args[1])
+        return fn(*args)
+
+    monkeypatch.setattr(executor, "CPU_POOL_WORKERS", 2)
+    monkeypatch.setattr(executor, "run_cpu_bound", run_cpu_bound)
+    monkeypatch.setattr(text_processor, "prepare_page_range", fake_range)
+
+    with pytest.raises(ValueError):
+        asyncio.run(text_processor._prepare_page_ranges("doc.pdf", [(n, n + 3) for n in range(0, 18, 3)]))
+
+    # Two ranges in flight at a time: the one queued behind the failure is cancelled, the rest never start
+    assert started == [0, 3, 6]
+    assert finished == [0]
@@ -0,0 +1,94 @@
+"""
+Track alignment: waypoint arrival/departure times and leg splits off a timed track
+"""
+
+import numpy as np
+import pytest
+from utils.gpx_processor import STOP_WINDOW_SECONDS, moving_time_seconds
+from utils.route_index import RouteIndex
+from utils.route_storage import decode_route, encode_route
+from utils.track_alignment import align_waypoints, leg_splits
+from tests.test_route_index import point_from_meters, route_from_meters
+
+T0 = 1_717_221_600.0
+# Stop detection blurs the edges of a stop by up to one window
+BLUR = STOP_WINDOW_SECONDS
+
+
+def timed_track(x, y):
+    """Decoded 1 Hz track through planar offsets, with stop detection, and its index"""
+    coordinates = np.asarray(route_from_meters(x, y))
+    times = T0 + np.arange(len(coordinates), dtype=np.float64)
+    moving = moving_time_seconds(coordinates[:, 0], coordinates[:, 1], times)
+    track = decode_route(encode_route(coordinates, times=times, moving_seconds=moving))
+    return track, RouteIndex(track.coordinates, track.profile)
+
+
+def waypoints(*points):
+    lats, lons = zip(*(point_from_meters(x, y) for x, y in points))
+    return list(lats), list(lons)
+
+
+@pytest.fixture(scope="module")
+def stop_at_aid():
+    """2.5 m/s east for 1000 m, five minutes stopped, then 2000 m more"""
+    x = np.concatenate((np.linspace(0, 1000, 401), np.full(300, 1000.0), np.linspace(1000, 3000, 801)[1:]))
+    return timed_track(x, np.zeros(len(x)))
+
+
+def test_moving_time_excludes_the_stop(stop_at_aid):
+    track, _ = stop_at_aid
+    assert track.moving_seconds[-1] == pytest.approx(1200, abs=BLUR)
+    # Flat through the middle of the stop, one second per second while running
+    assert track.moving_seconds[550] == track.moving_seconds[450]
+    assert track.moving_seconds[1300] - track.moving_seconds[1200] == pytest.approx(100)
+
+
+def test_arrival_and_departure_bracket_the_stop(stop_at_aid):
+    track, index = stop_at_aid
+    aid, finish = align_waypoints(track, index, *waypoints((1000, 5), (3000, 0)))
+
+    assert aid.distance_from_start == pytest.approx(1000, abs=1)
+    assert aid.arrival_seconds == pytest.approx(400, abs=BLUR)
+    assert aid.departure_seconds == pytest.approx(700, abs=BLUR)
+    assert finish.arrival_seconds == pytest.approx(track.times[-1] - T0, abs=1)
+    assert finish.departure_seconds == pytest.approx(finish.arrival_seconds)
+
+
+def test_leg_splits_add_up(stop_at_aid):
+    track, index = stop_at_aid
+    splits = leg_splits(align_waypoints(track, index, *waypoints((1000, 0), (3000, 0))))
+
+    first, second = splits
+    assert first["stop_seconds"] == pytest.approx(300, abs=2 * BLUR)
+    assert first["leg_seconds"] == pytest.approx(first["departure_seconds"])
+    for split in splits:
+        assert split["moving_seconds"] + split["stopped_seconds"] == pytest.approx(split["leg_seconds"])
+    assert second["moving_seconds"] == pytest.approx(800, abs=20)
+    assert second["stop_seconds"] == 0
+    assert sum(s["leg_seconds"] for s in splits) == pytest.approx(track.times[-1] - T0, abs=1)
+    assert sum(s["distance_meters"] for s in splits) == pytest.approx(3000, abs=1)
+
+
+def test_out_and_back_matches_each_pass():
+    # Out 1000 m, back on a parallel line 20 m away with a two minute stop halfway
+    out = np.linspace(0, 1000, 401)
+    back = np.concatenate((np.linspace(1000, 500, 201)[1:], np.full(120, 500.0), np.linspace(500, 0, 201)[1:]))
+    x = np.concatenate((out, back))
+    y = np.concatenate((np.zeros(len(out)), np.full(len(back), 20.0)))
+    track, index = timed_track(x, y)
+
+    outbound, inbound, finish = align_waypoints(track, index, *waypoints((500, 10), (500, 10), (0, 10)))
+
+    assert outbound.arrival_seconds == pytest.approx(200, abs=5)
+    assert outbound.departure_seconds - outbound.arrival_seconds == pytest.approx(0, abs=5)
+    assert inbound.arrival_seconds == pytest.approx(600, abs=BLUR)
+    assert inbound.departure_seconds == pytest.approx(720, abs=BLUR)
+    assert finish.distance_from_start == pytest.approx(track.profile.distance[-1])
+
+
+def test_untimed_track_has_no_alignment():
+    coordinates = route_from_meters([0, 500, 1000], [0, 0, 0])
+    track = decode_route(encode_route(coordinates))
+    assert track.moving_seconds is None
+    assert align_waypoints(track, RouteIndex(track.coordinates, track.profile), *waypoints((500, 0))) is None
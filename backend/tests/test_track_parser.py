@@ -0,0 +1,86 @@
+"""
+Streaming GPX/TCX parser: same points as a full gpxpy parse
+"""
+
+import io
+import gpxpy
+import numpy as np
+import pytest
+from utils.track_parser import read_track, parse_iso_time
+from utils.gpx_processor import parse_track_stream
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <metadata><name>Test</name></metadata>
+  <trk><name>Loop</name>
+    <trkseg>
+      <trkpt lat="45.0000" lon="-122.0000"><ele>100.5</ele><time>2024-06-01T06:00:00Z</time></trkpt>
+      <trkpt lat="45.0010" lon="-122.0005"><ele>110</ele><time>2024-06-01T06:01:00Z</time></trkpt>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="45.0020" lon="-122.0010"><time>2024-06-01T06:02:30+00:00</time></trkpt>
+      <trkpt lat="45.0030" lon="-122.0015"><ele>120</ele></trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+TCX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Running"><Lap StartTime="2024-06-01T06:00:00Z"><Track>
+    <Trackpoint><Time>2024-06-01T06:00:00Z</Time>
+      <Position><LatitudeDegrees>45.0</LatitudeDegrees><LongitudeDegrees>-122.0</LongitudeDegrees></Position>
+      <AltitudeMeters>100</AltitudeMeters></Trackpoint>
+    <Trackpoint><Time>2024-06-01T06:00:30Z</Time><HeartRateBpm><Value>140</Value></HeartRateBpm></Trackpoint>
+    <Trackpoint><Time>2024-06-01T06:01:00Z</Time>
+      <Position><LatitudeDegrees>45.001</LatitudeDegrees><LongitudeDegrees>-122.0</LongitudeDegrees></Position>
+      <AltitudeMeters>104</AltitudeMeters></Trackpoint>
+  </Track></Lap></Activity></Activities>
+</TrainingCenterDatabase>
+"""
+
+
+def test_gpx_points_match_gpxpy():
+    track = read_track(io.BytesIO(GPX))
+    points = [p for t in gpxpy.parse(GPX.decode()).tracks for s in t.segments for p in s.points]
+
+    assert track["format"] == "gpx"
+    assert track["lats"].tolist() == [p.latitude for p in points]
+    assert track["lons"].tolist() == [p.longitude for p in points]
+    expected_eles = [np.nan if p.elevation is None else p.elevation for p in points]
+    assert np.array_equal(track["eles"], expected_eles, equal_nan=True)
+    expected_times = [np.nan if p.time is None else p.time.timestamp() for p in points]
+    assert np.array_equal(track["times"], expected_times, equal_nan=True)
+
+
+def test_tcx_points_without_position_are_skipped():
+    track = read_track(io.BytesIO(TCX))
+    assert track["format"] == "tcx"
+    assert track["lats"].tolist() == [45.0, 45.001]
+    assert track["eles"].tolist() == [100.0, 104.0]
+    assert track["times"][1] - track["times"][0] == 60
+
+
+def test_unsupported_root_is_rejected():
+    with pytest.raises(ValueError):
+        read_track(io.BytesIO(b"<kml><Document/></kml>"))
+
+
+def test_parse_iso_time():
+    assert parse_iso_time("2024-06-01T06:00:00Z") == parse_iso_time("2024-06-01T06:00:00+00:00")
+    assert parse_iso_time("2024-06-01T06:00:00") == parse_iso_time("2024-06-01T06:00:00Z")
+    assert np.isnan(parse_iso_time("yesterday"))
+    assert np.isnan(parse_iso_time(None))
+
+
+def test_parse_track_stream_tcx():
+    result = parse_track_stream(io.BytesIO(TCX))
+    assert result["format"] == "tcx"
+    assert result["original_points"] == 2
+    assert result["elevation_gain_meters"] == pytest.approx(4)
+    assert result["timestamp_duration_minutes"] == pytest.approx(1)
+
+
+def test_empty_track_is_rejected():
+    with pytest.raises(ValueError):
+        parse_track_stream(io.BytesIO(b'<gpx xmlns="http://www.topografix.com/GPX/1/1"></gpx>'))
@@ -0,0 +1,110 @@
+"""
+Waypoint ordering: courses that pass the same spot twice keep the user's sequence
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from utils.route_index import RouteIndex, course_order_key, snap_between_neighbours
+from tests.test_route_index import route_from_meters, point_from_meters
+
+
+def waypoint(name, x, y, order_index, distance_from_start=None):
+    lat, lon = point_from_meters(x, y)
+    return SimpleNamespace(name=name, latitude=lat, longitude=lon,
+                           order_index=order_index, distance_from_start=distance_from_start)
+
+
+def add_waypoint(index, waypoints, new):
+    """What create_waypoint does: snap between neighbours in course order"""
+    waypoints.append(new)
+    waypoints.sort(key=course_order_key)
+    new.distance_from_start = snap_between_neighbours(index, waypoints, new).distance_from_start
+    return waypoints
+
+
+@pytest.fixture
+def out_and_back():
+    # Out 0 -> 1000 m along y=0, back along y=10
+    x = np.concatenate((np.linspace(0, 1000, 101), np.linspace(1000, 0, 101)))
+    y = np.concatenate((np.zeros(101), np.full(101, 10.0)))
+    return RouteIndex(route_from_meters(x, y))
+
+
+def test_course_order_key_follows_order_index_not_distance():
+    waypoints = [
+        waypoint("FINISH", 0, 0, 999999, 2000),
+        waypoint("Aid 2", 0, 0, 2, 500),
+        waypoint("Aid 1", 0, 0, 1, 500),
+        waypoint("Turn", 0, 0, 3, 1000),
+        waypoint("START", 0, 0, 0, 0),
+    ]
+    names = [wp.name for wp in sorted(waypoints, key=course_order_key)]
+    assert names == ["START", "Aid 1", "Aid 2", "Turn", "FINISH"]
+
+
+def test_out_and_back_aid_station_lands_on_return_pass(out_and_back):
+    total = float(out_and_back.cumulative_distance[-1])
+    waypoints = [waypoint("START", 0, 0, 0, 0.0), waypoint("FINISH", 0, 10, 999999, total)]
+    outbound = waypoint("Aid", 500, 4, 1)
+    add_waypoint(out_and_back, waypoints, outbound)
+    turn = waypoint("Turn", 1000, 5, 2)
+    add_waypoint(out_and_back, waypoints, turn)
+    inbound = waypoint("Aid", 500, 4, 3)
+    add_waypoint(out_and_back, waypoints, inbound)
+
+    # A global snap puts both visits on the outbound pass
+    assert out_and_back.snap(inbound.latitude, inbound.longitude).distance_from_start == pytest.approx(500, abs=1)
+
+    distances = [wp.distance_from_start for wp in waypoints]
+    assert [wp.name for wp in waypoints] == ["START", "Aid", "Turn", "Aid", "FINISH"]
+    assert distances == sorted(distances)
+    assert outbound.distance_from_start == pytest.approx(500, abs=1)
+    assert inbound.distance_from_start == pytest.approx(1510, abs=1)
+
+    # Recalculating the whole event in course order agrees with the incremental snaps
+    snaps = out_and_back.snap_sequence([wp.latitude for wp in waypoints], [wp.longitude for wp in waypoints])
+    assert [s.distance_from_start for s in snaps] == pytest.approx(distances, abs=1)
+
+
+def test_two_lap_loop_places_each_visit_on_its_lap():
+    # Square loop of 4 km, run twice; START and FINISH share a spot
+    side = np.linspace(0, 1000, 51)
+    x = np.concatenate((side, np.full(50, 1000.0), side[::-1][1:], np.zeros(50)))
+    y = np.concatenate((np.zeros(51), side[1:], np.full(50, 1000.0), side[::-1][1:]))
+    x, y = np.concatenate((x, x[1:])), np.concatenate((y, y[1:]))
+    index = RouteIndex(route_from_meters(x, y))
+    total = float(index.cumulative_distance[-1])
+    assert total == pytest.approx(8000, abs=1)
+
+    waypoints = [waypoint("START", 0, 0, 0, 0.0), waypoint("FINISH", 0, 0, 999999, total)]
+    lap_one = waypoint("Aid", 1000, 500, 1)
+    add_waypoint(index, waypoints, lap_one)
+    lap_two = waypoint("Aid", 1000, 500, 2)
+    add_waypoint(index, waypoints, lap_two)
+
+    assert lap_one.distance_from_start == pytest.approx(1500, abs=1)
+    assert lap_two.distance_from_start == pytest.approx(5500, abs=1)
+    finish = waypoints[-1]
+    assert snap_between_neighbours(index, waypoints, finish).distance_from_start == pytest.approx(8000, abs=1)
+
+    snaps = index.snap_sequence([wp.latitude for wp in waypoints], [wp.longitude for wp in waypoints])
+    assert [s.distance_from_start for s in snaps] == pytest.approx([0, 1500, 5500, 8000], abs=1)
+
+
+def test_moving_a_waypoint_resnaps_inside_its_neighbours(out_and_back):
+    total = float(out_and_back.cumulative_distance[-1])
+    waypoints = [waypoint("START", 0, 0, 0, 0.0), waypoint("FINISH", 0, 10, 999999, total)]
+    turn = waypoint("Turn", 1000, 5, 1)
+    add_waypoint(out_and_back, waypoints, turn)
+    aid = waypoint("Aid", 300, 4, 2)
+    add_waypoint(out_and_back, waypoints, aid)
+    assert aid.distance_from_start == pytest.approx(1710, abs=1)
+
+    # Moved ahead of the turnaround in the sequence: now the outbound pass
+    aid.order_index = 1
+    turn.order_index = 2
+    waypoints.sort(key=course_order_key)
+    aid.distance_from_start = snap_between_neighbours(out_and_back, waypoints, aid).distance_from_start
+    assert aid.distance_from_start == pytest.approx(300, abs=1)
@@ -0,0 +1,83 @@
+"""
+Bulk Inserts
+Writes many rows as multi-row INSERT ... VALUES statements, one round trip per
+batch, instead of flushing one ORM object (and one INSERT) at a time
+"""
+
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+from sqlalchemy.dialects.postgresql import Insert, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+BULK_INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", "500"))
+# Postgres wire protocol limit on bind parameters in a single statement
+MAX_BIND_PARAMETERS = 32767
+
+
+def batched(rows: Sequence[Dict], batch_size: Optional[int] = None) -> Iterator[List[Dict]]:
+    """
+    Split rows into batches that fit in one statement
+
+    Args:
+        rows: Column-value dicts (all with the same keys)
+        batch_size: Rows per batch (default BULK_INSERT_BATCH_SIZE); lowered
+            if the batch would exceed the bind parameter limit
+    """
+    if not rows:
+        return
+    size = max(1, batch_size or BULK_INSERT_BATCH_SIZE)
+    size = min(size, max(1, MAX_BIND_PARAMETERS // len(rows[0])))
+    for start in range(0, len(rows), size):
+        yield list(rows[start:start + size])
+
+
+def insert_statements(
+    model,
+    rows: Sequence[Dict],
+    batch_size: Optional[int] = None,
+    on_conflict: Optional[Callable[[Insert], Insert]] = None
+) -> Iterator[Insert]:
+    """Multi-row INSERT statements for rows, optionally with an ON CONFLICT clause"""
+    for batch in batched(rows, batch_size):
+        stmt = pg_insert(model).values(batch)
+        yield on_conflict(stmt) if on_conflict else stmt
+
+
+def bulk_insert(
+    db: Session,
+    model,
+    rows: Sequence[Dict],
+    batch_size: Optional[int] = None,
+    on_conflict: Optional[Callable[[Insert], Insert]] = None
+) -> int:
+    """
+    Insert rows in batches (does not commit)
+
+    Args:
+        db: Database session
+        model: Mapped class to insert into
+        rows: Column-value dicts (all with the same keys)
+        batch_size: Rows per statement (default BULK_INSERT_BATCH_SIZE)
+        on_conflict: Adds an ON CONFLICT clause to each statement, e.g.
+            ``lambda stmt: stmt.on_conflict_do_nothing()``
+
+    Returns:
+        Number of rows sent
+    """
+    for stmt in insert_statements(model, rows, batch_size, on_conflict):
+        db.execute(stmt)
+    return len(rows)
+
+
+async def bulk_insert_async(
+    db: AsyncSession,
+    model,
+    rows: Sequence[Dict],
+    batch_size: Optional[int] = None,
+    on_conflict: Optional[Callable[[Insert], Insert]] = None
+) -> int:
+    """Async version of bulk_insert (does not commit)"""
+    for stmt in insert_statements(model, rows, batch_size, on_conflict):
+        await db.execute(stmt)
+    return len(rows)
@@ -0,0 +1,306 @@
+"""
+Token-Window Chunking
+Splits text into overlapping token windows, returned as character spans into
+the source text rather than copies of it. Windows end at a paragraph or
+sentence break when one falls near the token limit.
+
+The tokenizer is loaded once per process (warm_tokenizer runs at startup in
+the app and in each pool worker). The byte length of each token id is cached
+per process as ids are first seen, so token positions map to character
+offsets without decoding.
+
+A long text can also be chunked in ranges on several workers (chunk_range)
+and the ranges joined afterwards (stitch_range_spans).
+"""
+
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# cl100k_base is the tokenizer of the text-embedding-3 models
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# How far back from the token limit a window may end to land on a paragraph or sentence break
+CHUNK_BOUNDARY_LOOKBACK_TOKENS = int(os.getenv("CHUNK_BOUNDARY_LOOKBACK_TOKENS", "100"))
+
+# Blank line(s) between paragraphs; any position inside the run is a paragraph break
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+# Sentence-ending punctuation (and closing quotes/brackets) followed by whitespace
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*(\s+)")
+_NO_BREAK, _SENTENCE, _PARAGRAPH = 0, 1, 2
+
+
+class ChunkSpan(NamedTuple):
+    """A chunk as a character range of the source text"""
+    start: int
+    end: int
+    token_count: int
+
+
+@lru_cache(maxsize=1)
+def get_encoding() -> tiktoken.Encoding:
+    """The process-wide tokenizer"""
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
+
+
+# Byte length per token id by encoding name, -1 until the id is first seen in this process
+_byte_length_tables: Dict[str, np.ndarray] = {}
+
+
+def _token_byte_lengths(tokens: np.ndarray) -> np.ndarray:
+    """UTF-8 byte length of each token, filling the per-process table for new ids"""
+    encoding = get_encoding()
+    table = _byte_length_tables.get(encoding.name)
+    if table is None:
+        table = _byte_length_tables[encoding.name] = np.full(encoding.n_vocab, -1, dtype=np.int32)
+    lengths = table[tokens]
+    if (lengths < 0).any():
+        for token in np.unique(tokens[lengths < 0]).tolist():
+            table[token] = len(encoding.decode_single_token_bytes(token))
+        lengths = table[tokens]
+    return lengths
+
+
+def warm_tokenizer() -> None:
+    """Load the tokenizer (startup hook; never raises)"""
+    try:
+        get_encoding()
+    except Exception:
+        logger.warning("Tokenizer warm-up failed, it will load on first use", exc_info=True)
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Token count of each text"""
+    return [len(tokens) for tokens in get_encoding().encode_batch(texts, disallowed_special=())]
+
+
+def _char_offsets(text: str, tokens: List[int]) -> np.ndarray:
+    """
+    Character offset of each token boundary in text (len(tokens) + 1 values)
+
+    A boundary inside a multi-byte character is moved to the start of that character.
+    """
+    byte_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(_token_byte_lengths(np.asarray(tokens, dtype=np.int64)), out=byte_offsets[1:])
+    if text.isascii():
+        return byte_offsets
+
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    char_bytes = 1 + (codepoints >= 0x80) + (codepoints >= 0x800) + (codepoints >= 0x10000)
+    char_ends = np.cumsum(char_bytes)
+    return np.searchsorted(char_ends, byte_offsets, side="right")
+
+
+def _break_rank(text: str, positions: np.ndarray) -> np.ndarray:
+    """How good a cut each position in text is: paragraph break > sentence end > anywhere"""
+    ranks = np.full(len(positions), _NO_BREAK, dtype=np.int8)
+    lo, hi = int(positions.min()), int(positions.max())
+    # A little context either side so runs that straddle the range still match
+    window_start = max(0, lo - 4)
+    window = text[window_start:hi + 4]
+
+    for pattern, rank, group in ((_SENTENCE_END, _SENTENCE, 1), (_PARAGRAPH_BREAK, _PARAGRAPH, 0)):
+        for match in pattern.finditer(window):
+            start, end = match.start(group) + window_start, match.end(group) + window_start
+            inside = (positions >= start) & (positions <= end)
+            ranks[inside] = np.maximum(ranks[inside], rank)
+    return ranks
+
+
+class _Tail(NamedTuple):
+    """Tokens still pending when the input ends: where they start, and their (trimmed) window"""
+    start: int
+    span: Optional[ChunkSpan]
+
+
+def _iter_windows(pieces: Iterable[str],
+                  chunk_size: int,
+                  overlap: int,
+                  boundary_lookback: Optional[int]) -> Iterator[Union[ChunkSpan, _Tail]]:
+    """Full windows of iter_chunk_spans, then a _Tail for the tokens left over"""
+    encoding = get_encoding()
+    lookback = min(boundary_lookback or 0, chunk_size - overlap - 1) if chunk_size > overlap else 0
+
+    text = ""  # buffered text, covering at least the pending tokens
+    text_start = 0  # offset of the buffer in the whole stream
+    consumed = 0  # characters of the stream seen so far
+    bounds = np.zeros(1, dtype=np.int64)  # offsets of pending token boundaries
+
+    def span(start: int, end: int, token_count: int) -> ChunkSpan:
+        chunk = text[start - text_start:end - text_start]
+        stripped = chunk.strip()
+        if not stripped:
+            return ChunkSpan(start, start, token_count)
+        lead = len(chunk) - len(chunk.lstrip())
+        return ChunkSpan(start + lead, start + lead + len(stripped), token_count)
+
+    for piece in pieces:
+        if not piece:
+            continue
+        tokens = encoding.encode(piece, disallowed_special=())
+        bounds = np.concatenate((bounds, _char_offsets(piece, tokens)[1:] + consumed))
+        text += piece
+        consumed += len(piece)
+
+        # More than one window's worth pending: the window from bounds[0] is not the last
+        while len(bounds) - 1 > chunk_size:
+            end = chunk_size
+            if lookback:
+                candidates = np.arange(chunk_size - lookback, chunk_size + 1)
+                ranks = _break_rank(text, bounds[candidates] - text_start)
+                best = ranks.max()
+                if best > _NO_BREAK:
+                    end = int(candidates[np.flatnonzero(ranks == best)[-1]])
+
+            chunk = span(int(bounds[0]), int(bounds[end]), end)
+            if chunk.end > chunk.start:
+                yield chunk
+            # lookback < chunk_size - overlap, so this always moves forward
+            bounds = bounds[max(end - overlap, 1):]
+            # Drop consumed text once it is most of the buffer (amortized, not a copy per window)
+            if int(bounds[0]) - text_start > len(text) // 2:
+                text = text[int(bounds[0]) - text_start:]
+                text_start = int(bounds[0])
+
+    pending = len(bounds) - 1
+    yield _Tail(int(bounds[0]), span(int(bounds[0]), int(bounds[-1]), pending) if pending else None)
+
+
+def iter_chunk_spans(pieces: Iterable[str],
+                     chunk_size: int = CHUNK_SIZE_TOKENS,
+                     overlap: int = CHUNK_OVERLAP_TOKENS,
+                     boundary_lookback: Optional[int] = CHUNK_BOUNDARY_LOOKBACK_TOKENS) -> Iterator[ChunkSpan]:
+    """
+    Chunk a stream of text pieces into overlapping token windows
+
+    Offsets are into the concatenated pieces. Beyond the current piece, only
+    about a window's worth of text and token offsets is buffered. Each window ends at the latest paragraph
+    break (else sentence end) within its last boundary_lookback tokens, or at
+    chunk_size tokens if there is none; the next window starts overlap tokens
+    before that. Whitespace at either end of a span is trimmed.
+
+    Args:
+        pieces: Text in order (pages, paragraphs or blocks), consumed once
+        chunk_size: Maximum tokens per window
+        overlap: Tokens shared by consecutive windows
+        boundary_lookback: Tokens to search back for a break (None or 0: fixed windows)
+
+    Yields:
+        ChunkSpan per window, in order
+    """
+    last_end = 0
+    for window in _iter_windows(pieces, chunk_size, overlap, boundary_lookback):
+        if isinstance(window, _Tail):
+            # Skip a tail that is entirely overlap with the previous window
+            if window.span is not None and window.span.end > max(window.span.start, last_end):
+                yield window.span
+        else:
+            yield window
+            last_end = window.end
+
+
+def chunk_range(pieces: Iterable[str],
+                chunk_size: int = CHUNK_SIZE_TOKENS,
+                overlap: int = CHUNK_OVERLAP_TOKENS,
+                boundary_lookback: Optional[int] = CHUNK_BOUNDARY_LOOKBACK_TOKENS) -> Tuple[List[ChunkSpan], int]:
+    """
+    Chunk one range of a longer text, leaving its last partial window to stitch_range_spans
+
+    Returns:
+        The range's full windows (as iter_chunk_spans, offsets into the range),
+        and the offset where its unchunked tail starts
+    """
+    spans = list(_iter_windows(pieces, chunk_size, overlap, boundary_lookback))
+    return spans[:-1], spans[-1].start
+
+
+def _seam_spans(text: str, start: int, seam: int, end: int,
+                chunk_size: int, overlap: int, boundary_lookback: Optional[int]) -> Iterator[ChunkSpan]:
+    """
+    Windows over text[start:end] joining a carried tail (before seam) to the
+    next range's first window, taken until one reaches overlap tokens past the seam
+    """
+    piece = text[start:end]
+    tokens = get_encoding().encode(piece, disallowed_special=())
+    bounds = _char_offsets(piece, tokens)
+    past_seam = int(np.searchsorted(bounds, seam - start))
+    target = int(bounds[min(past_seam + overlap, len(tokens))])
+    for span in iter_chunk_spans([piece], chunk_size, overlap, boundary_lookback):
+        yield ChunkSpan(span.start + start, span.end + start, span.token_count)
+        if span.end >= target:
+            return
+
+
+def stitch_range_spans(text: str,
+                       ranges: Sequence[Tuple[int, List[ChunkSpan], int]],
+                       chunk_size: int = CHUNK_SIZE_TOKENS,
+                       overlap: int = CHUNK_OVERLAP_TOKENS,
+                       boundary_lookback: Optional[int] = CHUNK_BOUNDARY_LOOKBACK_TOKENS) -> List[ChunkSpan]:
+    """
+    Chunk spans of text from consecutive ranges chunked separately (see chunk_range)
+
+    Each range's windows are rebased to offsets into text. The first range's
+    windows are exactly iter_chunk_spans'. At each later seam, the carried
+    tail and the next range's first window are re-chunked until a window
+    reaches overlap tokens into the next range, so consecutive chunks still
+    overlap by at least overlap tokens; only seams are tokenized again here.
+    Ranges with no full window are carried into the next seam.
+
+    Args:
+        text: The whole text (the ranges' texts concatenated)
+        ranges: Per range in order: its length in text, then chunk_range's result
+    """
+    spans = []
+
+    def emit(window: ChunkSpan) -> None:
+        # Tails can be entirely overlap with the previous window
+        if window.end > max(window.start, spans[-1].end if spans else 0):
+            spans.append(window)
+
+    offset = 0
+    carry_start = 0
+    for length, windows, tail_start in ranges:
+        if windows:
+            if text[carry_start:offset].strip():
+                for window in _seam_spans(text, carry_start, offset, offset + windows[0].end,
+                                          chunk_size, overlap, boundary_lookback):
+                    emit(window)
+            for window in windows:
+                emit(ChunkSpan(window.start + offset, window.end + offset, window.token_count))
+            carry_start = offset + tail_start
+        offset += length
+
+    for window in iter_chunk_spans([text[carry_start:]], chunk_size, overlap, boundary_lookback):
+        emit(ChunkSpan(window.start + carry_start, window.end + carry_start, window.token_count))
+    return spans
+
+
+def chunk_spans(text: str,
+                chunk_size: int = CHUNK_SIZE_TOKENS,
+                overlap: int = CHUNK_OVERLAP_TOKENS,
+                boundary_lookback: Optional[int] = CHUNK_BOUNDARY_LOOKBACK_TOKENS) -> List[ChunkSpan]:
+    """Chunk spans of a single text (see iter_chunk_spans)"""
+    return list(iter_chunk_spans([text], chunk_size, overlap, boundary_lookback))
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    Split text into chunks with overlap
+
+    Args:
+        text: The text to chunk
+        chunk_size: Target chunk size in tokens (default: 500)
+        overlap: Number of overlapping tokens between chunks (default: 50)
+
+    Returns:
+        List of text chunks
+    """
+    return [text[span.start:span.end] for span in chunk_spans(text, chunk_size, overlap)]
@@ -0,0 +1,115 @@
+"""
+Embedding Cache
+Content-addressed embeddings: keyed by sha256 of the text plus model and
+dimensions, held in an in-process LRU in front of the embedding_cache table.
+Only texts missing from both are sent to the embeddings API.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Tuple
+import numpy as np
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import EmbeddingCache
+from utils.bulk import bulk_insert_async
+from utils.cache import LRUCache
+from utils.embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, embed_texts
+
+# Entries in the in-process LRU (about 6 KB each at 1536 float32 dimensions)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+# Hashes per lookup query
+EMBEDDING_CACHE_LOOKUP_BATCH = int(os.getenv("EMBEDDING_CACHE_LOOKUP_BATCH", "1000"))
+
+_memory_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _memory_key(digest: str) -> Tuple[str, str, int]:
+    return (digest, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+
+
+async def _load(digests: List[str]) -> Dict[str, np.ndarray]:
+    """Stored embeddings for the given hashes (missing hashes are left out)"""
+    found = {}
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(digests), EMBEDDING_CACHE_LOOKUP_BATCH):
+            rows = await db.execute(
+                select(EmbeddingCache.text_hash, EmbeddingCache.embedding).where(
+                    EmbeddingCache.text_hash.in_(digests[start:start + EMBEDDING_CACHE_LOOKUP_BATCH]),
+                    EmbeddingCache.model == EMBEDDING_MODEL,
+                    EmbeddingCache.dimensions == EMBEDDING_DIMENSIONS
+                )
+            )
+            for digest, embedding in rows:
+                found[digest] = np.asarray(embedding, dtype=np.float32)
+    return found
+
+
+async def _store(embeddings: Dict[str, List[float]]) -> None:
+    async with AsyncSessionLocal() as db:
+        await bulk_insert_async(db, EmbeddingCache, [
+            {
+                "text_hash": digest,
+                "model": EMBEDDING_MODEL,
+                "dimensions": EMBEDDING_DIMENSIONS,
+                "embedding": embedding
+            }
+            for digest, embedding in embeddings.items()
+        ], on_conflict=lambda stmt: stmt.on_conflict_do_nothing())
+        await db.commit()
+
+
+async def cached_embeddings(texts: List[str], api_key: str) -> List[List[float]]:
+    """
+    Embed texts, reusing any embedding already computed for the same text
+
+    Lookup order is the in-process LRU, then the embedding_cache table, then
+    the API (each distinct missing text is embedded once). Cache read or write
+    failures are logged and fall back to the API, never fail the request.
+
+    Args:
+        texts: Texts to embed
+        api_key: OpenAI API key
+
+    Returns:
+        One embedding per text, in input order
+    """
+    if not texts:
+        return []
+
+    digests = [text_hash(text) for text in texts]
+    vectors: Dict[str, np.ndarray] = {}
+    for digest in set(digests):
+        vector = _memory_cache.get(_memory_key(digest))
+        if vector is not None:
+            vectors[digest] = vector
+
+    missing = [d for d in dict.fromkeys(digests) if d not in vectors]
+    if missing:
+        try:
+            stored = await _load(missing)
+        except Exception as e:
+            print(f"Embedding cache lookup failed: {e}")
+            stored = {}
+        for digest, vector in stored.items():
+            vectors[digest] = vector
+            _memory_cache.put(_memory_key(digest), vector)
+        missing = [d for d in missing if d not in vectors]
+
+    if missing:
+        text_by_digest = dict(zip(digests, texts))
+        fresh = await embed_texts([text_by_digest[d] for d in missing], api_key)
+        for digest, embedding in zip(missing, fresh):
+            vector = np.asarray(embedding, dtype=np.float32)
+            vectors[digest] = vector
+            _memory_cache.put(_memory_key(digest), vector)
+        try:
+            await _store(dict(zip(missing, fresh)))
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+
+    return [vectors[digest].tolist() for digest in digests]
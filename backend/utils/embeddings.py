@@ -0,0 +1,156 @@
+"""
+Embedding Client
+Async OpenAI embeddings over a pooled HTTP client: inputs are split into
+token-budgeted batches that run with bounded concurrency, and rate limits and
+transient errors are retried with exponential backoff
+"""
+
+import asyncio
+import os
+import random
+from typing import Dict, List, Optional
+import httpx
+import openai
+from utils.chunking import count_tokens
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Must match the document_chunks.embedding column
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# Per-request limits (the API allows 2048 inputs and 300k tokens; stay well inside)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "512"))
+# Concurrent embedding requests per process, shared by every caller
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_BACKOFF_BASE_SECONDS = float(os.getenv("EMBEDDING_BACKOFF_BASE_SECONDS", "0.5"))
+EMBEDDING_BACKOFF_MAX_SECONDS = float(os.getenv("EMBEDDING_BACKOFF_MAX_SECONDS", "30"))
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "60"))
+# Defaults to the public API; point at a local stub server for testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# One HTTP connection pool for the process; one lightweight API client per key on top of it
+_http_client: Optional[httpx.AsyncClient] = None
+_clients: Dict[str, openai.AsyncOpenAI] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_client(api_key: str) -> openai.AsyncOpenAI:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=EMBEDDING_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=EMBEDDING_CONCURRENCY * 2,
+                                max_keepalive_connections=EMBEDDING_CONCURRENCY)
+        )
+    client = _clients.get(api_key)
+    if client is None:
+        # Retries are handled here (with the shared concurrency limit), not by the SDK
+        client = openai.AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL,
+                                    http_client=_http_client, max_retries=0)
+        _clients[api_key] = client
+    return client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    return _semaphore
+
+
+async def close_embedding_clients() -> None:
+    """Close the pooled HTTP client (called from the app lifespan)"""
+    global _http_client, _semaphore
+    _clients.clear()
+    _semaphore = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def token_batches(token_counts: List[int],
+                  max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                  max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS) -> List[range]:
+    """
+    Split inputs (by their token counts) into consecutive batches within the
+    per-request token and input limits
+
+    Returns:
+        Index ranges into the inputs, in order
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if i > start and (batch_tokens + tokens > max_tokens or i - start >= max_inputs):
+            batches.append(range(start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += tokens
+    if start < len(token_counts):
+        batches.append(range(start, len(token_counts)))
+    return batches
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Backoff before retry number attempt (0-based): the server's Retry-After if given, else jittered exponential"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), EMBEDDING_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(EMBEDDING_BACKOFF_BASE_SECONDS * 2 ** attempt, EMBEDDING_BACKOFF_MAX_SECONDS))
+
+
+async def _embed_batch(client: openai.AsyncOpenAI, texts: List[str]) -> List[List[float]]:
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            async with _get_semaphore():
+                response = await client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=texts,
+                    dimensions=EMBEDDING_DIMENSIONS,
+                    encoding_format="float"
+                )
+            # The API returns items with their input index; don't rely on ordering
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            delay = _retry_delay(attempt, e)
+            print(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def embed_texts(texts: List[str], api_key: str) -> List[List[float]]:
+    """
+    Embed texts with the configured model
+
+    Args:
+        texts: Texts to embed
+        api_key: OpenAI API key
+
+    Returns:
+        One embedding per text, in input order
+
+    Raises:
+        openai.OpenAIError: If a batch still fails after EMBEDDING_MAX_RETRIES retries
+    """
+    if not texts:
+        return []
+
+    client = _get_client(api_key)
+    batches = token_batches(count_tokens(texts))
+    results = await asyncio.gather(*(
+        _embed_batch(client, [texts[i] for i in batch]) for batch in batches
+    ))
+    return [embedding for batch_embeddings in results for embedding in batch_embeddings]
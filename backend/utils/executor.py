@@ -0,0 +1,139 @@
+"""
+CPU Process Pool
+Runs CPU-bound work (track parsing, document extraction/chunking) in worker
+processes so it never blocks the event loop, with a bounded backlog that
+rejects new work instead of queueing without limit
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Sequence
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Jobs allowed to wait for a free worker before new work is rejected
+CPU_POOL_QUEUE_DEPTH = int(os.getenv("CPU_POOL_QUEUE_DEPTH", "8"))
+CPU_POOL_RETRY_AFTER_SECONDS = int(os.getenv("CPU_POOL_RETRY_AFTER_SECONDS", "5"))
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the process pool backlog is full (served as HTTP 503)"""
+
+    def __init__(self, retry_after: int = CPU_POOL_RETRY_AFTER_SECONDS):
+        super().__init__("Server is busy processing other uploads, please retry shortly")
+        self.retry_after = retry_after
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+# Run once in each worker process at startup (kept for pools recreated after a crash)
+_initializer: Optional[Callable[[], None]] = None
+# Submitted but unfinished jobs; only touched from the event loop thread
+_in_flight = 0
+
+
+def start_process_pool(initializer: Optional[Callable[[], None]] = None) -> ProcessPoolExecutor:
+    """
+    Create the worker pool (called from the app lifespan; idempotent)
+
+    Args:
+        initializer: Picklable module-level function run in each worker as it
+            starts, e.g. to load caches (must not raise, or the pool breaks)
+    """
+    global _pool, _initializer
+    if initializer is not None:
+        _initializer = initializer
+    if _pool is None:
+        # spawn: never fork a process that holds DB connections and threads
+        _pool = ProcessPoolExecutor(
+            max_workers=CPU_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initializer
+        )
+    return _pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the worker pool, cancelling jobs that have not started"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_cpu_bound(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a picklable module-level function in the process pool
+
+    Args:
+        fn: Function to run (must be importable by worker processes)
+        *args, **kwargs: Picklable arguments
+
+    Returns:
+        The function's return value
+
+    Raises:
+        PoolSaturatedError: If all workers are busy and the backlog is full
+    """
+    global _pool, _in_flight
+
+    if _in_flight >= CPU_POOL_WORKERS + CPU_POOL_QUEUE_DEPTH:
+        raise PoolSaturatedError()
+
+    pool = start_process_pool()
+    _in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); replace the pool for later requests
+        if _pool is pool:
+            _pool = None
+        raise
+    finally:
+        _in_flight -= 1
+
+
+async def map_cpu_bound(fn: Callable[..., Any],
+                        arg_tuples: Iterable[Sequence[Any]],
+                        max_in_flight: Optional[int] = None) -> AsyncIterator[Any]:
+    """
+    Run fn over many argument tuples in the process pool, yielding results in
+    input order as they become available
+
+    At most max_in_flight calls (default CPU_POOL_WORKERS) are submitted at
+    once, so one request split into many tasks never fills the backlog by
+    itself, and later tasks are only submitted as earlier results are consumed.
+    If a task fails or the caller stops iterating, tasks not yet started are
+    cancelled.
+
+    Raises:
+        PoolSaturatedError: If the backlog is full when a task is submitted
+    """
+    limit = max(1, max_in_flight or CPU_POOL_WORKERS)
+    pending = deque()
+    args_iter = iter(arg_tuples)
+
+    def submit_next() -> bool:
+        args = next(args_iter, None)
+        if args is None:
+            return False
+        pending.append(asyncio.ensure_future(run_cpu_bound(fn, *args)))
+        return True
+
+    try:
+        while len(pending) < limit and submit_next():
+            pass
+        while pending:
+            result = await pending[0]
+            pending.popleft()
+            submit_next()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -1,8 +1,26 @@
-import gpxpy
-import gpxpy.gpx
-from rdp import rdp
+import io
 import math
-from typing import List, Tuple, Dict, Optional
+import os
+import numpy as np
+from datetime import datetime, timezone
+from typing import BinaryIO, List, Tuple, Dict, Optional
+from utils.track_parser import read_track
+
+# Radius of earth in meters
+EARTH_RADIUS_METERS = 6371000
+
+# Route simplification tolerances in meters. The elevation tolerance is optional:
+# when set, points that shape climbs and descents are kept even on straight lines.
+SIMPLIFY_TOLERANCE_METERS = float(os.getenv("GPX_SIMPLIFY_TOLERANCE_METERS", "10"))
+SIMPLIFY_ELEVATION_TOLERANCE_METERS = (
+    float(os.getenv("GPX_SIMPLIFY_ELEVATION_TOLERANCE_METERS"))
+    if os.getenv("GPX_SIMPLIFY_ELEVATION_TOLERANCE_METERS") else None
+)
+
+# Stop detection for timed tracks: a point is stopped when its displacement over a
+# window centered on it is slower than this (GPS jitter while standing still is slower)
+STOP_SPEED_MPS = float(os.getenv("GPX_STOP_SPEED_MPS", "0.25"))
+STOP_WINDOW_SECONDS = float(os.getenv("GPX_STOP_WINDOW_SECONDS", "30"))
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -19,9 +37,7 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
     c = 2 * math.asin(math.sqrt(a))
     
-    # Radius of earth in meters
-    r = 6371000
-    return c * r
+    return c * EARTH_RADIUS_METERS
 
 def distance_3d(lat1: float, lon1: float, ele1: float, 
                 lat2: float, lon2: float, ele2: float) -> float:
@@ -33,158 +49,327 @@ def distance_3d(lat1: float, lon1: float, ele1: float,
     vertical_dist = abs(ele2 - ele1) if ele1 is not None and ele2 is not None else 0
     return math.sqrt(horizontal_dist**2 + vertical_dist**2)
 
-def simplify_coordinates(coordinates: List[List[float]], epsilon: float = 0.0001) -> List[List[float]]:
+def project_to_plane(lats: np.ndarray, lons: np.ndarray,
+                     ref_lat: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Simplify coordinates using Ramer-Douglas-Peucker algorithm
+    Project coordinates to a local planar frame in meters
+    (equirectangular around ref_lat, default the mean latitude - accurate enough
+    for route-scale geometry)
+    """
+    if ref_lat is None:
+        ref_lat = float(np.mean(lats)) if len(lats) else 0.0
+    x = np.radians(lons) * EARTH_RADIUS_METERS * math.cos(math.radians(ref_lat))
+    y = np.radians(lats) * EARTH_RADIUS_METERS
+    return x, y
+
+def simplify_track_indices(lats: np.ndarray,
+                           lons: np.ndarray,
+                           eles: Optional[np.ndarray] = None,
+                           tolerance_meters: float = SIMPLIFY_TOLERANCE_METERS,
+                           elevation_tolerance_meters: Optional[float] = None) -> np.ndarray:
+    """
+    Simplify a track with Ramer-Douglas-Peucker and return the indices of the kept points
+    
+    Iterative (stack-based) so long tracks cannot hit the recursion limit, with the
+    perpendicular distances for each span computed in one vectorized pass.
+    
+    Args:
+        lats: Latitudes in decimal degrees
+        lons: Longitudes in decimal degrees
+        eles: Elevations in meters (required for the elevation-aware mode)
+        tolerance_meters: Maximum horizontal deviation of a dropped point
+        elevation_tolerance_meters: If set, also keep points whose elevation deviates
+            more than this from the straight grade between the span's endpoints
+    
+    Returns:
+        Sorted array of kept indices (always includes the first and last point)
+    """
+    n = len(lats)
+    if n < 3:
+        return np.arange(n)
+    
+    x, y = project_to_plane(lats, lons)
+    
+    elevation_mode = eles is not None and elevation_tolerance_meters
+    if elevation_mode:
+        # Horizontal distance along the track, used to interpolate elevation within a span
+        along = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        chord = math.hypot(dx, dy)
+        
+        if chord > 0:
+            deviation = np.abs(px * dy - py * dx) / chord
+        else:
+            # Closed span (e.g. a loop returning to its start)
+            deviation = np.hypot(px, py)
+        score = deviation / tolerance_meters
+        
+        if elevation_mode:
+            span = along[end] - along[start]
+            fraction = (along[start + 1:end] - along[start]) / span if span > 0 else 0.0
+            expected = eles[start] + fraction * (eles[end] - eles[start])
+            score = np.maximum(score, np.abs(eles[start + 1:end] - expected) / elevation_tolerance_meters)
+        
+        worst = int(np.argmax(score))
+        if score[worst] > 1.0:
+            split = start + 1 + worst
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    
+    return np.flatnonzero(keep)
+
+def simplify_coordinates(coordinates: List[List[float]],
+                         tolerance_meters: float = SIMPLIFY_TOLERANCE_METERS,
+                         elevation_tolerance_meters: Optional[float] = None) -> List[List[float]]:
+    """
+    Simplify [lat, lon, ele] coordinates, keeping the original points (and their elevation)
     """
     if len(coordinates) < 3:
         return coordinates
     
-    # Convert to format expected by rdp
-    points = [[coord[0], coord[1]] for coord in coordinates]
-    simplified_points = rdp(points, epsilon=epsilon)
+    coords = np.asarray(coordinates, dtype=np.float64)
+    kept = simplify_track_indices(
+        coords[:, 0], coords[:, 1],
+        coords[:, 2] if coords.shape[1] > 2 else None,
+        tolerance_meters=tolerance_meters,
+        elevation_tolerance_meters=elevation_tolerance_meters
+    )
+    return [coordinates[i] for i in kept]
+
+def haversine_distances(lats1: np.ndarray, lons1: np.ndarray,
+                        lats2: np.ndarray, lons2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized haversine_distance over NumPy arrays (decimal degrees)
+    Returns distances in meters
+    """
+    lats1, lons1, lats2, lons2 = (np.radians(a) for a in (lats1, lons1, lats2, lons2))
     
-    # Map back to original coordinates with elevation
-    result = []
-    for sp in simplified_points:
-        for coord in coordinates:
-            if coord[0] == sp[0] and coord[1] == sp[1]:
-                result.append(coord)
-                break
+    dlat = lats2 - lats1
+    dlon = lons2 - lons1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lats1) * np.cos(lats2) * np.sin(dlon / 2) ** 2
     
-    return result
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
 
-def parse_gpx_file(gpx_content: str) -> Dict:
+def compute_track_metrics(lats: np.ndarray,
+                          lons: np.ndarray,
+                          eles: np.ndarray,
+                          times: Optional[np.ndarray] = None) -> Dict:
     """
-    Parse GPX file content and return optimized structure
-    Includes timestamp detection for timing data
+    Compute distance, elevation and timestamp metrics for a whole track in bulk
+    
+    Args:
+        lats: Latitudes in decimal degrees
+        lons: Longitudes in decimal degrees
+        eles: Elevations in meters, NaN where the point has no elevation
+        times: POSIX timestamps in seconds, NaN where the point has no time
+    
+    Returns:
+        Dict with total distance, gain/loss, min/max elevation and timestamp coverage
     """
-    gpx = gpxpy.parse(gpx_content)
+    total_points = len(lats)
+    has_ele = ~np.isnan(eles)
+    # Missing elevations count as 0, matching distance_3d's treatment of None
+    filled_eles = np.where(has_ele, eles, 0.0)
     
-    coordinates = []
-    total_distance = 0
-    elevation_gain = 0
-    elevation_loss = 0
-    min_elevation = float('inf')
-    max_elevation = float('-inf')
+    total_distance = 0.0
+    elevation_gain = 0.0
+    elevation_loss = 0.0
     
-    # Timestamp tracking
-    has_timestamps = False
+    if total_points > 1:
+        horizontal = haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+        ele_diff = np.diff(filled_eles)
+        total_distance = float(np.sqrt(horizontal ** 2 + ele_diff ** 2).sum())
+        
+        # Gain/loss only where both ends of the segment carry an elevation
+        valid_diff = np.where(has_ele[:-1] & has_ele[1:], ele_diff, 0.0)
+        elevation_gain = float(np.clip(valid_diff, 0.0, None).sum())
+        elevation_loss = float(np.clip(-valid_diff, 0.0, None).sum())
+    
+    # Timestamp coverage
     first_timestamp = None
     last_timestamp = None
     points_with_timestamps = 0
-    total_points = 0
-    
-    previous_point = None
-    
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for point in segment.points:
-                total_points += 1
-                lat, lon = point.latitude, point.longitude
-                ele = point.elevation if point.elevation else 0
-                
-                coordinates.append([lat, lon, ele])
-                
-                # Track timestamps if present
-                if point.time is not None:
-                    points_with_timestamps += 1
-                    if first_timestamp is None:
-                        first_timestamp = point.time
-                    last_timestamp = point.time
-                
-                # Update elevation stats
-                if ele < min_elevation:
-                    min_elevation = ele
-                if ele > max_elevation:
-                    max_elevation = ele
-                
-                # Calculate distance and elevation changes
-                if previous_point:
-                    dist = distance_3d(
-                        previous_point.latitude, previous_point.longitude, 
-                        previous_point.elevation or 0,
-                        lat, lon, ele
-                    )
-                    total_distance += dist
-                    
-                    if previous_point.elevation is not None and point.elevation is not None:
-                        ele_diff = point.elevation - previous_point.elevation
-                        if ele_diff > 0:
-                            elevation_gain += ele_diff
-                        else:
-                            elevation_loss += abs(ele_diff)
-                
-                previous_point = point
+    if times is not None and total_points > 0:
+        timed = np.flatnonzero(~np.isnan(times))
+        points_with_timestamps = len(timed)
+        if points_with_timestamps:
+            first_timestamp = float(times[timed[0]])
+            last_timestamp = float(times[timed[-1]])
     
     # Determine if we have sufficient timestamps (at least 80% of points)
     has_timestamps = (points_with_timestamps / total_points) >= 0.8 if total_points > 0 else False
     
     # Calculate duration if timestamps available
     timestamp_duration_minutes = None
-    if has_timestamps and first_timestamp and last_timestamp:
-        duration_seconds = (last_timestamp - first_timestamp).total_seconds()
-        timestamp_duration_minutes = duration_seconds / 60
-    
-    # Simplify coordinates
-    simplified_coords = simplify_coordinates(coordinates, epsilon=0.0001)
-    
-    # Calculate bounding box
-    lats = [c[0] for c in simplified_coords]
-    lons = [c[1] for c in simplified_coords]
+    if has_timestamps and first_timestamp is not None and last_timestamp is not None:
+        timestamp_duration_minutes = (last_timestamp - first_timestamp) / 60
     
     return {
-        "coordinates": simplified_coords,
         "total_distance_meters": total_distance,
         "elevation_gain_meters": elevation_gain,
         "elevation_loss_meters": elevation_loss,
-        "min_elevation": min_elevation if min_elevation != float('inf') else 0,
-        "max_elevation": max_elevation if max_elevation != float('-inf') else 0,
+        "min_elevation": float(filled_eles.min()) if total_points else 0,
+        "max_elevation": float(filled_eles.max()) if total_points else 0,
+        "has_timestamps": has_timestamps,
+        "timestamp_duration_minutes": timestamp_duration_minutes,
+        "first_timestamp": _format_timestamp(first_timestamp),
+        "last_timestamp": _format_timestamp(last_timestamp)
+    }
+
+def moving_time_seconds(lats: np.ndarray,
+                        lons: np.ndarray,
+                        times: np.ndarray,
+                        stop_speed_mps: float = STOP_SPEED_MPS,
+                        window_seconds: float = STOP_WINDOW_SECONDS) -> Optional[np.ndarray]:
+    """
+    Cumulative moving time at each point of a timed track
+    
+    A segment counts as moving when the straight-line displacement across a
+    window of window_seconds centered on it is at least stop_speed_mps; using
+    displacement rather than path length keeps GPS jitter at a stop from adding
+    up to movement. Fully vectorized, so a 12 hour track at 1 Hz is cheap.
+    
+    Args:
+        lats: Latitudes in decimal degrees
+        lons: Longitudes in decimal degrees
+        times: POSIX timestamps in seconds, NaN where the point has no time
+    
+    Returns:
+        Moving seconds from the start at each point (untimed points take their
+        neighbours' values), or None if fewer than two points are timed
+    """
+    timed = np.flatnonzero(~np.isnan(times))
+    if len(timed) < 2:
+        return None
+    
+    # Clocks occasionally step backwards; never let time run in reverse
+    t = np.maximum.accumulate(times[timed])
+    
+    x, y = project_to_plane(lats[timed], lons[timed])
+    
+    # Displacement across a window centered on each segment's midpoint
+    midpoints = (t[:-1] + t[1:]) / 2
+    ahead = np.minimum(midpoints + window_seconds / 2, t[-1])
+    behind = np.maximum(midpoints - window_seconds / 2, t[0])
+    displacement = np.hypot(np.interp(ahead, t, x) - np.interp(behind, t, x),
+                            np.interp(ahead, t, y) - np.interp(behind, t, y))
+    span = ahead - behind
+    speed = np.divide(displacement, span, out=np.zeros_like(span), where=span > 0)
+    
+    moving = np.concatenate(([0.0], np.cumsum(np.where(speed >= stop_speed_mps, np.diff(t), 0.0))))
+    return np.interp(np.arange(len(times)), timed, moving)
+
+def _format_timestamp(timestamp: Optional[float]) -> Optional[str]:
+    """Format a POSIX timestamp as an ISO 8601 UTC string"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+def parse_track_stream(stream: BinaryIO,
+                       tolerance_meters: float = SIMPLIFY_TOLERANCE_METERS,
+                       elevation_tolerance_meters: Optional[float] = SIMPLIFY_ELEVATION_TOLERANCE_METERS) -> Dict:
+    """
+    Parse a GPX or TCX file stream and return optimized structure
+    Includes timestamp detection for timing data; 'times' and 'moving_seconds'
+    are NumPy arrays aligned with 'coordinates'
+    """
+    track = read_track(stream)
+    lats, lons, eles, times = track["lats"], track["lons"], track["eles"], track["times"]
+    
+    if len(lats) == 0:
+        raise ValueError("No track points found in file")
+    
+    metrics = compute_track_metrics(lats, lons, eles, times)
+    
+    # Moving time is computed at full resolution, then sampled at the kept points
+    moving = moving_time_seconds(lats, lons, times) if metrics["has_timestamps"] else None
+    
+    # Simplify by index so elevation and timestamps travel with the kept points
+    filled_eles = np.nan_to_num(eles, nan=0.0)
+    kept = simplify_track_indices(
+        lats, lons, filled_eles,
+        tolerance_meters=tolerance_meters,
+        elevation_tolerance_meters=elevation_tolerance_meters
+    )
+    if moving is not None:
+        # Keep where the track stops and starts again, so stops survive simplification
+        stopped = np.diff(moving) == 0
+        changes = np.flatnonzero(stopped[1:] != stopped[:-1]) + 1
+        kept = np.union1d(kept, changes)
+    simplified_coords = np.column_stack((lats[kept], lons[kept], filled_eles[kept])).tolist()
+    
+    return {
+        "format": track["format"],
+        "coordinates": simplified_coords,
+        "total_distance_meters": metrics["total_distance_meters"],
+        "elevation_gain_meters": metrics["elevation_gain_meters"],
+        "elevation_loss_meters": metrics["elevation_loss_meters"],
+        "min_elevation": metrics["min_elevation"],
+        "max_elevation": metrics["max_elevation"],
         "bounding_box": [
-            [min(lats), min(lons)],
-            [max(lats), max(lons)]
+            [float(lats[kept].min()), float(lons[kept].min())],
+            [float(lats[kept].max()), float(lons[kept].max())]
         ],
-        "original_points": len(coordinates),
+        "original_points": len(lats),
         "simplified_points": len(simplified_coords),
-        "has_timestamps": has_timestamps,
-        "timestamp_duration_minutes": timestamp_duration_minutes,
-        "first_timestamp": first_timestamp.isoformat() if first_timestamp else None,
-        "last_timestamp": last_timestamp.isoformat() if last_timestamp else None
+        "has_timestamps": metrics["has_timestamps"],
+        "timestamp_duration_minutes": metrics["timestamp_duration_minutes"],
+        "first_timestamp": metrics["first_timestamp"],
+        "last_timestamp": metrics["last_timestamp"],
+        "moving_time_minutes": float(moving[-1]) / 60 if moving is not None else None,
+        # Per kept point, for route storage (None without timestamps)
+        "times": times[kept] if metrics["has_timestamps"] else None,
+        "moving_seconds": moving[kept] if moving is not None else None
     }
 
+def parse_gpx_file(gpx_content: str, **kwargs) -> Dict:
+    """
+    Parse GPX (or TCX) file content held in memory
+    Prefer parse_track_stream for uploads so the file is never fully loaded
+    """
+    return parse_track_stream(io.BytesIO(gpx_content.encode('utf-8')), **kwargs)
+
 def find_closest_point_on_route(route_coords: List[List[float]], 
                                  target_lat: float, 
                                  target_lon: float) -> Tuple[int, float]:
     """
     Find the closest point on the route to a given coordinate
     Returns: (index of closest point, distance from start in meters)
+    
+    One-off vectorized scan; use utils.route_index.RouteIndex for repeated queries
     """
-    min_distance = float('inf')
-    closest_index = 0
-    distance_from_start = 0
-    cumulative_distance = 0
+    coords = np.asarray(route_coords, dtype=np.float64)
+    lats, lons = coords[:, 0], coords[:, 1]
     
-    for i, coord in enumerate(route_coords):
-        dist = haversine_distance(target_lat, target_lon, coord[0], coord[1])
-        
-        if dist < min_distance:
-            min_distance = dist
-            closest_index = i
-            distance_from_start = cumulative_distance
-        
-        if i > 0:
-            cumulative_distance += haversine_distance(
-                route_coords[i-1][0], route_coords[i-1][1],
-                coord[0], coord[1]
-            )
+    distances = haversine_distances(np.full(len(lats), target_lat), np.full(len(lons), target_lon), lats, lons)
+    closest_index = int(np.argmin(distances))
     
-    return closest_index, distance_from_start
+    segment_lengths = haversine_distances(lats[:closest_index], lons[:closest_index],
+                                          lats[1:closest_index + 1], lons[1:closest_index + 1])
+    return closest_index, float(segment_lengths.sum())
 
 def calculate_leg_metrics(route_coords: List[List[float]], 
                           start_index: int, 
                           end_index: int) -> Dict:
     """
     Calculate distance and elevation metrics for a leg between two points
+    
+    For repeated legs on the same route use utils.route_profile.RouteProfile,
+    which answers this from prefix sums
     """
     if start_index >= end_index or end_index >= len(route_coords):
         return {
@@ -193,29 +378,14 @@ def calculate_leg_metrics(route_coords: List[List[float]],
             "elevation_loss": 0
         }
     
-    total_distance = 0
-    elevation_gain = 0
-    elevation_loss = 0
-    
-    for i in range(start_index + 1, end_index + 1):
-        prev = route_coords[i - 1]
-        curr = route_coords[i]
-        
-        # Add distance
-        total_distance += distance_3d(prev[0], prev[1], prev[2], 
-                                      curr[0], curr[1], curr[2])
-        
-        # Calculate elevation change
-        ele_diff = curr[2] - prev[2]
-        if ele_diff > 0:
-            elevation_gain += ele_diff
-        else:
-            elevation_loss += abs(ele_diff)
+    leg = np.asarray(route_coords[start_index:end_index + 1], dtype=np.float64)
+    horizontal = haversine_distances(leg[:-1, 0], leg[:-1, 1], leg[1:, 0], leg[1:, 1])
+    ele_diff = np.diff(leg[:, 2])
     
     return {
-        "distance": total_distance,
-        "elevation_gain": elevation_gain,
-        "elevation_loss": elevation_loss
+        "distance": float(np.sqrt(horizontal ** 2 + ele_diff ** 2).sum()),
+        "elevation_gain": float(np.clip(ele_diff, 0.0, None).sum()),
+        "elevation_loss": float(np.clip(-ele_diff, 0.0, None).sum())
     }
 
 def meters_to_miles(meters: float) -> float:
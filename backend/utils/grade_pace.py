@@ -0,0 +1,82 @@
+"""
+Grade-Adjusted Pace
+Effort per route segment from its local grade (a GAP curve), integrated with
+prefix sums so the effort of any leg is two array lookups. A leg with one steep
+climb costs more than a leg with the same total gain spread evenly.
+"""
+
+import os
+from typing import Hashable
+import numpy as np
+from utils.cache import LRUCache
+from utils.route_profile import RouteProfile
+
+# Grades are clipped to this magnitude (steeper is hiking / scrambling, off the curve)
+GAP_MAX_GRADE = float(os.getenv("GAP_MAX_GRADE", "0.45"))
+# Grade is measured over this much horizontal distance around each segment to smooth GPS elevation noise
+GAP_GRADE_WINDOW_METERS = float(os.getenv("GAP_GRADE_WINDOW_METERS", "100"))
+GRADE_COST_CACHE_SIZE = int(os.getenv("GRADE_COST_CACHE_SIZE", "64"))
+
+# Energy cost of running on a grade (J/kg/m), Minetti et al. 2002, highest power first
+_MINETTI_COEFFICIENTS = (155.4, -30.4, -43.3, 46.3, 19.5, 3.6)
+_FLAT_COST = _MINETTI_COEFFICIENTS[-1]
+
+
+def gap_multiplier(grades, max_grade: float = GAP_MAX_GRADE) -> np.ndarray:
+    """
+    Effort relative to flat ground for each grade (rise over run)
+
+    1.0 on the flat, above 1 uphill, below 1 on moderate descents and rising
+    again on steep ones
+    """
+    clipped = np.clip(np.asarray(grades, dtype=np.float64), -max_grade, max_grade)
+    return np.polyval(_MINETTI_COEFFICIENTS, clipped) / _FLAT_COST
+
+
+class GradeCostProfile:
+    """
+    Cumulative grade-adjusted distance at each route vertex
+
+    cost[i] is the flat-equivalent distance (meters) from the start to vertex i:
+    each segment's 3D length weighted by the GAP multiplier of its smoothed grade.
+    """
+
+    def __init__(self, profile: RouteProfile, max_grade: float = GAP_MAX_GRADE,
+                 window_meters: float = GAP_GRADE_WINDOW_METERS):
+        self.profile = profile
+        horizontal = profile.horizontal
+
+        if profile.point_count < 2:
+            self.cost = np.zeros(profile.point_count)
+            return
+
+        # Smoothed grade: elevation change across a window centered on each segment midpoint
+        midpoints = (horizontal[:-1] + horizontal[1:]) / 2
+        half_window = window_meters / 2
+        ahead = np.minimum(midpoints + half_window, horizontal[-1])
+        behind = np.maximum(midpoints - half_window, 0.0)
+        run = ahead - behind
+        rise = np.interp(ahead, horizontal, profile.elevation) - np.interp(behind, horizontal, profile.elevation)
+        grades = np.divide(rise, run, out=np.zeros_like(run), where=run > 0)
+
+        segment_cost = np.diff(profile.distance) * gap_multiplier(grades, max_grade)
+        self.cost = np.concatenate(([0.0], np.cumsum(segment_cost)))
+
+    def cost_between(self, start_position: float, end_position: float) -> float:
+        """Grade-adjusted distance (meters) between two route positions (0 if end is not after start)"""
+        if end_position <= start_position:
+            return 0.0
+        return self.profile.cumulative_at(self.cost, end_position) - self.profile.cumulative_at(self.cost, start_position)
+
+
+_cost_cache = LRUCache(GRADE_COST_CACHE_SIZE)
+
+
+def get_grade_cost_profile(cache_key: Hashable, profile: RouteProfile,
+                           max_grade: float = GAP_MAX_GRADE,
+                           window_meters: float = GAP_GRADE_WINDOW_METERS) -> GradeCostProfile:
+    """Return the cached cost profile for a route version and parameter set, building it on first use"""
+    return _cost_cache.get_or_create(
+        (cache_key, max_grade, window_meters),
+        lambda: GradeCostProfile(profile, max_grade, window_meters)
+    )
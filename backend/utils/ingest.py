@@ -0,0 +1,179 @@
+"""
+Track Ingestion
+Resolves an uploaded track to a (content-addressed) route row and applies it
+to an event. Shared by the synchronous upload endpoints and the background
+ingest job worker.
+"""
+
+from typing import Dict, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from models import Event, Route, Waypoint
+from utils.executor import run_cpu_bound
+from utils.gpx_processor import meters_to_miles
+from utils.route_storage import parse_and_encode_track, route_content_key
+
+PLANNED = "planned"
+ACTUAL = "actual"
+
+
+async def _find_route(db: AsyncSession, content_key: str) -> Optional[Route]:
+    result = await db.execute(
+        select(Route).options(defer(Route.data)).where(Route.content_hash == content_key)
+    )
+    return result.scalars().first()
+
+
+async def resolve_track(db: AsyncSession, file_sha256: str, path: str) -> Tuple[Route, Dict]:
+    """
+    Route row and track metadata for an uploaded file
+
+    A file already ingested with the same simplification settings reuses its
+    stored route and metadata without being parsed again; otherwise the file is
+    parsed in the process pool and a new route row is inserted (not committed).
+
+    Raises:
+        PoolSaturatedError: If the file needs parsing and the process pool is full
+    """
+    content_key = route_content_key(file_sha256)
+    route = await _find_route(db, content_key)
+    if route is not None:
+        return route, route.track_metadata
+
+    track = await run_cpu_bound(parse_and_encode_track, path)
+    encoded_route = track.pop("encoded_route")
+
+    # An identical upload may have been ingested concurrently; keep whichever row won
+    route_id = (await db.execute(
+        pg_insert(Route).values(
+            data=encoded_route,
+            point_count=track["simplified_points"],
+            content_hash=content_key,
+            track_metadata=track
+        ).on_conflict_do_nothing(index_elements=["content_hash"]).returning(Route.id)
+    )).scalar()
+    route = await db.get(Route, route_id, options=[defer(Route.data)]) if route_id else await _find_route(db, content_key)
+    return route, route.track_metadata
+
+
+async def apply_planned_track(db: AsyncSession, event: Event, route: Route, gpx_data: Dict) -> Dict:
+    """
+    Store a planned route on an event and reset its waypoints to START/FINISH
+    (does not commit)
+
+    Returns:
+        The event's new gpx_metadata
+    """
+    # Reference the shared route (binary, with its prefix-sum profile) and store metadata
+    event.route = route
+    event.gpx_route = None
+    event.gpx_metadata = {
+        "total_distance_meters": gpx_data["total_distance_meters"],
+        "elevation_gain_meters": gpx_data["elevation_gain_meters"],
+        "elevation_loss_meters": gpx_data["elevation_loss_meters"],
+        "min_elevation": gpx_data["min_elevation"],
+        "max_elevation": gpx_data["max_elevation"],
+        "bounding_box": gpx_data["bounding_box"],
+        "original_points": gpx_data["original_points"],
+        "simplified_points": gpx_data["simplified_points"],
+        "has_timestamps": gpx_data.get("has_timestamps", False),
+        "timestamp_duration_minutes": gpx_data.get("timestamp_duration_minutes"),
+        "first_timestamp": gpx_data.get("first_timestamp"),
+        "last_timestamp": gpx_data.get("last_timestamp")
+    }
+
+    # Update event distance if not set
+    if not event.distance:
+        event.distance = meters_to_miles(gpx_data["total_distance_meters"])
+
+    # Delete existing waypoints for clean start
+    await db.execute(delete(Waypoint).where(Waypoint.event_id == event.id))
+
+    # Create START and FINISH waypoints at the first and last coordinates
+    start_coord = gpx_data.get("start_coordinate")
+    finish_coord = gpx_data.get("end_coordinate")
+    if start_coord and finish_coord:
+        db.add(Waypoint(
+            event_id=event.id,
+            name="START",
+            waypoint_type="checkpoint",
+            latitude=start_coord[0],
+            longitude=start_coord[1],
+            elevation=start_coord[2] if len(start_coord) > 2 else None,
+            stop_time_minutes=0,
+            order_index=0,
+            distance_from_start=0,
+            comments="Start of route"
+        ))
+
+        db.add(Waypoint(
+            event_id=event.id,
+            name="FINISH",
+            waypoint_type="checkpoint",
+            latitude=finish_coord[0],
+            longitude=finish_coord[1],
+            elevation=finish_coord[2] if len(finish_coord) > 2 else None,
+            stop_time_minutes=0,
+            order_index=999999,  # Large number to keep it at end
+            distance_from_start=gpx_data["total_distance_meters"],
+            comments="End of route"
+        ))
+
+    return event.gpx_metadata
+
+
+async def apply_actual_track(db: AsyncSession, event: Event, route: Route, gpx_data: Dict) -> Dict:
+    """
+    Store a recorded (actual) track on an event (does not commit)
+
+    Returns:
+        The actual track metadata
+    """
+    # Reference the actual track (binary) and store its metadata with timestamp information
+    event.actual_route = route
+    actual_data = {
+        "metadata": {
+            "total_distance_meters": gpx_data["total_distance_meters"],
+            "elevation_gain_meters": gpx_data["elevation_gain_meters"],
+            "elevation_loss_meters": gpx_data["elevation_loss_meters"],
+            "has_timestamps": gpx_data.get("has_timestamps", False),
+            "timestamp_duration_minutes": gpx_data.get("timestamp_duration_minutes"),
+            "moving_time_minutes": gpx_data.get("moving_time_minutes"),
+            "first_timestamp": gpx_data.get("first_timestamp"),
+            "last_timestamp": gpx_data.get("last_timestamp")
+        }
+    }
+    if gpx_data["format"] == "tcx":
+        event.actual_tcx_data = actual_data
+        event.actual_gpx_data = None
+    else:
+        event.actual_gpx_data = actual_data
+        event.actual_tcx_data = None
+
+    return actual_data["metadata"]
+
+
+def upload_message(kind: str, gpx_data: Dict) -> str:
+    """User-facing summary of a processed upload"""
+    if kind == PLANNED:
+        message = (f"GPX file processed successfully. {gpx_data['simplified_points']} points from "
+                   f"{gpx_data['original_points']} original. Start and Finish waypoints created.")
+        if gpx_data.get("has_timestamps"):
+            duration_hours = gpx_data.get("timestamp_duration_minutes", 0) / 60
+            message += f" Timestamps detected (duration: {duration_hours:.1f} hours)."
+        return message
+
+    message = "Actual route uploaded successfully"
+    if gpx_data.get("has_timestamps"):
+        duration_hours = gpx_data.get("timestamp_duration_minutes", 0) / 60
+        message += f" with timestamps (duration: {duration_hours:.1f} hours)"
+    return message
+
+
+async def apply_track(db: AsyncSession, event: Event, kind: str, route: Route, gpx_data: Dict) -> Dict:
+    """Apply a resolved planned or actual track; returns its metadata"""
+    if kind == PLANNED:
+        return await apply_planned_track(db, event, route, gpx_data)
+    return await apply_actual_track(db, event, route, gpx_data)
@@ -0,0 +1,291 @@
+"""
+Ingest Job Queue
+Background GPX/TCX ingestion backed by the ingest_jobs table. Workers claim
+jobs with SELECT ... FOR UPDATE SKIP LOCKED, so every app process can poll
+the same table without an external broker and no job is processed twice.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import UploadFile
+from sqlalchemy import select, update, and_, or_, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import Event, IngestJob, ACTIVE_JOB_STATUSES
+from utils.executor import PoolSaturatedError
+from utils.ingest import resolve_track, apply_track, upload_message
+from utils.uploads import spool_upload, remove_spooled
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+# Running jobs not updated for this long are assumed orphaned (process died) and reclaimed
+INGEST_JOB_TIMEOUT_SECONDS = int(os.getenv("INGEST_JOB_TIMEOUT_SECONDS", "600"))
+# How often a worker touches updated_at on its running job (well below the timeout)
+INGEST_HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", "30"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+_workers: List[asyncio.Task] = []
+# Set when this process enqueues a job so an idle worker starts without waiting a poll interval
+_wakeup: Optional[asyncio.Event] = None
+
+
+async def _active_job(db: AsyncSession, event_id: uuid.UUID, kind: str, content_hash: str) -> Optional[IngestJob]:
+    result = await db.execute(
+        select(IngestJob).where(
+            IngestJob.event_id == event_id,
+            IngestJob.kind == kind,
+            IngestJob.content_hash == content_hash,
+            IngestJob.status.in_(ACTIVE_JOB_STATUSES)
+        )
+    )
+    return result.scalars().first()
+
+
+async def enqueue_ingest_job(db: AsyncSession, event_id: uuid.UUID, kind: str, file: UploadFile) -> IngestJob:
+    """
+    Spool an upload and queue it for background ingestion
+
+    An identical file (same sha256) already pending or running for the same
+    event and kind is coalesced: its job is returned and no new work is queued.
+    """
+    spooled = await spool_upload(file)
+
+    existing = await _active_job(db, event_id, kind, spooled.sha256)
+    if existing is not None:
+        await remove_spooled(spooled.path)
+        return existing
+
+    # The partial unique index on active jobs settles races between identical uploads
+    job_id = (await db.execute(
+        pg_insert(IngestJob).values(
+            id=uuid.uuid4(),
+            event_id=event_id,
+            kind=kind,
+            status="pending",
+            stage="queued",
+            progress_percent=0,
+            attempts=0,
+            filename=file.filename,
+            file_path=spooled.path,
+            content_hash=spooled.sha256
+        ).on_conflict_do_nothing(
+            index_elements=["event_id", "kind", "content_hash"],
+            # Literal predicate: Postgres can't match a partial index against bound parameters
+            index_where=text("status IN ('pending', 'running')")
+        ).returning(IngestJob.id)
+    )).scalar()
+    await db.commit()
+
+    if job_id is None:
+        await remove_spooled(spooled.path)
+        existing = await _active_job(db, event_id, kind, spooled.sha256)
+        if existing is not None:
+            return existing
+        raise RuntimeError("Identical upload finished while being queued, please retry")
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return await db.get(IngestJob, job_id)
+
+
+async def claim_next_job(db: AsyncSession) -> Optional[IngestJob]:
+    """Lock and mark the oldest runnable job as running (None if the queue is empty)"""
+    stale_before = func.now() - timedelta(seconds=INGEST_JOB_TIMEOUT_SECONDS)
+    result = await db.execute(
+        select(IngestJob).where(or_(
+            IngestJob.status == "pending",
+            and_(IngestJob.status == "running", IngestJob.updated_at < stale_before)
+        )).order_by(IngestJob.created_at).limit(1).with_for_update(skip_locked=True)
+    )
+    job = result.scalars().first()
+    if job is None:
+        await db.rollback()
+        return None
+
+    now = datetime.now(timezone.utc)
+    job.attempts = (job.attempts or 0) + 1
+    if job.attempts > INGEST_MAX_ATTEMPTS:
+        job.status = "failed"
+        job.error = f"Gave up after {INGEST_MAX_ATTEMPTS} attempts"
+        job.finished_at = now
+        await db.commit()
+        await remove_spooled(job.file_path)
+        return None
+
+    job.status = "running"
+    job.stage = "parsing"
+    job.progress_percent = 10
+    job.started_at = now
+    await db.commit()
+    return job
+
+
+def _claimed(job_id: uuid.UUID, attempt: int):
+    """
+    Filter for a job still held by the worker that claimed it; the attempts
+    count at claim time is the claim token (a reclaim increments it)
+    """
+    return and_(IngestJob.id == job_id, IngestJob.status == "running", IngestJob.attempts == attempt)
+
+
+async def _hold_claim(db: AsyncSession, job_id: uuid.UUID, attempt: int) -> Optional[IngestJob]:
+    """
+    Lock a claimed job's row until the next commit, or return None (after
+    rolling back) if another worker has reclaimed it in the meantime
+    """
+    result = await db.execute(
+        select(IngestJob).where(_claimed(job_id, attempt))
+        .with_for_update().execution_options(populate_existing=True)
+    )
+    job = result.scalars().first()
+    if job is None:
+        await db.rollback()
+    return job
+
+
+async def _heartbeat(job_id: uuid.UUID, attempt: int) -> None:
+    """
+    Keep a running job's updated_at fresh so it isn't taken for orphaned and
+    reclaimed while a long parse is still in progress (own session, since the
+    worker's session is busy with the job)
+    """
+    while True:
+        await asyncio.sleep(INGEST_HEARTBEAT_SECONDS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(IngestJob).where(_claimed(job_id, attempt)).values(updated_at=func.now())
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            return
+
+
+async def _fail_job(db: AsyncSession, job_id: uuid.UUID, attempt: int, error: str) -> None:
+    await db.rollback()
+    job = await _hold_claim(db, job_id, attempt)
+    if job is None:
+        return
+    file_path = job.file_path
+    job.status = "failed"
+    job.error = error
+    job.finished_at = datetime.now(timezone.utc)
+    await db.commit()
+    await remove_spooled(file_path)
+
+
+async def process_job(db: AsyncSession, job: IngestJob) -> bool:
+    """
+    Parse and apply a claimed job
+
+    A heartbeat keeps the claim alive while the job runs, and every write first
+    re-checks the claim under a row lock, so a worker whose job was reclaimed
+    (e.g. after a stall longer than INGEST_JOB_TIMEOUT_SECONDS) drops its result
+    instead of applying it a second time.
+
+    Returns:
+        False if the job was put back because the process pool was saturated
+    """
+    job_id, attempt = job.id, job.attempts
+    heartbeat = asyncio.create_task(_heartbeat(job_id, attempt))
+    try:
+        return await _run_claimed_job(db, job_id, attempt, job.content_hash, job.file_path)
+    finally:
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+
+
+async def _run_claimed_job(db: AsyncSession, job_id: uuid.UUID, attempt: int,
+                           content_hash: str, file_path: str) -> bool:
+    try:
+        route, gpx_data = await resolve_track(db, content_hash, file_path)
+    except PoolSaturatedError:
+        job = await _hold_claim(db, job_id, attempt)
+        if job is not None:
+            job.status = "pending"
+            job.stage = "queued"
+            job.progress_percent = 0
+            job.attempts -= 1
+            await db.commit()
+        return False
+    except Exception as e:
+        await _fail_job(db, job_id, attempt, f"Error processing file: {str(e)}")
+        return True
+
+    job = await _hold_claim(db, job_id, attempt)
+    if job is None:
+        return True
+    job.stage = "saving"
+    job.progress_percent = 80
+    # Commits the (new or shared) route row along with the progress update
+    await db.commit()
+
+    try:
+        job = await _hold_claim(db, job_id, attempt)
+        if job is None:
+            return True
+        event = await db.get(Event, job.event_id)
+        if event is None:
+            raise ValueError("Event not found")
+        metadata = await apply_track(db, event, job.kind, route, gpx_data)
+
+        job.status = "completed"
+        job.stage = "done"
+        job.progress_percent = 100
+        job.result = {"success": True, "message": upload_message(job.kind, gpx_data), "metadata": metadata}
+        job.finished_at = datetime.now(timezone.utc)
+        await db.commit()
+    except Exception as e:
+        await _fail_job(db, job_id, attempt, f"Error saving track: {str(e)}")
+        return True
+
+    await remove_spooled(file_path)
+    return True
+
+
+async def _worker_loop() -> None:
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await claim_next_job(db)
+                processed = await process_job(db, job) if job is not None else False
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ingest worker error")
+            processed = False
+
+        if processed:
+            continue
+
+        # Idle (or backing off from a full pool): wait for a local enqueue or the next poll
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=INGEST_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_ingest_workers() -> None:
+    """Start the background ingest workers (called from the app lifespan)"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for _ in range(INGEST_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop()))
+
+
+async def stop_ingest_workers() -> None:
+    """
+    Cancel the workers; a job interrupted mid-run stops heartbeating and is
+    reclaimed by any worker once INGEST_JOB_TIMEOUT_SECONDS have passed
+    """
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -1,5 +1,8 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence, Union
 from datetime import datetime, timedelta
+import numpy as np
+
+METERS_PER_MILE = 1609.34
 
 def calculate_adjusted_pace(
     base_pace: float,
@@ -47,6 +50,261 @@ def calculate_adjusted_pace(
     
     return final_pace
 
+def fatigue_progress(leg_count: int) -> np.ndarray:
+    """Linear fatigue progression: 0 on the first leg, 1 (full slowdown) on the last"""
+    return np.arange(leg_count) / (leg_count - 1) if leg_count > 1 else np.zeros(leg_count)
+
+def leg_effort_factors(
+    leg_distances: Sequence[float],
+    elevation_gains: Sequence[float],
+    elevation_losses: Sequence[float],
+    gain_adjustments: np.ndarray,
+    descent_adjustments: np.ndarray,
+    fatigue_slowdowns: np.ndarray,
+    leg_costs: Optional[Sequence[float]] = None
+) -> np.ndarray:
+    """
+    Relative effort of each leg: its distance in miles, scaled up by climbing,
+    down by descending, and by linear fatigue along the course
+    
+    Args:
+        leg_distances, elevation_gains, elevation_losses: Leg metrics in meters (L legs)
+        gain_adjustments, descent_adjustments, fatigue_slowdowns: Percentages (S scenarios)
+        leg_costs: Grade-adjusted leg distances in meters (utils.grade_pace); when
+            given they replace the gain/descent adjustment and only fatigue applies
+    
+    Returns:
+        (S, L) array of effort factors
+    """
+    fatigue = 1 + fatigue_progress(len(leg_distances)) * (np.asarray(fatigue_slowdowns)[:, None] / 100)
+    if leg_costs is not None:
+        return (np.asarray(leg_costs, dtype=np.float64) / METERS_PER_MILE) * fatigue
+    
+    distances = np.asarray(leg_distances, dtype=np.float64)
+    gains = np.asarray(elevation_gains, dtype=np.float64)
+    losses = np.asarray(elevation_losses, dtype=np.float64)
+    
+    # Climb and descent per meter of leg (zero-length legs get no elevation adjustment)
+    safe_distances = np.where(distances > 0, distances, 1.0)
+    gain_ratio = np.where(distances > 0, gains / safe_distances, 0.0)
+    loss_ratio = np.where(distances > 0, losses / safe_distances, 0.0)
+    
+    return (distances / METERS_PER_MILE) * (
+        1 + gain_ratio * (np.asarray(gain_adjustments)[:, None] / 100)
+        - loss_ratio * (np.asarray(descent_adjustments)[:, None] / 100)
+    ) * fatigue
+
+def pace_scenarios(
+    leg_distances: Sequence[float],
+    elevation_gains: Sequence[float],
+    elevation_losses: Sequence[float],
+    stop_times: Sequence[float],
+    target_durations: Union[float, Sequence[float]],
+    gain_adjustments: Union[float, Sequence[float]],
+    descent_adjustments: Union[float, Sequence[float]],
+    fatigue_slowdowns: Union[float, Sequence[float]],
+    event_distance: float = 0,
+    leg_costs: Optional[Sequence[float]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Vectorized pace engine: leg splits for many parameter sets in one pass
+    
+    The moving time (target minus stops) is split between legs in proportion to
+    their effort factors, so every scenario's total time equals its target.
+    
+    Args:
+        leg_distances: Leg distances in meters (L legs)
+        elevation_gains: Leg elevation gains in meters
+        elevation_losses: Leg elevation losses in meters
+        stop_times: Stop time at the end of each leg in minutes
+        target_durations: Target total time(s) in minutes (scalar or S scenarios)
+        gain_adjustments: % adjustment(s) per meter gain
+        descent_adjustments: % adjustment(s) per meter descent
+        fatigue_slowdowns: Total fatigue slowdown %(s)
+        event_distance: Total distance in distance units, for base_pace
+        leg_costs: Optional grade-adjusted leg distances (see leg_effort_factors)
+    
+    Returns:
+        Dict of arrays: 'leg_duration_minutes', 'adjusted_pace', 'arrival_minutes'
+        and 'cumulative_time_minutes' (elapsed at exit) shaped (S, L), and
+        'moving_time_minutes' and 'base_pace' shaped (S,). Scenario parameters
+        are broadcast against each other.
+    """
+    distances = np.asarray(leg_distances, dtype=np.float64)
+    stops = np.asarray(stop_times, dtype=np.float64)
+    targets, gain_pct, descent_pct, fatigue_pct = (
+        np.atleast_1d(np.asarray(values, dtype=np.float64))
+        for values in np.broadcast_arrays(target_durations, gain_adjustments, descent_adjustments, fatigue_slowdowns)
+    )
+    factors = leg_effort_factors(distances, elevation_gains, elevation_losses, gain_pct, descent_pct, fatigue_pct, leg_costs)
+    
+    # Distribute moving time proportionally based on factors
+    moving_time = targets - stops.sum()
+    total_factor = factors.sum(axis=1)
+    share = np.divide(factors, total_factor[:, None], out=np.zeros_like(factors), where=total_factor[:, None] != 0)
+    durations = share * moving_time[:, None]
+    
+    leg_miles = distances / METERS_PER_MILE
+    adjusted_pace = np.divide(durations, leg_miles, out=np.zeros_like(durations), where=leg_miles > 0)
+    base_pace = moving_time / event_distance if event_distance > 0 else np.zeros_like(moving_time)
+    
+    cumulative = np.cumsum(durations + stops, axis=1)
+    return {
+        'leg_duration_minutes': durations,
+        'adjusted_pace': adjusted_pace,
+        'arrival_minutes': cumulative - stops,
+        'cumulative_time_minutes': cumulative,
+        'moving_time_minutes': moving_time,
+        'base_pace': base_pace
+    }
+
+def solve_target_duration(
+    leg_distances: Sequence[float],
+    elevation_gains: Sequence[float],
+    elevation_losses: Sequence[float],
+    stop_times: Sequence[float],
+    gain_adjustment: float,
+    descent_adjustment: float,
+    fatigue_slowdown: float,
+    cutoffs: Sequence[float],
+    min_paces: Sequence[float],
+    max_paces: Sequence[float],
+    leg_costs: Optional[Sequence[float]] = None
+) -> Dict:
+    """
+    Feasible range of target durations for cutoffs and per-leg pace bounds
+    
+    Under the redistribution model every leg time is share * (target - total stops),
+    so each waypoint's arrival and each leg's pace are linear in the target and
+    every constraint is one closed-form bound on it; no search is needed.
+    
+    Args:
+        leg_distances, elevation_gains, elevation_losses: Leg metrics in meters (L legs)
+        stop_times: Stop minutes at the end of each leg
+        gain_adjustment, descent_adjustment, fatigue_slowdown: Pace model percentages
+        cutoffs: Latest allowed elapsed arrival minutes per waypoint (NaN = none)
+        min_paces: Fastest allowed pace per leg in minutes per mile (NaN = none)
+        max_paces: Slowest allowed pace per leg in minutes per mile (NaN = none)
+        leg_costs: Optional grade-adjusted leg distances (see leg_effort_factors)
+    
+    Returns:
+        Dict with 'min_target_minutes' and 'max_target_minutes' (max is inf only
+        when nothing bounds it, finite whenever a constraint does), 'feasible', and 'lower_binding'/'upper_binding' as
+        (constraint kind, leg index) of the bound that sets each end, or None
+    """
+    distances = np.asarray(leg_distances, dtype=np.float64)
+    stops = np.asarray(stop_times, dtype=np.float64)
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    min_paces = np.asarray(min_paces, dtype=np.float64)
+    max_paces = np.asarray(max_paces, dtype=np.float64)
+    
+    factors = leg_effort_factors(
+        distances, elevation_gains, elevation_losses,
+        np.array([gain_adjustment]), np.array([descent_adjustment]), np.array([fatigue_slowdown]),
+        leg_costs
+    )[0]
+    total_factor = factors.sum()
+    total_stops = stops.sum()
+    share = factors / total_factor if total_factor > 0 else np.zeros_like(factors)
+    
+    # arrival_i = reached_i * moving + stops_before_i, with moving = target - total stops
+    reached = np.cumsum(share)
+    stops_before = np.cumsum(stops) - stops
+    # pace_i = share_i * moving / miles_i
+    miles = distances / METERS_PER_MILE
+    timed = (share > 0) & (miles > 0)
+    safe_share = np.where(timed, share, 1.0)
+    
+    with np.errstate(invalid="ignore", divide="ignore"):
+        upper = {
+            "cutoff": np.where(reached > 0, (cutoffs - stops_before) / reached, np.nan),
+            "max_pace": np.where(timed, max_paces * miles / safe_share, np.nan)
+        }
+        lower = {
+            "min_pace": np.where(timed, min_paces * miles / safe_share, np.nan)
+        }
+        # A cutoff with no moving time before it can't be helped by any target
+        unreachable_cutoff = (reached <= 0) & (stops_before > cutoffs)
+    
+    # Moving time must be positive: target above total stop time
+    min_moving, lower_binding = 0.0, ("stop_time", None)
+    for kind, bounds in lower.items():
+        if np.any(~np.isnan(bounds)):
+            i = int(np.nanargmax(bounds))
+            if bounds[i] > min_moving:
+                min_moving, lower_binding = float(bounds[i]), (kind, i)
+    
+    max_moving, upper_binding = np.inf, None
+    for kind, bounds in upper.items():
+        if np.any(~np.isnan(bounds)):
+            i = int(np.nanargmin(bounds))
+            if bounds[i] < max_moving:
+                max_moving, upper_binding = float(bounds[i]), (kind, i)
+    cutoff_missed = bool(np.any(unreachable_cutoff))
+    if cutoff_missed:
+        # No target works; report the stop-time floor as the (empty) range's upper end
+        max_moving, upper_binding = 0.0, ("cutoff", int(np.argmax(unreachable_cutoff)))
+    
+    return {
+        "min_target_minutes": float(total_stops + min_moving),
+        "max_target_minutes": float(total_stops + max_moving),
+        "feasible": bool(max_moving >= min_moving) and not cutoff_missed,
+        "lower_binding": lower_binding,
+        "upper_binding": upper_binding
+    }
+
+def simulate_arrivals(
+    leg_durations: Sequence[float],
+    stop_times: Sequence[float],
+    fatigue_slowdown: float,
+    runs: int,
+    seed: np.random.SeedSequence,
+    pace_variability_pct: float,
+    leg_variability_pct: float,
+    stop_variability_pct: float,
+    fatigue_variability_pct: float
+) -> np.ndarray:
+    """
+    Monte Carlo sample of waypoint arrival times around a planned leg split
+    
+    Each run draws a whole-day pace multiplier, an independent multiplier per
+    leg and per stop (all log-normal with median 1, so the plan is the median
+    run), and its own fatigue slowdown. Module-level so it can run in the
+    process pool.
+    
+    Args:
+        leg_durations: Planned moving minutes per leg (L legs, from pace_scenarios)
+        stop_times: Planned stop minutes at the end of each leg
+        fatigue_slowdown: Fatigue slowdown % the plan was computed with
+        runs: Number of simulated runs (R)
+        seed: Seed for this batch of runs
+        pace_variability_pct: Spread of the whole-day pace multiplier (%)
+        leg_variability_pct: Spread of each leg's pace multiplier (%)
+        stop_variability_pct: Spread of each stop's duration multiplier (%)
+        fatigue_variability_pct: Standard deviation of the fatigue slowdown (percentage points)
+    
+    Returns:
+        (R, L) float32 array of elapsed minutes at each waypoint arrival
+    """
+    rng = np.random.default_rng(seed)
+    durations = np.asarray(leg_durations, dtype=np.float64)
+    stops = np.asarray(stop_times, dtype=np.float64)
+    leg_count = len(durations)
+    
+    day_form = rng.lognormal(0.0, np.log1p(pace_variability_pct / 100), size=(runs, 1))
+    leg_noise = rng.lognormal(0.0, np.log1p(leg_variability_pct / 100), size=(runs, leg_count))
+    stop_noise = rng.lognormal(0.0, np.log1p(stop_variability_pct / 100), size=(runs, leg_count))
+    
+    # Swap the planned fatigue ramp for each run's own
+    progress = fatigue_progress(leg_count)
+    fatigue = np.maximum(rng.normal(fatigue_slowdown, fatigue_variability_pct, size=(runs, 1)), -99.0)
+    fatigue_ratio = (1 + progress * fatigue / 100) / (1 + progress * fatigue_slowdown / 100)
+    
+    moving = durations * day_form * leg_noise * fatigue_ratio
+    stopped = stops * stop_noise
+    arrivals = np.cumsum(moving + stopped, axis=1) - stopped
+    return arrivals.astype(np.float32)
+
 def calculate_legs(
     event_distance: float,
     target_duration_minutes: int,
@@ -55,7 +313,8 @@ def calculate_legs(
     elevation_gain_adjustment: float,
     elevation_descent_adjustment: float,
     fatigue_slowdown: float,
-    start_time: datetime
+    start_time: datetime,
+    leg_costs: Optional[List[float]] = None
 ) -> List[Dict]:
     """
     Calculate detailed leg-by-leg breakdown with proper time redistribution
@@ -72,92 +331,49 @@ def calculate_legs(
         elevation_descent_adjustment: % adjustment per meter descent
         fatigue_slowdown: Total fatigue slowdown %
         start_time: Event start time
+        leg_costs: Grade-adjusted leg distances in meters; when given, legs are
+            weighted by terrain shape instead of the gain/descent adjustments
     
     Returns:
         List of calculated leg dictionaries
     """
-    # Calculate total stop time
-    total_stop_time = sum(wp.get('stop_time_minutes', 0) for wp in waypoints)
-    
-    # Available moving time (this is what we must distribute)
-    moving_time_minutes = target_duration_minutes - total_stop_time
-    
-    # Step 1: Calculate adjustment factors for each leg (relative difficulty)
-    leg_factors = []
-    for i, metrics in enumerate(leg_metrics):
-        leg_distance_meters = metrics['distance']
-        elevation_gain = metrics['elevation_gain']
-        elevation_loss = metrics['elevation_loss']
-        leg_distance_miles = leg_distance_meters / 1609.34
-        
-        # Start with base distance
-        factor = leg_distance_miles
-        
-        # Apply elevation adjustments (makes leg "longer" in terms of effort)
-        if leg_distance_meters > 0:
-            gain_factor = (elevation_gain / leg_distance_meters) * (elevation_gain_adjustment / 100)
-            loss_factor = (elevation_loss / leg_distance_meters) * (elevation_descent_adjustment / 100)
-            factor = factor * (1 + gain_factor - loss_factor)
-        
-        # Apply fatigue adjustment (linear progression)
-        if len(leg_metrics) > 1:
-            fatigue_factor = (i / (len(leg_metrics) - 1)) * (fatigue_slowdown / 100)
-        else:
-            fatigue_factor = 0
-        factor = factor * (1 + fatigue_factor)
-        
-        leg_factors.append(factor)
+    stop_times = [wp.get('stop_time_minutes', 0) or 0 for wp in waypoints]
     
-    # Step 2: Calculate total adjusted distance
-    total_adjusted_distance = sum(leg_factors)
+    # Single scenario of the vectorized engine
+    result = pace_scenarios(
+        leg_distances=[metrics['distance'] for metrics in leg_metrics],
+        elevation_gains=[metrics['elevation_gain'] for metrics in leg_metrics],
+        elevation_losses=[metrics['elevation_loss'] for metrics in leg_metrics],
+        stop_times=stop_times,
+        target_durations=target_duration_minutes,
+        gain_adjustments=elevation_gain_adjustment,
+        descent_adjustments=elevation_descent_adjustment,
+        fatigue_slowdowns=fatigue_slowdown,
+        event_distance=event_distance,
+        leg_costs=leg_costs
+    )
+    base_pace = float(result['base_pace'][0])
     
-    # Step 3: Distribute moving time proportionally based on factors
     legs = []
     cumulative_distance = 0
-    cumulative_time_minutes = 0
-    current_time = start_time
-    
-    for i, (waypoint, metrics, factor) in enumerate(zip(waypoints, leg_metrics, leg_factors)):
-        leg_distance_meters = metrics['distance']
-        elevation_gain = metrics['elevation_gain']
-        elevation_loss = metrics['elevation_loss']
-        leg_distance_miles = leg_distance_meters / 1609.34
-        
-        # Allocate time proportionally based on this leg's factor
-        leg_duration_minutes = (factor / total_adjusted_distance) * moving_time_minutes
-        
-        # Calculate the actual pace for this leg
-        adjusted_pace = leg_duration_minutes / leg_distance_miles if leg_distance_miles > 0 else 0
-        
-        # Base pace for reference (if no adjustments)
-        base_pace = moving_time_minutes / event_distance if event_distance > 0 else 0
-        
-        # Calculate arrival time
-        current_time += timedelta(minutes=leg_duration_minutes)
-        arrival_time = current_time
-        
-        # Add stop time
-        stop_time = waypoint.get('stop_time_minutes', 0)
-        current_time += timedelta(minutes=stop_time)
-        exit_time = current_time
-        
-        # Update cumulative values
-        cumulative_distance += leg_distance_meters
-        cumulative_time_minutes += leg_duration_minutes + stop_time
+    for i, (waypoint, metrics, stop_time) in enumerate(zip(waypoints, leg_metrics, stop_times)):
+        cumulative_distance += metrics['distance']
+        cumulative_time_minutes = float(result['cumulative_time_minutes'][0, i])
         
         leg = {
             'leg_number': i + 1,
             'waypoint_name': waypoint.get('name', f'Waypoint {i + 1}'),
             'waypoint_id': waypoint.get('id'),
-            'leg_distance': leg_distance_meters,
-            'elevation_gain': elevation_gain,
-            'elevation_loss': elevation_loss,
+            'leg_distance': metrics['distance'],
+            'elevation_gain': metrics['elevation_gain'],
+            'elevation_loss': metrics['elevation_loss'],
+            'grade_adjusted_distance': leg_costs[i] if leg_costs is not None else None,
             'base_pace': base_pace,
-            'adjusted_pace': adjusted_pace,
-            'leg_duration_minutes': leg_duration_minutes,
-            'expected_arrival_time': arrival_time,
+            'adjusted_pace': float(result['adjusted_pace'][0, i]),
+            'leg_duration_minutes': float(result['leg_duration_minutes'][0, i]),
+            'expected_arrival_time': start_time + timedelta(minutes=float(result['arrival_minutes'][0, i])),
             'stop_time_minutes': stop_time,
-            'exit_time': exit_time,
+            'exit_time': start_time + timedelta(minutes=cumulative_time_minutes),
             'cumulative_distance': cumulative_distance,
             'cumulative_time_minutes': cumulative_time_minutes
         }
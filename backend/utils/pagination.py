@@ -0,0 +1,72 @@
+"""
+Keyset Pagination
+Cursor-based paging on (sort column, id) so each page is an index range scan
+instead of an OFFSET that reads and discards every earlier row
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from uuid import UUID
+from sqlalchemy import tuple_
+
+# Response header carrying the cursor for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort_value: datetime, row_id: UUID) -> str:
+    """Opaque URL-safe cursor for the row a page ended on"""
+    payload = json.dumps([sort_value.isoformat(), str(row_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(sort_value), UUID(row_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def paginate(query, sort_column, id_column, cursor: Optional[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Fetch one page of a query, newest first
+
+    Args:
+        query: SQLAlchemy query with filters already applied
+        sort_column: Mapped column (or column_property) to order by, descending
+        id_column: Primary key column, the tie-breaker for equal sort values
+        cursor: Cursor from the previous page's NEXT_CURSOR_HEADER, or None for the first page
+        limit: Page size (clamped to 1..MAX_PAGE_SIZE)
+
+    Returns:
+        Tuple of (rows, next cursor or None when this is the last page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        # Row-value comparison matches a (sort DESC, id DESC) index directly
+        query = query.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+
+    # One extra row tells us whether another page exists
+    rows = query.order_by(sort_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
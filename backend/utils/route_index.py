@@ -0,0 +1,418 @@
+"""
+Route Spatial Index
+Grid index over a route's projected segments for fast waypoint snapping
+"""
+
+import math
+import os
+from typing import Hashable, List, NamedTuple, Optional, Sequence
+import numpy as np
+from utils.cache import LRUCache
+from utils.gpx_processor import haversine_distances, project_to_plane
+
+ROUTE_INDEX_CACHE_SIZE = int(os.getenv("ROUTE_INDEX_CACHE_SIZE", "64"))
+
+# Passes of the route within this many meters of the nearest one are considered
+# as alternative positions when snapping a waypoint sequence
+SNAP_CANDIDATE_SLACK_METERS = float(os.getenv("SNAP_CANDIDATE_SLACK_METERS", "150"))
+
+# Sequence snapping costs (meters): two waypoints on the same spot, or going backwards
+DUPLICATE_POSITION_PENALTY = 200.0
+BACKTRACK_PENALTY = 1e7
+
+# Grid cells are sized relative to the route's typical segment length
+MIN_CELL_SIZE_METERS = 25.0
+MAX_CELL_SIZE_METERS = 1000.0
+
+
+class RouteSnap(NamedTuple):
+    """A point projected onto the route"""
+    segment_index: int  # segment i joins vertex i and i + 1
+    fraction: float  # position along the segment, 0..1
+    vertex_index: int  # nearer vertex of the segment
+    distance_from_start: float  # meters along the route
+    distance_to_route: float  # meters from the query point to the route
+    latitude: float
+    longitude: float
+    elevation: float
+
+    @property
+    def position(self) -> float:
+        """Fractional vertex index along the route"""
+        return self.segment_index + self.fraction
+
+
+class RouteIndex:
+    """
+    Spatial index over one route version
+
+    Segments are bucketed into a uniform grid in a local planar projection and the
+    (cell, segment) pairs are kept sorted by cell key, so looking up a cell is a
+    binary search. Cumulative distance along the route is precomputed once.
+    """
+
+    def __init__(self, coordinates, profile=None, cell_size_meters: Optional[float] = None):
+        coords = np.asarray(coordinates, dtype=np.float64)
+        if coords.ndim != 2 or len(coords) == 0:
+            raise ValueError("Route has no coordinates")
+
+        self.lats = coords[:, 0]
+        self.lons = coords[:, 1]
+        self.eles = coords[:, 2] if coords.shape[1] > 2 else np.zeros(len(coords))
+        self.ref_lat = float(np.mean(self.lats))
+        self.x, self.y = project_to_plane(self.lats, self.lons, self.ref_lat)
+
+        # Cumulative (horizontal) distance along the route at each vertex,
+        # shared with the route's RouteProfile when one is supplied
+        if profile is not None:
+            self.cumulative_distance = profile.horizontal
+            self.segment_lengths = np.diff(profile.horizontal)
+        else:
+            self.segment_lengths = haversine_distances(self.lats[:-1], self.lons[:-1], self.lats[1:], self.lons[1:])
+            self.cumulative_distance = np.concatenate(([0.0], np.cumsum(self.segment_lengths)))
+
+        # Planar segment vectors
+        self.dx = np.diff(self.x)
+        self.dy = np.diff(self.y)
+        self.length_sq = self.dx ** 2 + self.dy ** 2
+
+        if cell_size_meters is None:
+            planar = np.sqrt(self.length_sq)
+            typical = float(np.median(planar)) * 2 if len(planar) else MIN_CELL_SIZE_METERS
+            cell_size_meters = min(max(typical, MIN_CELL_SIZE_METERS), MAX_CELL_SIZE_METERS)
+        self.cell_size = cell_size_meters
+
+        self._build_grid()
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.dx)
+
+    def _build_grid(self) -> None:
+        """Bucket every segment into each grid cell its bounding box covers"""
+        cell = self.cell_size
+        self.origin_x = float(self.x.min())
+        self.origin_y = float(self.y.min())
+        self.grid_width = int((self.x.max() - self.origin_x) // cell) + 1
+        self.grid_height = int((self.y.max() - self.origin_y) // cell) + 1
+
+        if self.segment_count == 0:
+            self.cell_keys = np.empty(0, dtype=np.int64)
+            self.cell_segments = np.empty(0, dtype=np.int64)
+            return
+
+        cx = ((self.x - self.origin_x) // cell).astype(np.int64)
+        cy = ((self.y - self.origin_y) // cell).astype(np.int64)
+        x0 = np.minimum(cx[:-1], cx[1:])
+        x1 = np.maximum(cx[:-1], cx[1:])
+        y0 = np.minimum(cy[:-1], cy[1:])
+        y1 = np.maximum(cy[:-1], cy[1:])
+
+        widths = x1 - x0 + 1
+        counts = widths * (y1 - y0 + 1)
+        segment_ids = np.repeat(np.arange(self.segment_count), counts)
+        # Position of each pair within its segment's block of cells
+        local = np.arange(len(segment_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_x = x0[segment_ids] + local % widths[segment_ids]
+        pair_y = y0[segment_ids] + local // widths[segment_ids]
+
+        keys = pair_x * self.grid_height + pair_y
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys = keys[order]
+        self.cell_segments = segment_ids[order]
+
+    def _segments_near(self, cell_x: int, cell_y: int, radius: int) -> np.ndarray:
+        """Segment ids bucketed in the cells within `radius` cells of (cell_x, cell_y)"""
+        xs = np.arange(max(cell_x - radius, 0), min(cell_x + radius, self.grid_width - 1) + 1)
+        ys = np.arange(max(cell_y - radius, 0), min(cell_y + radius, self.grid_height - 1) + 1)
+        if len(xs) == 0 or len(ys) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        keys = (xs[:, None] * self.grid_height + ys[None, :]).ravel()
+        starts = np.searchsorted(self.cell_keys, keys, side="left")
+        ends = np.searchsorted(self.cell_keys, keys, side="right")
+        hits = ends > starts
+        if not hits.any():
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([
+            self.cell_segments[s:e] for s, e in zip(starts[hits], ends[hits])
+        ]))
+
+    def _covers_grid(self, cell_x: int, cell_y: int, radius: int) -> bool:
+        return (cell_x - radius <= 0 and cell_y - radius <= 0 and
+                cell_x + radius >= self.grid_width - 1 and cell_y + radius >= self.grid_height - 1)
+
+    def _project(self, px: float, py: float, segments: np.ndarray):
+        """Project a planar point onto the given segments; returns (fractions, distances)"""
+        rel_x = px - self.x[segments]
+        rel_y = py - self.y[segments]
+        length_sq = self.length_sq[segments]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length_sq > 0, (rel_x * self.dx[segments] + rel_y * self.dy[segments]) / length_sq, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distances = np.hypot(rel_x - t * self.dx[segments], rel_y - t * self.dy[segments])
+        return t, distances
+
+    def _nearest_segment(self, px: float, py: float):
+        """Nearest segment to a planar point; returns (segment, fraction, distance)"""
+        cell = self.cell_size
+        cell_x = int((px - self.origin_x) // cell)
+        cell_y = int((py - self.origin_y) // cell)
+
+        # Grow the search box until it holds a candidate...
+        radius = 0
+        candidates = self._segments_near(cell_x, cell_y, radius)
+        while len(candidates) == 0 and not self._covers_grid(cell_x, cell_y, radius):
+            radius = radius * 2 + 1
+            candidates = self._segments_near(cell_x, cell_y, radius)
+        if len(candidates) == 0:
+            candidates = np.arange(self.segment_count)
+
+        t, distances = self._project(px, py, candidates)
+        best = int(np.argmin(distances))
+
+        # ...then make sure no closer segment sits just outside the box searched
+        needed = int(math.ceil(distances[best] / cell))
+        if needed > radius and not self._covers_grid(cell_x, cell_y, radius):
+            candidates = self._segments_near(cell_x, cell_y, needed)
+            t, distances = self._project(px, py, candidates)
+            best = int(np.argmin(distances))
+
+        return int(candidates[best]), float(t[best]), float(distances[best])
+
+    def snap_at(self, segment: int, fraction: float, distance_to_route: float = 0.0) -> RouteSnap:
+        """Build a RouteSnap for a position on a segment"""
+        if self.segment_count == 0:
+            return RouteSnap(0, 0.0, 0, 0.0, distance_to_route,
+                             float(self.lats[0]), float(self.lons[0]), float(self.eles[0]))
+
+        a, b = segment, segment + 1
+        return RouteSnap(
+            segment_index=segment,
+            fraction=fraction,
+            vertex_index=a if fraction <= 0.5 else b,
+            distance_from_start=float(self.cumulative_distance[a] + fraction * self.segment_lengths[segment]),
+            distance_to_route=distance_to_route,
+            latitude=float(self.lats[a] + fraction * (self.lats[b] - self.lats[a])),
+            longitude=float(self.lons[a] + fraction * (self.lons[b] - self.lons[a])),
+            elevation=float(self.eles[a] + fraction * (self.eles[b] - self.eles[a]))
+        )
+
+    def snap_at_position(self, position: float) -> RouteSnap:
+        """RouteSnap for a fractional vertex index along the route"""
+        position = min(max(position, 0.0), float(self.segment_count))
+        segment = min(int(position), max(self.segment_count - 1, 0))
+        return self.snap_at(segment, position - segment)
+
+    def snap(self, latitude: float, longitude: float) -> RouteSnap:
+        """Project a coordinate onto the nearest point of the route"""
+        if self.segment_count == 0:
+            px, py = project_to_plane(np.array([latitude]), np.array([longitude]), self.ref_lat)
+            distance = float(math.hypot(px[0] - self.x[0], py[0] - self.y[0]))
+            return self.snap_at(0, 0.0, distance)
+
+        px, py = project_to_plane(np.array([latitude]), np.array([longitude]), self.ref_lat)
+        segment, fraction, distance = self._nearest_segment(float(px[0]), float(py[0]))
+        return self.snap_at(segment, fraction, distance)
+
+    def snap_many(self, latitudes, longitudes) -> List[RouteSnap]:
+        """Snap a whole list of coordinates (e.g. every waypoint of an event)"""
+        return [self.snap(lat, lon) for lat, lon in zip(latitudes, longitudes)]
+
+    def position_at_distance(self, distance: float) -> float:
+        """Fractional vertex index at a distance (meters) along the route"""
+        if self.segment_count == 0:
+            return 0.0
+        distance = min(max(distance, 0.0), float(self.cumulative_distance[-1]))
+        segment = min(int(np.searchsorted(self.cumulative_distance, distance, side="right")) - 1,
+                      self.segment_count - 1)
+        length = self.segment_lengths[segment]
+        fraction = (distance - self.cumulative_distance[segment]) / length if length > 0 else 0.0
+        return segment + min(max(fraction, 0.0), 1.0)
+
+    def snap_between(self, latitude: float, longitude: float, lower: float, upper: float,
+                     occupied: Sequence[float] = (),
+                     slack_meters: float = SNAP_CANDIDATE_SLACK_METERS) -> RouteSnap:
+        """
+        Snap one point within route positions [lower, upper]
+
+        Like snap_sequence, landing exactly on an occupied position (a neighbour in
+        course order) costs DUPLICATE_POSITION_PENALTY, so a second visit to a spot
+        takes the next pass of the route rather than stacking onto the first.
+        """
+        if self.segment_count == 0:
+            return self.snap(latitude, longitude)
+        px, py = project_to_plane(np.array([latitude]), np.array([longitude]), self.ref_lat)
+        candidates = self._candidates(float(px[0]), float(py[0]), lower, upper, slack_meters)
+        costs = [
+            distance + (DUPLICATE_POSITION_PENALTY
+                        if any(abs(segment + fraction - p) < 1e-6 for p in occupied) else 0.0)
+            for segment, fraction, distance in candidates
+        ]
+        return self.snap_at(*candidates[int(np.argmin(costs))])
+
+    def _window_nearest(self, px: float, py: float, lower: float, upper: float):
+        """Nearest point to (px, py) restricted to route positions [lower, upper]"""
+        first = min(int(lower), self.segment_count - 1)
+        last = min(int(math.ceil(upper)), self.segment_count) - 1
+        segments = np.arange(first, max(last, first) + 1)
+        t, distances = self._project(px, py, segments)
+        positions = np.clip(segments + t, lower, upper)
+        # Re-measure after clipping the position into the window
+        t = positions - segments
+        distances = np.hypot(px - (self.x[segments] + t * self.dx[segments]),
+                             py - (self.y[segments] + t * self.dy[segments]))
+        best = int(np.argmin(distances))
+        return int(segments[best]), float(t[best]), float(distances[best])
+
+    def _candidates(self, px: float, py: float, lower: float, upper: float, slack: float):
+        """
+        Alternative snaps for one point: the closest position of every pass of the
+        route that comes within `slack` meters of the nearest pass
+        Returns a list of (segment, fraction, distance) sorted by route position
+        """
+        segment, fraction, best = self._nearest_segment(px, py)
+        radius = best + slack
+        cell_x = int((px - self.origin_x) // self.cell_size)
+        cell_y = int((py - self.origin_y) // self.cell_size)
+        segments = self._segments_near(cell_x, cell_y, int(math.ceil(radius / self.cell_size)))
+        if len(segments) == 0:
+            segments = np.array([segment])
+
+        t, distances = self._project(px, py, segments)
+        positions = segments + t
+        within = (distances <= radius) & (positions >= lower) & (positions <= upper)
+        segments, t, distances = segments[within], t[within], distances[within]
+
+        if len(segments) == 0:
+            return [self._window_nearest(px, py, lower, upper)]
+
+        # Consecutive segments belong to the same pass; keep each pass's closest point
+        pass_starts = np.flatnonzero(np.diff(segments) > 1) + 1
+        candidates = []
+        for run in np.split(np.arange(len(segments)), pass_starts):
+            i = run[int(np.argmin(distances[run]))]
+            candidates.append((int(segments[i]), float(t[i]), float(distances[i])))
+        return candidates
+
+    def snap_sequence(self,
+                      latitudes,
+                      longitudes,
+                      lower: float = 0.0,
+                      upper: Optional[float] = None,
+                      slack_meters: float = SNAP_CANDIDATE_SLACK_METERS) -> List[RouteSnap]:
+        """
+        Snap an ordered list of points so their route positions never decrease
+
+        Each point gets one candidate per nearby pass of the route (so an aid station
+        visited on the way out and on the way back has two), then a dynamic program
+        picks the combination that is ordered along the course with the smallest total
+        snapping distance. Cost is one grid query per point plus the candidate pairs.
+
+        Args:
+            latitudes: Point latitudes, in course order
+            longitudes: Point longitudes, in course order
+            lower: Earliest allowed route position (fractional vertex index)
+            upper: Latest allowed route position (defaults to the route end)
+            slack_meters: How much farther than the nearest pass a pass may be
+                and still be considered
+
+        Returns:
+            One RouteSnap per point, in the same order
+        """
+        if upper is None:
+            upper = float(self.segment_count)
+        if self.segment_count == 0 or len(latitudes) == 0:
+            return self.snap_many(latitudes, longitudes)
+
+        px, py = project_to_plane(np.asarray(latitudes, dtype=np.float64),
+                                  np.asarray(longitudes, dtype=np.float64), self.ref_lat)
+        candidates = [
+            self._candidates(float(x), float(y), lower, upper, slack_meters)
+            for x, y in zip(px, py)
+        ]
+
+        # Viterbi over candidates: costs[c] = best total cost ending at candidate c
+        costs = [c[2] for c in candidates[0]]
+        back_pointers = []
+        for prev, current in zip(candidates, candidates[1:]):
+            prev_positions = np.array([c[0] + c[1] for c in prev])
+            prev_costs = np.array(costs)
+            new_costs = []
+            pointers = []
+            for segment, fraction, distance in current:
+                step = prev_positions - (segment + fraction)
+                transition = np.where(step < 0, 0.0,
+                                      np.where(step == 0, DUPLICATE_POSITION_PENALTY, BACKTRACK_PENALTY + step))
+                total = prev_costs + transition
+                # argmin keeps the earliest position on ties
+                best = int(np.argmin(total))
+                new_costs.append(float(total[best]) + distance)
+                pointers.append(best)
+            costs = new_costs
+            back_pointers.append(pointers)
+
+        # Walk the best path backwards
+        choice = int(np.argmin(costs))
+        chosen = [choice]
+        for pointers in reversed(back_pointers):
+            choice = pointers[choice]
+            chosen.append(choice)
+        chosen.reverse()
+
+        return [
+            self.snap_at(*point_candidates[c])
+            for point_candidates, c in zip(candidates, chosen)
+        ]
+
+
+def course_order_key(waypoint):
+    """
+    Sort key for an event's waypoints in course order: START first, FINISH
+    last, the rest in the user's sequence (order_index)
+
+    Distance along the route only breaks ties; on a course that passes the same
+    spot twice it can't tell the passes apart.
+    """
+    if waypoint.name == 'START':
+        rank = 0
+    elif waypoint.name == 'FINISH':
+        rank = 2
+    else:
+        rank = 1
+    order = waypoint.order_index if waypoint.order_index is not None else 0
+    return (rank, order, waypoint.distance_from_start or 0)
+
+
+def snap_between_neighbours(route_index: RouteIndex, waypoints: List, waypoint) -> RouteSnap:
+    """
+    Snap one waypoint inside the stretch of route between the waypoints before
+    and after it in course order (their stored distance_from_start), so an aid
+    station passed twice lands on the pass its place in the sequence implies
+
+    Args:
+        route_index: Index of the event's route
+        waypoints: The event's waypoints, including this one, in course order
+        waypoint: The waypoint to snap
+
+    Returns:
+        RouteSnap of the waypoint
+    """
+    i = waypoints.index(waypoint)
+    before = [wp.distance_from_start for wp in waypoints[:i] if wp.distance_from_start is not None]
+    after = [wp.distance_from_start for wp in waypoints[i + 1:] if wp.distance_from_start is not None]
+
+    lower = route_index.position_at_distance(before[-1]) if before else None
+    upper = route_index.position_at_distance(after[0]) if after else None
+    occupied = [p for p in (lower, upper) if p is not None]
+    lower = lower if lower is not None else 0.0
+    upper = max(lower, upper if upper is not None else float(route_index.segment_count))
+    return route_index.snap_between(waypoint.latitude, waypoint.longitude, lower, upper, occupied)
+
+
+_index_cache = LRUCache(ROUTE_INDEX_CACHE_SIZE)
+
+
+def get_route_index(cache_key: Hashable, coordinates, profile=None) -> RouteIndex:
+    """Return the cached RouteIndex for a route version, building it on first use"""
+    return _index_cache.get_or_create(cache_key, lambda: RouteIndex(coordinates, profile))
@@ -0,0 +1,141 @@
+"""
+Route Profile
+Prefix sums of distance and elevation change per route vertex, so metrics for
+any leg or distance range are two array lookups instead of a walk over the route
+"""
+
+from typing import Dict
+import numpy as np
+from utils.gpx_processor import haversine_distances
+
+# Stored profiles are rounded to centimeters to keep the JSON compact
+PROFILE_DECIMALS = 2
+
+
+class RouteProfile:
+    """
+    Cumulative metrics at each vertex of a route
+
+    Arrays (meters, one value per vertex, starting at 0):
+        horizontal: distance along the route over the ground (haversine)
+        distance: 3D distance along the route (includes elevation change)
+        gain: cumulative elevation gain
+        loss: cumulative elevation loss
+
+    Positions are fractional vertex indices (segment i + fraction), the same
+    convention as utils.route_index.RouteSnap.position.
+    """
+
+    def __init__(self, horizontal, distance, gain, loss, elevation):
+        self.horizontal = np.asarray(horizontal, dtype=np.float64)
+        self.distance = np.asarray(distance, dtype=np.float64)
+        self.gain = np.asarray(gain, dtype=np.float64)
+        self.loss = np.asarray(loss, dtype=np.float64)
+        self.elevation = np.asarray(elevation, dtype=np.float64)
+
+    @classmethod
+    def from_coordinates(cls, coordinates) -> "RouteProfile":
+        """Build the profile from [lat, lon, ele] coordinates"""
+        coords = np.asarray(coordinates, dtype=np.float64)
+        lats, lons = coords[:, 0], coords[:, 1]
+        eles = coords[:, 2] if coords.shape[1] > 2 else np.zeros(len(coords))
+
+        horizontal = haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+        ele_diff = np.diff(eles)
+        distance = np.sqrt(horizontal ** 2 + ele_diff ** 2)
+
+        return cls(
+            horizontal=_prefix_sum(horizontal),
+            distance=_prefix_sum(distance),
+            gain=_prefix_sum(np.clip(ele_diff, 0.0, None)),
+            loss=_prefix_sum(np.clip(-ele_diff, 0.0, None)),
+            elevation=eles
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict, coordinates) -> "RouteProfile":
+        """Load a profile stored with to_dict (elevation comes from the coordinates)"""
+        eles = [c[2] if len(c) > 2 else 0.0 for c in coordinates]
+        return cls(data["horizontal"], data["distance"], data["gain"], data["loss"], eles)
+
+    def to_dict(self) -> Dict:
+        """JSON-serializable form stored alongside the route coordinates"""
+        return {
+            "horizontal": np.round(self.horizontal, PROFILE_DECIMALS).tolist(),
+            "distance": np.round(self.distance, PROFILE_DECIMALS).tolist(),
+            "gain": np.round(self.gain, PROFILE_DECIMALS).tolist(),
+            "loss": np.round(self.loss, PROFILE_DECIMALS).tolist(),
+        }
+
+    @property
+    def point_count(self) -> int:
+        return len(self.distance)
+
+    @property
+    def end_position(self) -> float:
+        return float(self.point_count - 1)
+
+    def _at(self, values: np.ndarray, position: float) -> float:
+        """Value of a cumulative array at a fractional position (linear within a segment)"""
+        position = min(max(position, 0.0), self.end_position)
+        i = min(int(position), self.point_count - 2) if self.point_count > 1 else 0
+        fraction = position - i
+        if fraction == 0.0 or self.point_count == 1:
+            return float(values[i])
+        return float(values[i] + fraction * (values[i + 1] - values[i]))
+
+    def cumulative_at(self, values: np.ndarray, position: float) -> float:
+        """Value of any per-vertex cumulative array (e.g. a cost prefix sum) at a route position"""
+        return self._at(values, position)
+
+    def metrics_between(self, start_position: float, end_position: float) -> Dict:
+        """
+        Distance and elevation metrics between two route positions
+
+        Returns zeros when end is not after start, matching calculate_leg_metrics
+        """
+        if end_position <= start_position:
+            return {"distance": 0, "elevation_gain": 0, "elevation_loss": 0}
+
+        return {
+            "distance": self._at(self.distance, end_position) - self._at(self.distance, start_position),
+            "elevation_gain": self._at(self.gain, end_position) - self._at(self.gain, start_position),
+            "elevation_loss": self._at(self.loss, end_position) - self._at(self.loss, start_position),
+        }
+
+    def leg_metrics(self, start_index: int, end_index: int) -> Dict:
+        """Metrics between two vertex indices (same contract as calculate_leg_metrics)"""
+        if start_index >= end_index or end_index >= self.point_count:
+            return {"distance": 0, "elevation_gain": 0, "elevation_loss": 0}
+        return self.metrics_between(float(start_index), float(end_index))
+
+    def position_at_distance(self, distance_meters: float) -> float:
+        """Route position at a horizontal distance from the start (clamped to the route)"""
+        if self.point_count == 1 or distance_meters <= 0:
+            return 0.0
+        if distance_meters >= self.horizontal[-1]:
+            return self.end_position
+
+        i = int(np.searchsorted(self.horizontal, distance_meters, side="right")) - 1
+        span = self.horizontal[i + 1] - self.horizontal[i]
+        fraction = (distance_meters - self.horizontal[i]) / span if span > 0 else 0.0
+        return i + fraction
+
+    def distance_at(self, position: float) -> float:
+        """Horizontal distance from the start at a route position"""
+        return self._at(self.horizontal, position)
+
+    def elevation_at(self, position: float) -> float:
+        return self._at(self.elevation, position)
+
+    def metrics_between_distances(self, start_meters: float, end_meters: float) -> Dict:
+        """Metrics for an arbitrary range given as horizontal distances from the start"""
+        return self.metrics_between(
+            self.position_at_distance(start_meters),
+            self.position_at_distance(end_meters)
+        )
+
+
+def _prefix_sum(values: np.ndarray) -> np.ndarray:
+    return np.concatenate(([0.0], np.cumsum(values)))
+
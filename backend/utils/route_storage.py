@@ -0,0 +1,267 @@
+"""
+Compact Route Storage
+Columnar binary encoding for route coordinates, their prefix-sum profile and
+optional per-point time offsets. Decoding returns NumPy views straight over the
+stored bytes (e.g. the memoryview psycopg2 returns for a bytea column).
+
+Layout (little-endian):
+    header: magic 'URT1', uint32 point count, uint16 flags, 2 pad bytes, float64 time base
+    int32   latitude * 1e7
+    int32   longitude * 1e7
+    float32 elevation (meters)
+    float32 horizontal, distance, gain, loss   (if FLAG_PROFILE)
+    float32 seconds since the time base        (if FLAG_TIMES; NaN where missing)
+    float32 cumulative moving seconds          (if FLAG_MOVING)
+"""
+
+import hashlib
+import json
+import os
+import struct
+from typing import Dict, Hashable, List, Optional
+import numpy as np
+from utils.cache import LRUCache
+from utils.gpx_processor import (
+    parse_track_stream, SIMPLIFY_TOLERANCE_METERS, SIMPLIFY_ELEVATION_TOLERANCE_METERS,
+    STOP_SPEED_MPS, STOP_WINDOW_SECONDS
+)
+from utils.route_profile import RouteProfile
+
+MAGIC = b"URT1"
+HEADER = struct.Struct("<4sIH2xd")
+
+FLAG_PROFILE = 1
+FLAG_TIMES = 2
+FLAG_MOVING = 4
+
+# 1e-7 degrees is ~1 cm
+COORDINATE_SCALE = 1e7
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "64"))
+
+
+class StoredRoute:
+    """A decoded route; array attributes are views over the encoded bytes where possible"""
+
+    def __init__(self,
+                 lat_e7: np.ndarray,
+                 lon_e7: np.ndarray,
+                 elevation: np.ndarray,
+                 profile_arrays: Optional[List[np.ndarray]] = None,
+                 time_offsets: Optional[np.ndarray] = None,
+                 time_base: float = 0.0,
+                 moving_seconds: Optional[np.ndarray] = None):
+        self.lat_e7 = lat_e7
+        self.lon_e7 = lon_e7
+        self.elevation = elevation
+        self.profile_arrays = profile_arrays
+        self.time_offsets = time_offsets
+        self.time_base = time_base
+        self.moving_seconds = moving_seconds
+        self._profile = None
+        self._coordinates = None
+
+    @classmethod
+    def from_json(cls, route: Dict) -> "StoredRoute":
+        """Wrap a legacy {"coordinates": [[lat, lon, ele], ...]} route"""
+        coords = np.asarray(route["coordinates"], dtype=np.float64)
+        stored = cls(
+            np.round(coords[:, 0] * COORDINATE_SCALE).astype(np.int32),
+            np.round(coords[:, 1] * COORDINATE_SCALE).astype(np.int32),
+            coords[:, 2].astype(np.float32) if coords.shape[1] > 2 else np.zeros(len(coords), np.float32)
+        )
+        if route.get("profile"):
+            stored._profile = RouteProfile.from_dict(route["profile"], route["coordinates"])
+        return stored
+
+    @property
+    def point_count(self) -> int:
+        return len(self.lat_e7)
+
+    @property
+    def latitudes(self) -> np.ndarray:
+        return self.lat_e7 / COORDINATE_SCALE
+
+    @property
+    def longitudes(self) -> np.ndarray:
+        return self.lon_e7 / COORDINATE_SCALE
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        """(n, 3) float64 array of [lat, lon, ele]"""
+        if self._coordinates is None:
+            self._coordinates = np.column_stack((self.latitudes, self.longitudes, self.elevation.astype(np.float64)))
+        return self._coordinates
+
+    @property
+    def times(self) -> Optional[np.ndarray]:
+        """POSIX timestamps per point, or None if the route carries no times"""
+        if self.time_offsets is None:
+            return None
+        return self.time_base + self.time_offsets.astype(np.float64)
+
+    @property
+    def profile(self) -> RouteProfile:
+        """Prefix-sum profile, from the stored arrays or computed on first use"""
+        if self._profile is None:
+            if self.profile_arrays is not None:
+                horizontal, distance, gain, loss = self.profile_arrays
+                self._profile = RouteProfile(horizontal, distance, gain, loss, self.elevation)
+            else:
+                self._profile = RouteProfile.from_coordinates(self.coordinates)
+        return self._profile
+
+    def to_json(self, include_profile: bool = True) -> Dict:
+        """API representation matching the legacy JSON route"""
+        route = {"coordinates": np.round(self.coordinates, 7).tolist()}
+        if include_profile:
+            route["profile"] = self.profile.to_dict()
+        return route
+
+
+def encode_route(coordinates,
+                 profile: Optional[RouteProfile] = None,
+                 times: Optional[np.ndarray] = None,
+                 moving_seconds: Optional[np.ndarray] = None) -> bytes:
+    """
+    Encode [lat, lon, ele] coordinates (plus optional profile, POSIX times and
+    cumulative moving seconds) to bytes
+    """
+    coords = np.asarray(coordinates, dtype=np.float64)
+    n = len(coords)
+    flags = 0
+    time_base = 0.0
+
+    columns = [
+        np.round(coords[:, 0] * COORDINATE_SCALE).astype("<i4"),
+        np.round(coords[:, 1] * COORDINATE_SCALE).astype("<i4"),
+        (coords[:, 2] if coords.shape[1] > 2 else np.zeros(n)).astype("<f4"),
+    ]
+
+    if profile is not None:
+        flags |= FLAG_PROFILE
+        columns += [a.astype("<f4") for a in (profile.horizontal, profile.distance, profile.gain, profile.loss)]
+
+    if times is not None:
+        times = np.asarray(times, dtype=np.float64)
+        timed = times[~np.isnan(times)]
+        if len(timed):
+            flags |= FLAG_TIMES
+            time_base = float(timed[0])
+            columns.append((times - time_base).astype("<f4"))
+
+    if moving_seconds is not None:
+        flags |= FLAG_MOVING
+        columns.append(np.asarray(moving_seconds, dtype=np.float64).astype("<f4"))
+
+    return HEADER.pack(MAGIC, n, flags, time_base) + b"".join(c.tobytes() for c in columns)
+
+
+def decode_route(data) -> StoredRoute:
+    """Decode bytes/memoryview produced by encode_route without copying the arrays"""
+    buffer = memoryview(data)
+    magic, n, flags, time_base = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Unrecognized route encoding")
+
+    offset = HEADER.size
+
+    def column(dtype: str) -> np.ndarray:
+        nonlocal offset
+        values = np.frombuffer(buffer, dtype=dtype, count=n, offset=offset)
+        offset += values.nbytes
+        return values
+
+    lat_e7 = column("<i4")
+    lon_e7 = column("<i4")
+    elevation = column("<f4")
+    profile_arrays = [column("<f4") for _ in range(4)] if flags & FLAG_PROFILE else None
+    time_offsets = column("<f4") if flags & FLAG_TIMES else None
+    moving_seconds = column("<f4") if flags & FLAG_MOVING else None
+
+    return StoredRoute(lat_e7, lon_e7, elevation, profile_arrays, time_offsets, time_base, moving_seconds)
+
+
+def route_content_key(file_sha256: str, **params) -> str:
+    """
+    Content address of a parsed route: the raw upload's hash plus every
+    setting that shapes the stored result (simplification, encoding)
+    """
+    settings = {
+        "encoding": MAGIC.decode(),
+        "tolerance_meters": SIMPLIFY_TOLERANCE_METERS,
+        "elevation_tolerance_meters": SIMPLIFY_ELEVATION_TOLERANCE_METERS,
+        "stop_speed_mps": STOP_SPEED_MPS,
+        "stop_window_seconds": STOP_WINDOW_SECONDS,
+        **params
+    }
+    return hashlib.sha256(f"{file_sha256}:{json.dumps(settings, sort_keys=True)}".encode()).hexdigest()
+
+
+def parse_and_encode_track(path: str) -> Dict:
+    """
+    Parse a spooled GPX/TCX file and encode its simplified route
+    Runs in a worker process (see utils.executor), so the whole CPU-bound
+    upload pipeline stays off the event loop
+
+    Returns:
+        parse_track_stream metadata without the per-point arrays, plus
+        'start_coordinate', 'end_coordinate' and 'encoded_route' (bytes for a Route row)
+    """
+    with open(path, "rb") as stream:
+        track = parse_track_stream(stream)
+    coordinates = track.pop("coordinates")
+    times = track.pop("times")
+    moving_seconds = track.pop("moving_seconds")
+    track["start_coordinate"] = coordinates[0]
+    track["end_coordinate"] = coordinates[-1]
+    track["encoded_route"] = encode_route(
+        coordinates,
+        profile=RouteProfile.from_coordinates(coordinates),
+        times=times,
+        moving_seconds=moving_seconds
+    )
+    return track
+
+
+def route_cache_key(event) -> Hashable:
+    """
+    Cache key identifying the current planned route version of an event
+    Route rows are immutable, so their id is the version
+    """
+    if event.route_id is not None:
+        return ("route", str(event.route_id))
+    return ("event", str(event.id), str(event.updated_at or event.created_at))
+
+
+def actual_route_cache_key(event) -> Hashable:
+    """Cache key identifying the current actual (recorded) track version of an event"""
+    if event.actual_route_id is not None:
+        return ("route", str(event.actual_route_id))
+    return ("actual", str(event.id), str(event.updated_at or event.created_at))
+
+
+_route_cache = LRUCache(ROUTE_CACHE_SIZE)
+
+
+def load_event_route(event) -> Optional[StoredRoute]:
+    """
+    Planned route of an event: the binary route row, or a legacy JSON route
+    Cached by route id, so a warm cache never touches the bytea column
+    """
+    if event.route_id is not None:
+        return _route_cache.get_or_create(route_cache_key(event), lambda: decode_route(event.route.data))
+    if event.gpx_route and "coordinates" in event.gpx_route:
+        return _route_cache.get_or_create(route_cache_key(event), lambda: StoredRoute.from_json(event.gpx_route))
+    return None
+
+
+def load_actual_route(event) -> Optional[StoredRoute]:
+    """Actual (recorded) track of an event, binary or legacy JSON"""
+    if event.actual_route_id is not None:
+        return _route_cache.get_or_create(actual_route_cache_key(event),
+                                          lambda: decode_route(event.actual_route.data))
+    actual_data = event.actual_gpx_data or event.actual_tcx_data
+    if actual_data and actual_data.get("coordinates"):
+        return StoredRoute.from_json(actual_data)
+    return None
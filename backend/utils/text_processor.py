@@ -1,29 +1,116 @@
 """
 Text Processing Utilities for RAG
-Handles document chunking and embedding generation
+Handles document extraction, chunking and embedding generation
+
+Extraction yields text piece by piece (PDF pages, DOCX paragraphs and table
+rows) and the chunker (utils.chunking) consumes pieces incrementally, so a
+large document never needs its raw bytes, full text and every chunk in memory
+at the same time. Chunks are character spans into the document text.
+Large PDFs are extracted and chunked in page ranges across the process pool.
 """
 
-import tiktoken
-from typing import List, Dict
-import openai
+import math
+import os
+from contextlib import aclosing
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
 from pypdf import PdfReader
 from docx import Document as DocxDocument
 import markdown
 import io
 import re
+from utils.executor import map_cpu_bound, run_cpu_bound, CPU_POOL_WORKERS
+from utils.chunking import ChunkSpan, chunk_range, chunk_text, iter_chunk_spans, stitch_range_spans
+
+# PDFs with more pages than this are extracted in parallel page ranges
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Plain text is read and tokenized in blocks of about this many characters
+TEXT_BLOCK_CHARS = 64 * 1024
+
+# A file path (spooled upload) or the raw file bytes
+DocumentSource = Union[str, bytes]
+
+
+def _open_source(source: DocumentSource):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def pdf_page_count(source: DocumentSource) -> int:
+    """Number of pages in a PDF"""
+    try:
+        return len(PdfReader(_open_source(source)).pages)
+    except Exception as e:
+        raise Exception(f"Error extracting text from PDF: {str(e)}")
+
+
+def iter_pdf_pages(source: DocumentSource, start: int = 0, stop: int = None) -> Iterator[str]:
+    """Yield the text of each page in [start, stop), one page at a time"""
+    reader = PdfReader(_open_source(source))
+    for i in range(start, len(reader.pages) if stop is None else stop):
+        yield reader.pages[i].extract_text() + "\n\n"
+
+
+def pdf_page_ranges(page_count: int, max_tasks: int = CPU_POOL_WORKERS,
+                    pages_per_task: int = PDF_PAGES_PER_TASK) -> List[Tuple[int, int]]:
+    """
+    Split pages into contiguous ranges of at most pages_per_task pages, or into
+    max_tasks even ranges if that would take more
+    """
+    tasks = max(1, min(max_tasks, math.ceil(page_count / max(1, pages_per_task))))
+    bounds = [round(page_count * i / tasks) for i in range(tasks + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(tasks) if bounds[i] < bounds[i + 1]]
+
+
+def prepare_page_range(path: str, start: int, stop: int, first: bool, last: bool) -> Dict:
+    """
+    Extract and chunk pages [start, stop) of a PDF file (a page-range task for the process pool)
+    
+    The range is chunked on its own (see utils.chunking.chunk_range) and
+    stitch_range_spans joins consecutive ranges. Leading whitespace is stripped
+    from the first range and trailing whitespace from the last, as for the
+    whole document.
+    
+    Returns:
+        Dict with the range's 'text', its full-window 'spans' (offsets into
+        'text') and 'tail_start', where its unchunked tail begins
+    """
+    parts = []
+    
+    def collect() -> Iterator[str]:
+        for piece in _strip_pieces(iter_pdf_pages(path, start, stop), leading=first, trailing=last):
+            parts.append(piece)
+            yield piece
+    
+    try:
+        spans, tail_start = chunk_range(collect())
+    except Exception as e:
+        raise Exception(f"Error extracting text from PDF: {str(e)}")
+    return {'text': "".join(parts), 'spans': spans, 'tail_start': tail_start}
+
+
+def iter_docx_text(source: DocumentSource) -> Iterator[str]:
+    """Yield each paragraph, then each table row (cells separated by spaces)"""
+    doc = DocxDocument(_open_source(source))
+    for paragraph in doc.paragraphs:
+        yield paragraph.text + "\n"
+    for table in doc.tables:
+        for row in table.rows:
+            yield "".join(cell.text + " " for cell in row.cells) + "\n"
+
+
+def iter_text_file(path: str, block_chars: int = TEXT_BLOCK_CHARS) -> Iterator[str]:
+    """Yield a UTF-8 text file in blocks of whole lines"""
+    with open(path, encoding="utf-8", newline="") as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                return
+            yield block + f.readline()
 
 
 def extract_text_from_pdf(file_content: bytes) -> str:
     """Extract text from PDF file"""
     try:
-        pdf_file = io.BytesIO(file_content)
-        reader = PdfReader(pdf_file)
-        
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n\n"
-        
-        return text.strip()
+        return "".join(iter_pdf_pages(file_content)).strip()
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
@@ -31,21 +118,7 @@ def extract_text_from_pdf(file_content: bytes) -> str:
 def extract_text_from_docx(file_content: bytes) -> str:
     """Extract text from DOCX (Microsoft Word) file"""
     try:
-        docx_file = io.BytesIO(file_content)
-        doc = DocxDocument(docx_file)
-        
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        
-        # Also extract text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text += cell.text + " "
-                text += "\n"
-        
-        return text.strip()
+        return "".join(iter_docx_text(file_content)).strip()
     except Exception as e:
         raise Exception(f"Error extracting text from DOCX: {str(e)}")
 
@@ -73,40 +146,6 @@ def extract_text_from_markdown(file_content: bytes) -> str:
         raise Exception(f"Error extracting text from Markdown: {str(e)}")
 
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    """
-    Split text into chunks with overlap
-    
-    Args:
-        text: The text to chunk
-        chunk_size: Target chunk size in tokens (default: 500)
-        overlap: Number of overlapping tokens between chunks (default: 50)
-    
-    Returns:
-        List of text chunks
-    """
-    # Use tiktoken to count tokens (cl100k_base is used by text-embedding-3-small)
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(text)
-    
-    chunks = []
-    start = 0
-    
-    while start < len(tokens):
-        # Get chunk
-        end = start + chunk_size
-        chunk_tokens = tokens[start:end]
-        
-        # Decode back to text
-        chunk_text = encoding.decode(chunk_tokens)
-        chunks.append(chunk_text)
-        
-        # Move start position with overlap
-        start = end - overlap
-    
-    return chunks
-
-
 def generate_document_summary(text: str, max_length: int = 500) -> str:
     """
     Generate a brief summary of the document
@@ -142,19 +181,9 @@ async def generate_embeddings(texts: List[str], api_key: str) -> List[List[float
         return []
     
     try:
-        client = openai.OpenAI(api_key=api_key)
-        
-        # OpenAI allows batch embedding requests
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=texts,
-            encoding_format="float"
-        )
-        
-        # Extract embeddings in order
-        embeddings = [data.embedding for data in response.data]
-        
-        return embeddings
+        # Cached by text hash; misses go out as batched, concurrent requests with retries
+        from utils.embedding_cache import cached_embeddings
+        return await cached_embeddings(texts, api_key)
         
     except Exception as e:
         raise Exception(f"Error generating embeddings: {str(e)}")
@@ -175,65 +204,188 @@ def prepare_chunk_for_embedding(chunk_text: str, document_summary: str) -> str:
     return f"Document: {document_summary}\n\nChunk: {chunk_text}"
 
 
-async def process_document(
-    file_content: bytes,
-    filename: str,
-    api_key: str
-) -> Dict:
-    """
-    Process a document end-to-end: extract text, chunk, and generate embeddings
-    
-    Args:
-        file_content: Raw file bytes
-        filename: Original filename
-        api_key: OpenAI API key for embeddings
-    
-    Returns:
-        Dict with 'text', 'summary', 'chunks', and 'embeddings'
-    """
-    # Extract text
+def iter_document_text(path: str, filename: str) -> Iterator[str]:
+    """Yield the text of a document file piece by piece, by file type"""
     file_ext = filename.split('.')[-1].lower()
     
     if file_ext == 'pdf':
-        text = extract_text_from_pdf(file_content)
+        return iter_pdf_pages(path)
     elif file_ext == 'txt':
-        text = file_content.decode('utf-8')
+        return iter_text_file(path)
     elif file_ext == 'docx':
-        text = extract_text_from_docx(file_content)
+        return iter_docx_text(path)
     elif file_ext in ['md', 'markdown']:
-        text = extract_text_from_markdown(file_content)
+        with open(path, 'rb') as f:
+            return iter([extract_text_from_markdown(f.read())])
     else:
         raise Exception(f"Unsupported file type: {file_ext}")
+
+
+def prepare_text(pieces: Iterable[str]) -> Dict:
+    """
+    Chunk and summarize extracted text as it streams in (CPU-bound; called in
+    a worker process by prepare_document)
     
-    if not text or len(text.strip()) < 50:
+    Args:
+        pieces: Document text in order (pages, paragraphs or blocks), consumed once
+    
+    Returns:
+        Dict with 'text', 'summary' and 'spans' (ChunkSpan per chunk, offsets into 'text')
+    """
+    parts = []
+    
+    def collect() -> Iterator[str]:
+        for piece in pieces:
+            parts.append(piece)
+            yield piece
+    
+    # Chunk the same (stripped) text that is stored
+    spans = list(iter_chunk_spans(_strip_pieces(collect())))
+    text = "".join(parts).strip()
+    parts.clear()
+    return _prepared(text, spans)
+
+
+def _prepared(text: str, spans: List[ChunkSpan]) -> Dict:
+    """Summarize chunked text (raises if there is nothing to embed)"""
+    if not text or len(text) < 50:
         raise Exception("Document appears to be empty or too short")
     
     # Generate summary
     summary = generate_document_summary(text)
     
-    # Chunk the text
-    chunks = chunk_text(text)
-    
-    if not chunks:
+    if not spans:
         raise Exception("No chunks generated from document")
     
-    # Prepare chunks with context
-    chunks_with_context = [
-        prepare_chunk_for_embedding(chunk, summary)
-        for chunk in chunks
-    ]
-    
-    # Generate embeddings
-    embeddings = await generate_embeddings(chunks_with_context, api_key)
-    
-    if len(embeddings) != len(chunks):
-        raise Exception(f"Embedding count mismatch: {len(embeddings)} vs {len(chunks)}")
-    
     return {
         'text': text,
         'summary': summary,
-        'chunks': chunks,
-        'chunks_with_context': chunks_with_context,
-        'embeddings': embeddings
+        'spans': spans
     }
 
+
+def chunk_texts(prepared: Dict) -> List[str]:
+    """Text of each chunk of a prepared document"""
+    text = prepared['text']
+    return [text[span.start:span.end] for span in prepared['spans']]
+
+
+def embedding_inputs(prepared: Dict) -> List[str]:
+    """Text sent for embedding for each chunk of a prepared document (chunk plus summary)"""
+    return [prepare_chunk_for_embedding(chunk, prepared['summary']) for chunk in chunk_texts(prepared)]
+
+
+def prepare_document(path: str, filename: str) -> Dict:
+    """
+    Extract, summarize and chunk a document file in one worker process,
+    streaming its text from disk into the chunker
+    
+    Args:
+        path: Document file (e.g. a spooled upload)
+        filename: Original filename (its extension selects the extractor)
+    
+    Returns:
+        Dict with 'text', 'summary' and 'spans'
+    """
+    return prepare_text(iter_document_text(path, filename))
+
+
+async def _prepare_page_ranges(path: str, ranges: Sequence[Tuple[int, int]]) -> Dict:
+    """
+    Extract and chunk page ranges of a PDF on several workers, then stitch the
+    ranges' spans in page order
+    
+    Ranges in flight are capped at the worker count, and ranges not yet started
+    are cancelled if one fails.
+    """
+    tasks = [(path, start, stop, i == 0, i == len(ranges) - 1) for i, (start, stop) in enumerate(ranges)]
+    texts = []
+    chunked = []
+    async with aclosing(map_cpu_bound(prepare_page_range, tasks)) as results:
+        async for part in results:
+            texts.append(part['text'])
+            chunked.append((len(part['text']), part['spans'], part['tail_start']))
+    
+    text = "".join(texts)
+    del texts
+    spans = stitch_range_spans(text, chunked)
+    # Ranges are stripped at the document's edges, which only misses a fully blank edge range;
+    # spans are trimmed, so they never start inside that whitespace
+    lead = len(text) - len(text.lstrip())
+    if lead:
+        spans = [ChunkSpan(span.start - lead, span.end - lead, span.token_count) for span in spans]
+    return _prepared(text.strip(), spans)
+
+
+async def load_document(path: str, filename: str) -> Dict:
+    """
+    Extract, summarize and chunk a document file in the process pool
+    
+    PDFs longer than PDF_PAGES_PER_TASK pages are extracted and chunked in page
+    ranges on several workers at once; everything else is handled by
+    prepare_document in a single worker.
+    
+    Raises:
+        PoolSaturatedError: If the process pool backlog is full
+    """
+    if filename.split('.')[-1].lower() == 'pdf':
+        ranges = pdf_page_ranges(await run_cpu_bound(pdf_page_count, path))
+        if len(ranges) > 1:
+            return await _prepare_page_ranges(path, ranges)
+    
+    return await run_cpu_bound(prepare_document, path, filename)
+
+
+def _strip_pieces(pieces: Iterable[str], leading: bool = True, trailing: bool = True) -> Iterator[str]:
+    """
+    Stream of pieces with the leading and/or trailing whitespace of the whole
+    text removed (the same text as "".join(pieces).strip())
+    """
+    started = not leading
+    pending = ""
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        body = piece.rstrip()
+        if body:
+            yield pending + body
+            pending = piece[len(body):]
+        else:
+            pending += piece
+    # Trailing whitespace of the last non-blank piece is dropped unless kept
+    if pending and not trailing:
+        yield pending
+
+
+async def process_document(
+    path: str,
+    filename: str,
+    api_key: str
+) -> Dict:
+    """
+    Process a document end-to-end: extract text, chunk, and generate embeddings
+    Extraction and chunking run in the process pool; embedding requests run here
+    
+    Args:
+        path: Document file (e.g. a spooled upload)
+        filename: Original filename
+        api_key: OpenAI API key for embeddings
+    
+    Returns:
+        Dict with 'text', 'summary', 'spans', and 'embeddings'
+    
+    Raises:
+        PoolSaturatedError: If the process pool backlog is full
+    """
+    prepared = await load_document(path, filename)
+    
+    # Generate embeddings
+    embeddings = await generate_embeddings(embedding_inputs(prepared), api_key)
+    
+    if len(embeddings) != len(prepared['spans']):
+        raise Exception(f"Embedding count mismatch: {len(embeddings)} vs {len(prepared['spans'])}")
+    
+    return {**prepared, 'embeddings': embeddings}
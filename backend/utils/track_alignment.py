@@ -0,0 +1,151 @@
+"""
+Track Alignment
+Matches planned waypoints to a recorded (actual) track and reads true arrival,
+departure and moving times off the track's stored per-point time arrays
+"""
+
+import os
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from utils.route_index import RouteIndex
+from utils.route_storage import StoredRoute
+
+# Stops within this distance along the track of a waypoint count as stopping at it
+# (the snapped point rarely lands exactly where the runner stood)
+WAYPOINT_STOP_RADIUS_METERS = float(os.getenv("WAYPOINT_STOP_RADIUS_METERS", "100"))
+
+
+class WaypointPassage(NamedTuple):
+    """When and where the recorded track passed a waypoint"""
+    position: float  # fractional vertex index on the actual track
+    distance_from_start: float  # meters along the actual track (3D, like leg distances)
+    distance_to_track: float  # meters from the waypoint to the track
+    arrival_seconds: float  # elapsed since the track start
+    departure_seconds: float  # arrival plus any stop at the waypoint
+    moving_seconds: float  # cumulative moving time at the waypoint
+
+
+def _elapsed_seconds(track: StoredRoute) -> Optional[np.ndarray]:
+    """Seconds since the first timed point, untimed points interpolated (None without times)"""
+    times = track.times
+    if times is None:
+        return None
+    timed = np.flatnonzero(~np.isnan(times))
+    if len(timed) < 2:
+        return None
+    elapsed = np.interp(np.arange(len(times)), timed, times[timed]) - times[timed[0]]
+    return np.maximum.accumulate(elapsed)
+
+
+def _times_at_moving(moving: np.ndarray, elapsed: np.ndarray, targets: np.ndarray, first: bool) -> np.ndarray:
+    """
+    Elapsed time at which cumulative moving time reaches each target
+
+    Moving time is flat while stopped, so one target maps to a time range: the
+    first point of a flat run (arrival) or its last point (departure).
+    """
+    n = len(moving)
+    if first:
+        index = np.searchsorted(moving, targets, side="left")
+        lo, hi = np.clip(index, 1, n - 1) - 1, np.clip(index, 1, n - 1)
+        beyond = index == 0
+        edge = elapsed[0]
+    else:
+        index = np.searchsorted(moving, targets, side="right") - 1
+        lo, hi = np.clip(index, 0, n - 2), np.clip(index, 0, n - 2) + 1
+        beyond = index >= n - 1
+        edge = elapsed[-1]
+
+    span = moving[hi] - moving[lo]
+    fraction = np.divide(targets - moving[lo], span, out=np.zeros_like(span), where=span > 0)
+    result = elapsed[lo] + np.clip(fraction, 0.0, 1.0) * (elapsed[hi] - elapsed[lo])
+
+    # Exactly on a flat run: snap to its first (arrival) or last (departure) point
+    exact = moving[hi if first else lo] == targets
+    result = np.where(exact, elapsed[hi if first else lo], result)
+    # Flat from the track's start (arrival) or through its end (departure)
+    return np.where(beyond, edge, result)
+
+
+def align_waypoints(track: StoredRoute,
+                    track_index: RouteIndex,
+                    latitudes,
+                    longitudes,
+                    stop_radius_meters: float = WAYPOINT_STOP_RADIUS_METERS) -> Optional[List[WaypointPassage]]:
+    """
+    Align waypoints (in course order) to a timed track
+
+    Waypoints are snapped onto the actual track with the monotonic sequence
+    snap, so an out-and-back aid station is matched to the right pass. Arrival
+    is leaving the point stop_radius_meters before the waypoint plus the moving
+    time from there, departure likewise from the point after, so any stop within
+    the radius is time spent at the waypoint. Moving time falls back to elapsed
+    time for tracks stored without stop detection.
+
+    Returns:
+        One passage per waypoint, or None if the track has no timestamps
+    """
+    elapsed = _elapsed_seconds(track)
+    if elapsed is None or track.point_count < 2:
+        return None
+    moving = track.moving_seconds.astype(np.float64) if track.moving_seconds is not None else elapsed
+
+    snaps = track_index.snap_sequence(latitudes, longitudes)
+    profile = track.profile
+
+    def moving_at(positions) -> np.ndarray:
+        return np.array([profile.cumulative_at(moving, position) for position in positions])
+
+    along = [profile.distance_at(snap.position) for snap in snaps]
+    targets = moving_at([snap.position for snap in snaps])
+    before = moving_at([profile.position_at_distance(d - stop_radius_meters) for d in along])
+    after = moving_at([profile.position_at_distance(d + stop_radius_meters) for d in along])
+
+    arrivals = _times_at_moving(moving, elapsed, before, first=False) + (targets - before)
+    departures = _times_at_moving(moving, elapsed, after, first=True) - (after - targets)
+    departures = np.maximum(departures, arrivals)
+
+    return [
+        WaypointPassage(
+            position=snap.position,
+            distance_from_start=profile.cumulative_at(profile.distance, snap.position),
+            distance_to_track=snap.distance_to_route,
+            arrival_seconds=float(arrival),
+            departure_seconds=float(departure),
+            moving_seconds=float(target)
+        )
+        for snap, arrival, departure, target in zip(snaps, arrivals, departures, targets)
+    ]
+
+
+def leg_splits(passages: List[WaypointPassage]) -> List[Dict]:
+    """
+    Actual time per leg from consecutive waypoint passages
+
+    A leg runs from leaving the previous waypoint (the track start for the
+    first leg) to leaving this one, so like the planned legs it includes the
+    stop at its end waypoint.
+
+    Returns:
+        Per leg: 'leg_seconds', 'moving_seconds', 'stopped_seconds' (all stops
+        within the leg), 'stop_seconds' (at the end waypoint), 'distance_meters'
+        along the actual track, and 'arrival_seconds' / 'departure_seconds'
+    """
+    splits = []
+    prev_departure = prev_moving = prev_distance = 0.0
+    for passage in passages:
+        leg_seconds = max(passage.departure_seconds - prev_departure, 0.0)
+        moving_seconds = min(max(passage.moving_seconds - prev_moving, 0.0), leg_seconds)
+        splits.append({
+            "leg_seconds": leg_seconds,
+            "moving_seconds": moving_seconds,
+            "stopped_seconds": leg_seconds - moving_seconds,
+            "stop_seconds": passage.departure_seconds - passage.arrival_seconds,
+            "distance_meters": max(passage.distance_from_start - prev_distance, 0.0),
+            "arrival_seconds": passage.arrival_seconds,
+            "departure_seconds": passage.departure_seconds
+        })
+        prev_departure = passage.departure_seconds
+        prev_moving = passage.moving_seconds
+        prev_distance = passage.distance_from_start
+    return splits
@@ -0,0 +1,167 @@
+"""
+Streaming Track Parser
+Reads GPX and TCX trackpoints incrementally with iterparse, so no full
+document tree (or per-point Python objects) is ever built
+"""
+
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Optional, Tuple
+import numpy as np
+
+# Root element -> trackpoint element for each supported format
+POINT_TAGS = {
+    "gpx": "trkpt",
+    "TrainingCenterDatabase": "Trackpoint",
+}
+
+FORMAT_NAMES = {
+    "gpx": "gpx",
+    "TrainingCenterDatabase": "tcx",
+}
+
+NAN = float("nan")
+
+
+def _local_name(tag: str) -> str:
+    """Strip the XML namespace from a tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_iso_time(text: Optional[str]) -> float:
+    """
+    Parse an ISO 8601 timestamp to POSIX seconds
+    Naive times are treated as UTC; missing or invalid times return NaN
+    """
+    if not text:
+        return NAN
+    try:
+        time = datetime.fromisoformat(text.strip())
+    except ValueError:
+        return NAN
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+def _parse_float(text: Optional[str]) -> float:
+    """Parse a float, returning NaN for missing or invalid values"""
+    if text is None:
+        return NAN
+    try:
+        return float(text)
+    except ValueError:
+        return NAN
+
+
+def _read_gpx_point(elem: ET.Element) -> Optional[Tuple[float, float, float, float]]:
+    """Read lat/lon/ele/time from a GPX <trkpt>"""
+    lat = _parse_float(elem.get("lat"))
+    lon = _parse_float(elem.get("lon"))
+    if lat != lat or lon != lon:
+        return None
+
+    ele = NAN
+    time = NAN
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == "ele":
+            ele = _parse_float(child.text)
+        elif name == "time":
+            time = parse_iso_time(child.text)
+
+    return lat, lon, ele, time
+
+
+def _read_tcx_point(elem: ET.Element) -> Optional[Tuple[float, float, float, float]]:
+    """Read lat/lon/ele/time from a TCX <Trackpoint> (points without a position are skipped)"""
+    lat = lon = NAN
+    ele = NAN
+    time = NAN
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == "Position":
+            for coord in child:
+                coord_name = _local_name(coord.tag)
+                if coord_name == "LatitudeDegrees":
+                    lat = _parse_float(coord.text)
+                elif coord_name == "LongitudeDegrees":
+                    lon = _parse_float(coord.text)
+        elif name == "AltitudeMeters":
+            ele = _parse_float(child.text)
+        elif name == "Time":
+            time = parse_iso_time(child.text)
+
+    if lat != lat or lon != lon:
+        return None
+    return lat, lon, ele, time
+
+
+POINT_READERS = {
+    "gpx": _read_gpx_point,
+    "TrainingCenterDatabase": _read_tcx_point,
+}
+
+
+def read_track(stream: BinaryIO) -> Dict:
+    """
+    Stream trackpoints from a GPX or TCX file into compact array buffers
+
+    Each trackpoint element is detached from its parent as soon as it has been
+    read, so peak memory is the point buffers (32 bytes per point) regardless of
+    how large or verbose the XML is.
+
+    Args:
+        stream: Binary file-like object positioned at the start of the document
+
+    Returns:
+        Dict with 'format' ('gpx' or 'tcx') and float64 NumPy arrays
+        'lats', 'lons', 'eles' (NaN if missing) and 'times' (POSIX seconds, NaN if missing)
+    """
+    lats = array("d")
+    lons = array("d")
+    eles = array("d")
+    times = array("d")
+
+    root_name = None
+    point_tag = None
+    read_point = None
+    stack = []
+
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root_name is None:
+                root_name = _local_name(elem.tag)
+                if root_name not in POINT_TAGS:
+                    raise ValueError(f"Unsupported track file: root element <{root_name}>")
+                point_tag = POINT_TAGS[root_name]
+                read_point = POINT_READERS[root_name]
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        if _local_name(elem.tag) != point_tag:
+            continue
+
+        point = read_point(elem)
+        if point is not None:
+            lats.append(point[0])
+            lons.append(point[1])
+            eles.append(point[2])
+            times.append(point[3])
+
+        # Drop the processed point so the partial tree never grows
+        if stack:
+            stack[-1].remove(elem)
+
+    if root_name is None:
+        raise ValueError("Empty track file")
+
+    return {
+        "format": FORMAT_NAMES[root_name],
+        "lats": np.frombuffer(lats, dtype=np.float64),
+        "lons": np.frombuffer(lons, dtype=np.float64),
+        "eles": np.frombuffer(eles, dtype=np.float64),
+        "times": np.frombuffer(times, dtype=np.float64),
+    }
@@ -0,0 +1,66 @@
+"""
+Upload Spooling
+Streams uploaded files to disk so worker processes can read them by path
+"""
+
+import hashlib
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+class SpooledFile(NamedTuple):
+    path: str
+    sha256: str  # hex digest of the file content
+    size: int
+
+
+async def spool_upload(file: UploadFile) -> SpooledFile:
+    """
+    Copy an upload to a uniquely named file in UPLOAD_DIR, one chunk at a time,
+    hashing the content on the way through
+
+    Returns:
+        The spooled file (the caller is responsible for removing it)
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{suffix}")
+    digest = hashlib.sha256()
+    size = 0
+
+    async with aiofiles.open(path, "wb") as out:
+        while True:
+            chunk = await file.read(SPOOL_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            await out.write(chunk)
+
+    return SpooledFile(path, digest.hexdigest(), size)
+
+
+async def remove_spooled(path: str) -> None:
+    """Delete a spooled upload, ignoring files that are already gone"""
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@asynccontextmanager
+async def spooled_upload(file: UploadFile) -> AsyncIterator[SpooledFile]:
+    """Spool an upload to disk for the duration of the block"""
+    spooled = await spool_upload(file)
+    try:
+        yield spooled
+    finally:
+        await remove_spooled(spooled.path)